@@ -0,0 +1,447 @@
+"""Simplification des géométries préservant la topologie
+
+Remplace la chaîne `geo2topo | toposimplify | topo2geo` de topojson, en
+reprenant son principe :
+
+1. les points sont repérés sur une grille fine (1e-7 degré, environ 1 cm), ce
+   qui permet de reconnaître les points communs à plusieurs géométries ;
+2. les jonctions sont les points où les frontières se séparent, c'est-à-dire
+   les points dont les voisins ne sont pas les mêmes dans tous les anneaux où
+   ils apparaissent ;
+3. chaque anneau est découpé aux jonctions en arcs, et chaque arc est simplifié
+   avec l'algorithme de Visvalingam (aire des triangles sphériques, en
+   stéradians, comme avec `toposimplify -s`), les jonctions étant conservées.
+
+Un arc commun à deux communes (ou à une commune et son canton) est toujours
+parcouru dans le même sens avant d'être simplifié : il est donc simplifié de la
+même façon des deux côtés, et les frontières restent jointives.
+
+Les entités sont traitées par lots, en parallèle, et les deux passes (recherche
+des jonctions, puis simplification) ne gardent en mémoire que les lots en cours
+et, pour la première, un tableau d'entiers par point distinct.
+"""
+import heapq
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from sys import stderr
+
+import numpy as np
+import pyarrow as pa
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+# les clés des points sont calculées sur une grille de pas 1/PRECISION degré
+PRECISION = 10**7
+# ordonnées décalées de 90°, multipliées par PRECISION : toujours < 2^31
+DECALAGE_CLE = 1 << 31
+
+COLONNE_GEOMETRIE = "geometry"
+
+# fichiers produits par la simplification : les propriétés sont en JSON, pour
+# que communes et cantons partagent le même schéma
+SCHEMA_SIMPLIFIE = pa.schema(
+    [
+        ("objet", pa.string()),
+        ("proprietes", pa.string()),
+        (COLONNE_GEOMETRIE, pa.binary()),
+    ]
+)
+
+TAILLE_LOT = 500
+MAX_PROCESSUS = os.cpu_count() or 1
+
+RADIANS = math.pi / 180
+QUART_PI = math.pi / 4
+
+
+def aire_triangle_spherique(a, b, c):
+    """Aire d'un triangle sphérique (en stéradians), comme dans topojson"""
+    somme = 0.0
+    lambda0 = c[0] * RADIANS
+    phi0 = c[1] * RADIANS / 2 + QUART_PI
+    cos_phi0, sin_phi0 = math.cos(phi0), math.sin(phi0)
+    for x, y in (a, b, c):
+        lambda1 = x * RADIANS
+        phi1 = y * RADIANS / 2 + QUART_PI
+        d_lambda = lambda1 - lambda0
+        signe = 1 if d_lambda >= 0 else -1
+        cos_phi1, sin_phi1 = math.cos(phi1), math.sin(phi1)
+        k = sin_phi0 * sin_phi1
+        u = cos_phi0 * cos_phi1 + k * math.cos(signe * d_lambda)
+        v = k * signe * math.sin(signe * d_lambda)
+        somme += math.atan2(v, u)
+        lambda0, cos_phi0, sin_phi0 = lambda1, cos_phi1, sin_phi1
+    return abs(2 * somme)
+
+
+def aires_triangles_spheriques(coords):
+    """Version vectorisée : aires des triangles formés par les points consécutifs"""
+    lam = coords[:, 0] * RADIANS
+    phi = coords[:, 1] * RADIANS / 2 + QUART_PI
+    cos_phi, sin_phi = np.cos(phi), np.sin(phi)
+
+    somme = np.zeros(len(coords) - 2)
+    # côtés (c, a), (a, b) et (b, c) de chaque triangle (a, b, c)
+    for debut, fin in ((2, 0), (0, 1), (1, 2)):
+        i = slice(debut, len(coords) - 2 + debut)
+        j = slice(fin, len(coords) - 2 + fin)
+        d_lambda = lam[j] - lam[i]
+        signe = np.where(d_lambda >= 0, 1.0, -1.0)
+        k = sin_phi[i] * sin_phi[j]
+        u = cos_phi[i] * cos_phi[j] + k * np.cos(signe * d_lambda)
+        v = k * signe * np.sin(signe * d_lambda)
+        somme += np.arctan2(v, u)
+    return np.abs(2 * somme)
+
+
+def poids_visvalingam(coords):
+    """Poids de chaque point d'un arc selon l'algorithme de Visvalingam
+
+    Le poids d'un point est l'aire du triangle qu'il forme avec ses voisins au
+    moment où il est retiré, et jamais inférieur à celui des points retirés
+    avant lui. Les extrémités de l'arc ont un poids infini.
+    """
+    n = len(coords)
+    poids = np.full(n, np.inf)
+    if n < 3:
+        return poids
+
+    courantes = [None, *aires_triangles_spheriques(coords).tolist(), None]
+    precedents = list(range(-1, n - 1))
+    suivants = list(range(1, n + 1))
+    points = coords.tolist()
+
+    tas = [(aire, i) for i, aire in enumerate(courantes) if aire is not None]
+    heapq.heapify(tas)
+
+    maximum = 0.0
+    while tas:
+        aire, i = heapq.heappop(tas)
+        if aire != courantes[i]:
+            # entrée périmée : l'aire du point a été recalculée depuis
+            continue
+
+        maximum = max(maximum, aire)
+        poids[i] = maximum
+        courantes[i] = None
+
+        p, s = precedents[i], suivants[i]
+        suivants[p], precedents[s] = s, p
+        for j in (p, s):
+            if 0 < j < n - 1:
+                courantes[j] = aire_triangle_spherique(
+                    points[precedents[j]], points[j], points[suivants[j]]
+                )
+                heapq.heappush(tas, (courantes[j], j))
+
+    return poids
+
+
+def cles_points(coords):
+    """Renvoie la clé entière de chaque point d'un tableau de coordonnées"""
+    x = np.rint((coords[:, 0] + 180) * PRECISION).astype(np.int64)
+    y = np.rint((coords[:, 1] + 90) * PRECISION).astype(np.int64)
+    return x * DECALAGE_CLE + y
+
+
+def coordonnees(cles):
+    return np.column_stack(
+        [cles // DECALAGE_CLE / PRECISION - 180, cles % DECALAGE_CLE / PRECISION - 90]
+    )
+
+
+def polygones(geometrie):
+    if isinstance(geometrie, MultiPolygon):
+        return list(geometrie.geoms)
+    return [geometrie]
+
+
+def cles_anneau(anneau):
+    """Clés des points d'un anneau, sans point de fermeture ni doublon consécutif"""
+    cles = cles_points(np.asarray(anneau.coords))[:-1]
+    if len(cles):
+        cles = cles[np.concatenate([[True], cles[1:] != cles[:-1]])]
+    while len(cles) > 1 and cles[-1] == cles[0]:
+        cles = cles[:-1]
+    return cles
+
+
+def anneaux(geometrie):
+    for polygone in polygones(geometrie):
+        yield cles_anneau(polygone.exterior)
+        for interieur in polygone.interiors:
+            yield cles_anneau(interieur)
+
+
+def lire_arrow(chemin, taille_lot=TAILLE_LOT):
+    """Lit un fichier Arrow d'entités (voir `extraire_geometries_communes`)
+
+    :return: un itérateur de lots d'au plus `taille_lot` lignes, chacune sous
+        forme de dictionnaire, la géométrie étant en WKB
+    """
+    with pa.memory_map(str(chemin)) as source:
+        lecteur = pa.ipc.open_file(source)
+        for i in range(lecteur.num_record_batches):
+            lot = lecteur.get_batch(i)
+            for debut in range(0, lot.num_rows, taille_lot):
+                yield lot.slice(debut, taille_lot).to_pylist()
+
+
+def lire_entites(lot):
+    """Renvoie l'objet, les propriétés et la géométrie de chaque entité d'un lot"""
+    geometries = shapely.from_wkb([ligne[COLONNE_GEOMETRIE] for _, ligne in lot])
+    for (objet, ligne), geometrie in zip(lot, geometries):
+        proprietes = {k: v for k, v in ligne.items() if k != COLONNE_GEOMETRIE}
+        yield objet, proprietes, geometrie
+
+
+def voisinages(lot):
+    """Renvoie les triplets distincts (point, voisin 1, voisin 2) d'un lot d'entités"""
+    triplets = []
+    for _, _, geometrie in lire_entites(lot):
+        for cles in anneaux(geometrie):
+            if len(cles) < 3:
+                continue
+            precedents, suivants = np.roll(cles, 1), np.roll(cles, -1)
+            triplets.append(
+                np.column_stack(
+                    [
+                        cles,
+                        np.minimum(precedents, suivants),
+                        np.maximum(precedents, suivants),
+                    ]
+                )
+            )
+
+    if not triplets:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.unique(np.concatenate(triplets), axis=0)
+
+
+def trouver_jonctions(triplets):
+    """Les jonctions sont les points qui apparaissent avec plusieurs voisinages"""
+    # np.unique trie les triplets : ceux d'un même point sont consécutifs
+    points = triplets[:, 0]
+    return np.unique(points[1:][points[1:] == points[:-1]])
+
+
+def arcs_anneau(cles, jonctions):
+    """Découpe un anneau aux jonctions
+
+    :return: la liste des arcs, chacun donné par ses clés, le dernier point de
+        chaque arc étant le premier du suivant, et un booléen indiquant si
+        l'anneau n'a aucune jonction (il forme alors un unique arc fermé)
+    """
+    positions = np.flatnonzero(np.isin(cles, jonctions))
+
+    if len(positions) == 0:
+        return [np.append(cles, cles[0])], True
+
+    cles = np.roll(cles, -positions[0])
+    positions = np.append(positions - positions[0], len(cles))
+    cles = np.append(cles, cles[0])
+    return [cles[d : f + 1] for d, f in zip(positions[:-1], positions[1:])], False
+
+
+def canonique(arc, ferme):
+    """Renvoie l'arc parcouru dans le sens canonique
+
+    Un arc est parcouru de sa plus petite extrémité vers la plus grande ; un
+    arc qui part et revient à la même jonction est parcouru vers son plus petit
+    voisin. Un arc fermé, sans jonction, commence d'abord par sa plus petite
+    clé : c'est alors ce point qui est conservé comme extrémité.
+    """
+    if ferme:
+        arc = np.roll(arc[:-1], -np.argmin(arc[:-1]))
+        arc = np.append(arc, arc[0])
+
+    if arc[0] != arc[-1]:
+        inverser = arc[0] > arc[-1]
+    else:
+        inverser = arc[-2] < arc[1]
+    return arc[::-1] if inverser else arc
+
+
+class Simplificateur:
+    """Simplifie les arcs d'un lot, en gardant en cache les arcs déjà vus"""
+
+    def __init__(self, jonctions, aire_minimum):
+        self.jonctions = jonctions
+        self.aire_minimum = aire_minimum
+        self._cache = {}
+
+    def simplifier_arc(self, arc, ferme):
+        """Renvoie les clés des points conservés de l'arc"""
+        arc = canonique(arc, ferme)
+        cle = arc.tobytes()
+        if cle not in self._cache:
+            poids = poids_visvalingam(coordonnees(arc))
+            garder = poids >= self.aire_minimum
+            if arc[0] == arc[-1] and garder.sum() < 4:
+                # une boucle garde au moins ses deux points les plus importants
+                garder[np.argsort(poids[1:-1])[-2:] + 1] = True
+            self._cache[cle] = arc[garder]
+        return self._cache[cle]
+
+    def simplifier_anneau(self, cles):
+        if len(cles) < 3:
+            return None
+
+        arcs, ferme = arcs_anneau(cles, self.jonctions)
+        cles = np.concatenate(
+            [
+                arc[:-1][np.isin(arc[:-1], self.simplifier_arc(arc, ferme))]
+                for arc in arcs
+            ]
+        )
+        if len(cles) < 3:
+            return None
+        return coordonnees(np.append(cles, cles[0]))
+
+    def simplifier(self, geometrie):
+        resultat = []
+        for polygone in polygones(geometrie):
+            exterieur = self.simplifier_anneau(cles_anneau(polygone.exterior))
+            if exterieur is None:
+                continue
+            interieurs = [
+                self.simplifier_anneau(cles_anneau(interieur))
+                for interieur in polygone.interiors
+            ]
+            resultat.append(
+                Polygon(exterieur, [i for i in interieurs if i is not None])
+            )
+
+        if not resultat:
+            # la géométrie entière a disparu : on garde l'originale
+            return geometrie
+        return MultiPolygon(resultat)
+
+
+# état des processus de simplification, initialisé par `initialiser_processus`
+_simplificateur = None
+
+
+def initialiser_processus(jonctions, aire_minimum):
+    global _simplificateur
+    _simplificateur = Simplificateur(jonctions, aire_minimum)
+
+
+def simplifier_lot(lot):
+    # le cache n'est utile qu'au sein d'un lot, où les entités sont voisines
+    _simplificateur._cache.clear()
+
+    resultats = []
+    for objet, proprietes, geometrie in lire_entites(lot):
+        resultats.append(
+            {
+                "objet": objet,
+                "proprietes": json.dumps(proprietes, separators=(",", ":")),
+                COLONNE_GEOMETRIE: _simplificateur.simplifier(geometrie).wkb,
+            }
+        )
+    return resultats
+
+
+def par_lots(iterable, taille_lot=TAILLE_LOT):
+    iterateur = iter(iterable)
+    while lot := list(islice(iterateur, taille_lot)):
+        yield lot
+
+
+def lire_lots(region, objets, taille_lot=TAILLE_LOT):
+    """Découpe les fichiers Arrow d'une région en lots d'entités
+
+    :param objets: un dictionnaire associant le nom de chaque objet
+        (`communes`, `cantons`) au fichier Arrow de ses entités
+    """
+    for objet, chemin in objets.items():
+        for lot in lire_arrow(chemin, taille_lot):
+            yield region, [(objet, ligne) for ligne in lot]
+
+
+def executer(executor, fonction, lots, en_cours):
+    """Comme `executor.map`, mais avec au plus `en_cours` lots en mémoire à la fois"""
+    futures = deque()
+    for region, lot in lots:
+        futures.append((region, executor.submit(fonction, lot)))
+        if len(futures) >= en_cours:
+            region, future = futures.popleft()
+            yield region, future.result()
+    while futures:
+        region, future = futures.popleft()
+        yield region, future.result()
+
+
+def entrelacer(*iterables):
+    iterateurs = deque(iter(i) for i in iterables)
+    while iterateurs:
+        iterateur = iterateurs.popleft()
+        try:
+            yield next(iterateur)
+        except StopIteration:
+            continue
+        iterateurs.append(iterateur)
+
+
+def simplifier_regions(regions, aire_minimum, max_processus=MAX_PROCESSUS):
+    """Simplifie en parallèle les géométries de plusieurs régions
+
+    Les lots des différentes régions (métropole et outremer) sont entrelacés et
+    traités par le même ensemble de processus.
+
+    :param regions: un dictionnaire associant à chaque fichier Arrow de sortie
+        le dictionnaire des fichiers Arrow d'entrée, par objet
+    :param aire_minimum: l'aire minimale, en stéradians, des triangles
+        conservés par la simplification
+    """
+
+    def tous_les_lots():
+        return entrelacer(*(lire_lots(d, objets) for d, objets in regions.items()))
+
+    en_cours = 2 * max_processus
+
+    with ProcessPoolExecutor(max_workers=max_processus) as executor:
+        triplets = []
+        for i, (_, t) in enumerate(
+            executer(executor, voisinages, tous_les_lots(), en_cours), start=1
+        ):
+            triplets.append(t)
+            if i % 50 == 0:
+                triplets = [np.unique(np.concatenate(triplets), axis=0)]
+        jonctions = trouver_jonctions(np.unique(np.concatenate(triplets), axis=0))
+        del triplets
+        stderr.write(f"{len(jonctions)} jonctions trouvées\n")
+
+    with ExitStack() as stack, ProcessPoolExecutor(
+        max_workers=max_processus,
+        initializer=initialiser_processus,
+        initargs=(jonctions, aire_minimum),
+    ) as executor:
+        writers = {
+            dest: stack.enter_context(pa.ipc.new_file(str(dest), SCHEMA_SIMPLIFIE))
+            for dest in regions
+        }
+
+        for dest, resultats in executer(
+            executor, simplifier_lot, tous_les_lots(), en_cours
+        ):
+            writers[dest].write_batch(
+                pa.RecordBatch.from_pylist(resultats, schema=SCHEMA_SIMPLIFIE)
+            )
+
+
+def depuis_simplification(chemin, obj):
+    """Relit les entités d'un objet dans un fichier produit par `simplifier_regions`
+
+    :return: un itérateur de couples (propriétés, géométrie en WKB)
+    """
+    for lot in lire_arrow(chemin):
+        for ligne in lot:
+            if ligne["objet"] == obj:
+                yield json.loads(ligne["proprietes"]), ligne[COLONNE_GEOMETRIE]
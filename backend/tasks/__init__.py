@@ -1,7 +1,13 @@
 from doit.tools import create_folder
 
 from sources import SOURCES, SOURCE_DIR, PREPARE_DIR
-from utils import check_hash, extract_archive, extract_singlefile
+from telechargement import telecharger_tout
+from utils import (
+    cache_empreintes,
+    check_hash,
+    extract_archive,
+    extract_singlefile,
+)
 from .admin_express import *
 from .cog import *
 from .elections import *
@@ -27,23 +33,47 @@ RGB.__set__ = __rgb_set_fixed__
 
 
 def task_telecharger():
-    for source in SOURCES:
-        yield {
-            "name": str(source.path),
-            "targets": [SOURCE_DIR / source.filename],
-            "actions": [
-                (create_folder, [(SOURCE_DIR / source.filename).parent]),
-                [
-                    "curl",
-                    "--silent",
-                    "--location",
-                    "--output",
-                    SOURCE_DIR / source.filename,
-                    source.url,
-                ],
-            ],
-            "uptodate": [check_hash(SOURCE_DIR / source.filename, source.hash)],
-        }
+    """Télécharge, en parallèle, les sources absentes ou dont l'empreinte a changé"""
+    verifications = [
+        (
+            source,
+            check_hash(
+                SOURCE_DIR / source.filename,
+                source.hash,
+                verifier_apres_execution=False,
+            ),
+        )
+        for source in SOURCES
+    ]
+
+    return {
+        "targets": [SOURCE_DIR / source.filename for source in SOURCES],
+        "actions": [(telecharger_sources, [verifications])],
+        "uptodate": [verification for _, verification in verifications],
+        "params": [
+            {
+                "name": "verifier_tout",
+                "long": "verify-all",
+                "type": bool,
+                "default": False,
+                "help": "Recalcule toutes les empreintes sans utiliser le cache",
+            }
+        ],
+    }
+
+
+def telecharger_sources(verifications):
+    # doit cesse d'évaluer les conditions `uptodate` à la première qui échoue :
+    # les sources suivantes n'ont donc pas forcément été vérifiées
+    empreintes = telecharger_tout(
+        (source.url, SOURCE_DIR / source.filename, source.hash)
+        for source, verification in verifications
+        if not verification.est_valide()
+    )
+
+    # les empreintes ont été calculées au fil du téléchargement
+    for dest, empreinte in empreintes.items():
+        cache_empreintes.set(dest, empreinte)
 
 
 def task_decompresser():
@@ -1,23 +1,38 @@
 import os
 import json
 import csv
+import multiprocessing
+import queue
 import shutil
 import subprocess
 import tempfile
-from functools import reduce
+import time
 from itertools import product, groupby
 from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path, PurePath
 from tempfile import TemporaryDirectory
 
 
-import fiona
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyogrio
 from doit.tools import create_folder
-from shapely.geometry import shape, MultiPolygon
+import numpy as np
+import shapely
 from shapely import wkb
 from py7zr import SevenZipFile
 
+from simplification import (
+    COLONNE_GEOMETRIE,
+    MAX_PROCESSUS,
+    depuis_simplification,
+    executer,
+    lire_arrow,
+    par_lots,
+    simplifier_regions,
+)
 from sources import PREPARE_DIR, SOURCE_DIR, SOURCES
 from .cog import COMMUNE_TYPE_ORDERING
 from contextlib import ExitStack
@@ -27,6 +42,7 @@ __all__ = [
     "task_extraire_geometries_communes",
     "task_extraire_geometries_cantons",
     "task_simplifier_geometries",
+    "task_comparer_simplification",
     "task_trier_et_normaliser_geometries",
 ]
 
@@ -45,10 +61,26 @@ EXTRAIRE_GEOMETRIES = [*GEOMETRIES_COMMUNES, "CANTON"]
 
 EXTS = [".shp", ".cpg", ".dbf", ".prj", ".shx"]
 
+# identifiant de type de géométrie de shapely.get_type_id
+POLYGON = 3
+
+# Les géométries extraites des shapefiles sont écrites en WKB dans des fichiers
+# Arrow (format IPC), un par objet et par région
+SCHEMA_COMMUNES = pa.schema(
+    [("type", pa.string()), ("code", pa.string()), (COLONNE_GEOMETRIE, pa.binary())]
+)
+SCHEMA_CANTONS = pa.schema([("code", pa.string()), (COLONNE_GEOMETRIE, pa.binary())])
+TAILLE_LOT_ARROW = 10_000
+
+# intervalle, en secondes, entre deux relevés de mémoire de la comparaison
+INTERVALLE_MESURE = 0.2
+
 METROPOLE_QUANTIZATION = "1e5"
 OUTREMER_QUANTIZATION = "1e6"
 MIN_SPHERICAL_TRIANGLE_AREA = "1e-9"
 
+# Les paramètres de quantification et de mémoire ne servent plus qu'à la chaîne
+# topojson, conservée pour comparaison (voir `task_comparer_simplification`).
 # Il faut augmenter significativement la mémoire disponible pour pouvoir faire
 # tourner topojson
 NODE_OPTIONS = "--max_old_space_size=6000"
@@ -79,17 +111,17 @@ def task_decompresser_admin_express():
 def task_extraire_geometries_communes():
     """Extrait l'ensemble des polygones correspondant aux communes
 
-    Pour pouvoir réaliser la simplification des géométries, on sépare les
-    communes d'outremer dans un autre fichier : cela rendra la quantification du
-    fichier de métropole beaucoup plus efficace.
+    Les shapefiles sont lus par lots Arrow, et les géométries écrites en WKB
+    dans des fichiers Arrow. On sépare les communes d'outremer dans un autre
+    fichier, pour que la simplification puisse traiter les deux en parallèle.
     """
     shp_dir = PREPARE_DIR / SOURCES.ign["admin-express"]["version-cog"].path
     out_dir = PREPARE_DIR / "ign" / "admin-express"
 
     shp_config = {shp_dir / f"{g}.shp": c for g, c in GEOMETRIES_COMMUNES.items()}
     sources = [shp_dir / f"{g}{e}" for g, e in product(GEOMETRIES_COMMUNES, EXTS)]
-    metropole = out_dir / "communes_metropole.ndjson"
-    outremer = out_dir / "communes_outremer.ndjson"
+    metropole = out_dir / "communes_metropole.arrow"
+    outremer = out_dir / "communes_outremer.arrow"
 
     return {
         "file_dep": sources,
@@ -106,16 +138,16 @@ def task_extraire_geometries_communes():
 def task_extraire_geometries_cantons():
     """Extrait les polygones correspondant aux cantons
 
-    On traite séparément la métropole et l'outremer, pour faciliter la
-    quantification : il faut donc séparer les cantons dans deux fichiers.
+    Comme pour les communes, on sépare les cantons de métropole et d'outremer
+    dans deux fichiers Arrow.
     """
 
     shp_dir = PREPARE_DIR / SOURCES.ign["admin-express"]["version-cog"].path
     out_dir = PREPARE_DIR / "ign" / "admin-express"
 
     sources = [shp_dir / f"CANTON{e}" for e in EXTS]
-    metropole = out_dir / "cantons_metropole.ndjson"
-    outremer = out_dir / "cantons_outremer.ndjson"
+    metropole = out_dir / "cantons_metropole.arrow"
+    outremer = out_dir / "cantons_outremer.arrow"
 
     return {
         "file_dep": sources,
@@ -127,53 +159,54 @@ def task_extraire_geometries_cantons():
 
 
 def task_simplifier_geometries():
+    """Simplifie les géométries des communes et des cantons
+
+    La métropole et l'outremer sont traités en parallèle, par lots, et en
+    préservant la topologie : voir le module `simplification`.
+    """
     ae_dir = PREPARE_DIR / "ign" / "admin-express"
-    yield {
-        "name": "metropole",
-        "file_dep": [
-            ae_dir / "communes_metropole.ndjson",
-            ae_dir / "cantons_metropole.ndjson",
-        ],
-        "targets": [ae_dir / "topologie_metropole.csv"],
-        "actions": [
-            (
-                simplifier_geometries,
-                (
-                    ae_dir / "communes_metropole.ndjson",
-                    ae_dir / "cantons_metropole.ndjson",
-                    ae_dir / "topologie_metropole.csv",
-                    METROPOLE_QUANTIZATION,
-                ),
-            )
-        ],
+    regions = {
+        ae_dir / f"simplifie_{region}.arrow": {
+            obj: ae_dir / f"{obj}_{region}.arrow" for obj in ("communes", "cantons")
+        }
+        for region in ("metropole", "outremer")
     }
 
-    yield {
-        "name": "outremer",
-        "file_dep": [
-            ae_dir / "communes_outremer.ndjson",
-            ae_dir / "cantons_outremer.ndjson",
-        ],
-        "targets": [ae_dir / "topologie_outremer.csv"],
+    return {
+        "file_dep": [p for objets in regions.values() for p in objets.values()],
+        "targets": list(regions),
         "actions": [
-            (
-                simplifier_geometries,
-                (
-                    ae_dir / "communes_outremer.ndjson",
-                    ae_dir / "cantons_outremer.ndjson",
-                    ae_dir / "topologie_outremer.csv",
-                    OUTREMER_QUANTIZATION,
-                ),
-            )
+            (simplifier_regions, (regions, float(MIN_SPHERICAL_TRIANGLE_AREA)))
         ],
     }
 
 
+def task_comparer_simplification():
+    """Compare la simplification en Python avec la chaîne topojson (node)
+
+    Cette tâche ne fait pas partie du build : elle doit être lancée
+    explicitement (`doit comparer_simplification`) et nécessite `geo2topo`,
+    `toposimplify` et `topo2geo`. Elle affiche la durée et le pic de mémoire
+    de chaque méthode.
+    """
+    ae_dir = PREPARE_DIR / "ign" / "admin-express"
+    sources = [
+        ae_dir / f"{obj}_{region}.arrow"
+        for obj, region in product(("communes", "cantons"), ("metropole", "outremer"))
+    ]
+
+    return {
+        "file_dep": sources,
+        "actions": [(comparer_simplification, (ae_dir,))],
+        "verbosity": 2,
+    }
+
+
 def task_trier_et_normaliser_geometries():
     ae_dir = PREPARE_DIR / "ign" / "admin-express"
     sources = [
-        ae_dir / "topologie_metropole.csv",
-        ae_dir / "topologie_outremer.csv",
+        ae_dir / "simplifie_metropole.arrow",
+        ae_dir / "simplifie_outremer.arrow",
     ]
 
     yield {
@@ -223,50 +256,82 @@ def decompresser_admin_express(archive, dest_dir):
                 shutil.move(Path(d) / f, dest_dir / f.name)
 
 
-def extraire_geometries_communes(shp_config, dest_metropole, dest_outremer):
-    with open(dest_metropole, mode="w") as fm, open(dest_outremer, mode="w") as fo:
-        for shp_path, conf in shp_config.items():
-            with fiona.open(shp_path) as shp:
-                for com in shp:
-                    props = {
-                        "type": conf[0] or com["properties"]["NATURE"].strip(),
-                        "code": com["properties"][conf[1]].strip(),
-                    }
-                    feature = {
-                        "type": "Feature",
-                        "geometry": com["geometry"].__geo_interface__,
-                        "properties": props,
-                    }
-                    if props["code"][:2] in ["97", "98"]:
-                        f = fo
-                    else:
-                        f = fm
-                    json.dump(feature, f, separators=(",", ":"))
-                    f.write("\n")
-
+def lire_shapefile(shp_path, colonnes):
+    """Lit un shapefile par lots Arrow, en renommant `geometry` la colonne WKB"""
+    with pyogrio.open_arrow(
+        shp_path, columns=colonnes, batch_size=TAILLE_LOT_ARROW, use_pyarrow=True
+    ) as (meta, reader):
+        colonne_geometrie = meta["geometry_name"] or "wkb_geometry"
+        for lot in reader:
+            yield lot.rename_columns(
+                [
+                    COLONNE_GEOMETRIE if c == colonne_geometrie else c
+                    for c in lot.schema.names
+                ]
+            )
 
-def extraire_geometries_cantons(shp_path, dest_metropole, dest_outremer):
-    with dest_metropole.open("w") as fm, dest_outremer.open("w") as fo, fiona.open(
-        shp_path
-    ) as shp:
-        for canton in shp:
-            p = canton["properties"]
-            props = {"code": f'{p["INSEE_DEP"]}{p["INSEE_CAN"]}'}
-            feature = {
-                "geometry": canton.__geo_interface__["geometry"],
-                "properties": props,
-                "type": "Feature",
-            }
 
-            if len(p["INSEE_DEP"]) == 3:
-                f = fo
-            else:
-                f = fm
-            json.dump(feature, f, separators=(",", ":"))
-            f.write("\n")
+def extraire_geometries_communes(shp_config, dest_metropole, dest_outremer):
+    with pa.ipc.new_file(
+        str(dest_metropole), SCHEMA_COMMUNES
+    ) as fm, pa.ipc.new_file(str(dest_outremer), SCHEMA_COMMUNES) as fo:
+        for shp_path, (type_commune, champ_code) in shp_config.items():
+            colonnes = [champ_code] if type_commune else [champ_code, "NATURE"]
+            for lot in lire_shapefile(shp_path, colonnes):
+                code = pc.utf8_trim_whitespace(lot[champ_code].cast(pa.string()))
+                if type_commune:
+                    types = pa.array([type_commune] * lot.num_rows, pa.string())
+                else:
+                    types = pc.utf8_trim_whitespace(lot["NATURE"].cast(pa.string()))
+
+                communes = pa.record_batch(
+                    [types, code, lot[COLONNE_GEOMETRIE].cast(pa.binary())],
+                    schema=SCHEMA_COMMUNES,
+                )
+                outremer = pc.is_in(
+                    pc.utf8_slice_codeunits(code, 0, 2),
+                    value_set=pa.array(["97", "98"]),
+                )
+                fo.write_batch(communes.filter(outremer))
+                fm.write_batch(communes.filter(pc.invert(outremer)))
 
 
-def simplifier_geometries(
+def extraire_geometries_cantons(shp_path, dest_metropole, dest_outremer):
+    with pa.ipc.new_file(
+        str(dest_metropole), SCHEMA_CANTONS
+    ) as fm, pa.ipc.new_file(str(dest_outremer), SCHEMA_CANTONS) as fo:
+        for lot in lire_shapefile(shp_path, ["INSEE_DEP", "INSEE_CAN"]):
+            departement = lot["INSEE_DEP"].cast(pa.string())
+            cantons = pa.record_batch(
+                [
+                    pc.binary_join_element_wise(
+                        departement, lot["INSEE_CAN"].cast(pa.string()), ""
+                    ),
+                    lot[COLONNE_GEOMETRIE].cast(pa.binary()),
+                ],
+                schema=SCHEMA_CANTONS,
+            )
+            outremer = pc.equal(pc.utf8_length(departement), 3)
+            fo.write_batch(cantons.filter(outremer))
+            fm.write_batch(cantons.filter(pc.invert(outremer)))
+
+
+def ecrire_ndjson(source, dest):
+    """Convertit un fichier Arrow d'entités en NDJSON, l'entrée de geo2topo"""
+    with dest.open("w") as f:
+        for lot in lire_arrow(source):
+            for ligne in lot:
+                geometrie = wkb.loads(ligne.pop(COLONNE_GEOMETRIE))
+                feature = {
+                    "type": "Feature",
+                    "geometry": geometrie.__geo_interface__,
+                    "properties": ligne,
+                }
+                json.dump(feature, f, separators=(",", ":"))
+                f.write("\n")
+
+
+def simplifier_geometries_topojson(
     geometries_communes, geometries_cantons, dest_topologie, quantization
 ):
     env = {"NODE_OPTIONS": NODE_OPTIONS, "PATH": os.environ["PATH"]}
@@ -320,62 +385,199 @@ def depuis_topologie(topologie, obj):
     topo2geo.wait()
 
 
-def cle_tri(l):
-    return (COMMUNE_TYPE_ORDERING.index(l["type"]), l["code"])
+def mesurer(fonction, args, resultats):
+    """Exécute la méthode à comparer et renvoie sa durée, ou l'erreur rencontrée"""
+    debut = time.perf_counter()
+    try:
+        fonction(*args)
+    except Exception as e:
+        resultats.put(("erreur", f"{type(e).__name__}: {e}"))
+        raise
+    resultats.put(("ok", time.perf_counter() - debut))
 
 
-def nettoyer_geometrie(geom, cle):
-    s = shape(geom["geometry"])
-    if not s.is_valid:
-        # semble généralement corriger les géométries invalides Il semble s'agir
-        # généralement de géometries avec un segment d'aire nulle (i.e. un bout
-        # de polygone qui s'étend depuis un des coins avant de revenir par le
-        # même chemin). Ces géométries sont sans doute causées par la simplification
-        # de la topologie.
-        s = s.buffer(0)
+def rss_arborescence(pid):
+    """Mémoire résidente totale (en Mo) d'un processus et de ses descendants
 
-    return {
-        "properties": geom["properties"],
-        "cle": cle(geom["properties"]),
-        "shape": s,
-    }
+    Lit `/proc`, et ne fonctionne donc que sous Linux.
+    """
+    total = 0
+    a_visiter = [pid]
+    while a_visiter:
+        pid = a_visiter.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for ligne in f:
+                    if ligne.startswith("VmRSS:"):
+                        total += int(ligne.split()[1])
+            for tache in Path(f"/proc/{pid}/task").iterdir():
+                enfants = (tache / "children").read_text().split()
+                a_visiter.extend(int(e) for e in enfants)
+        except (FileNotFoundError, ProcessLookupError):
+            # le processus vient de se terminer
+            continue
+    return total / 1024
+
+
+def simplifier_avec_topojson(ae_dir, dest_dir):
+    for region, quantization in (
+        ("metropole", METROPOLE_QUANTIZATION),
+        ("outremer", OUTREMER_QUANTIZATION),
+    ):
+        topologie = dest_dir / f"topologie_{region}.json"
+        simplifier_geometries_topojson(
+            dest_dir / f"communes_{region}.ndjson",
+            dest_dir / f"cantons_{region}.ndjson",
+            topologie,
+            quantization,
+        )
+        # le décodage par topo2geo fait partie de la chaîne à comparer
+        for obj in ("communes", "cantons"):
+            for _ in depuis_topologie(topologie, obj):
+                pass
+
+
+def simplifier_en_python(ae_dir, dest_dir):
+    simplifier_regions(
+        {
+            dest_dir / f"simplifie_{region}.arrow": {
+                obj: ae_dir / f"{obj}_{region}.arrow"
+                for obj in ("communes", "cantons")
+            }
+            for region in ("metropole", "outremer")
+        },
+        float(MIN_SPHERICAL_TRIANGLE_AREA),
+    )
 
 
-def fusionner_geometries(g1, g2):
-    return {
-        "properties": {**g2["properties"], **g1["properties"]},
-        "shape": g1["shape"].union(g2["shape"]),
-    }
+def comparer_simplification(ae_dir):
+    # chaque méthode tourne dans un processus neuf, dont on relève régulièrement
+    # la mémoire totale, sous-processus compris (node ou processus de calcul)
+    contexte = multiprocessing.get_context("spawn")
+
+    lignes = []
+    with TemporaryDirectory() as d:
+        # topojson lit du NDJSON : la conversion n'est pas comptée
+        for obj, region in product(("communes", "cantons"), ("metropole", "outremer")):
+            ecrire_ndjson(
+                ae_dir / f"{obj}_{region}.arrow", Path(d) / f"{obj}_{region}.ndjson"
+            )
+
+        for nom, fonction in (
+            ("topojson (node)", simplifier_avec_topojson),
+            ("python", simplifier_en_python),
+        ):
+            resultats = contexte.Queue()
+            processus = contexte.Process(
+                target=mesurer, args=(fonction, (ae_dir, Path(d)), resultats)
+            )
+            processus.start()
+
+            pic = 0
+            while processus.is_alive():
+                pic = max(pic, rss_arborescence(processus.pid))
+                time.sleep(INTERVALLE_MESURE)
+            processus.join()
+
+            try:
+                statut, valeur = resultats.get(timeout=5)
+            except queue.Empty:
+                statut = "erreur"
+                valeur = f"arrêt sans résultat (code {processus.exitcode})"
+            if statut == "erreur":
+                raise RuntimeError(f"Échec de la méthode {nom} : {valeur}")
+            lignes.append((nom, valeur, pic))
+
+    print(f"{'méthode':<16} {'durée (s)':>10} {'pic de mémoire (Mo)':>20}")
+    for nom, duree, pic in lignes:
+        print(f"{nom:<16} {duree:>10.1f} {pic:>20.0f}")
+
+
+def cle_tri(l):
+    return (COMMUNE_TYPE_ORDERING.index(l["type"]), l["code"])
 
 
-def serialiser_geometrie(g):
-    """Prépare la géométrie pour sérialisation en csv
+def parties_polygonales(geometrie):
+    """Ne garde que les polygones d'une géométrie corrigée par `make_valid`
 
-    Aplatit l'objet properties et sérialise la géométrie shapely en WKB (hex)
+    `make_valid` peut renvoyer une collection mêlant polygones et lignes (les
+    segments d'aire nulle, généralement causés par la simplification).
     """
-    s = g["shape"]
-    if not isinstance(s, MultiPolygon):
-        s = MultiPolygon([s])
+    # deux niveaux : GeometryCollection, puis MultiPolygon
+    parties = shapely.get_parts(shapely.get_parts(geometrie))
+    return shapely.multipolygons(parties[shapely.get_type_id(parties) == POLYGON])
 
-    return {**g["properties"], "geometry": s.wkb_hex}
 
+def normaliser_lot(lot):
+    """Corrige et fusionne les géométries d'un lot de groupes
 
-def trier_et_normaliser_geometries(obj, cle, inpaths, outpath):
-    geoms = []
+    :param lot: une liste de groupes, chacun étant la liste des couples
+        (propriétés, WKB) partageant la même clé de tri
+    :return: une ligne à écrire par groupe
+    """
+    geometries = shapely.from_wkb([g for groupe in lot for _, g in groupe])
 
-    for p in inpaths:
-        geoms.extend(nettoyer_geometrie(g, cle) for g in depuis_topologie(p, obj))
+    invalides = ~shapely.is_valid(geometries)
+    geometries[invalides] = [
+        parties_polygonales(g) for g in shapely.make_valid(geometries[invalides])
+    ]
 
-    # trier en utilisant la clé précalculée par `nettoyer_geometrie`
-    geoms.sort(key=itemgetter("cle"))
+    fusions = []
+    proprietes = []
+    debut = 0
+    for groupe in lot:
+        fin = debut + len(groupe)
+        if len(groupe) == 1:
+            fusions.append(geometries[debut])
+        else:
+            fusions.append(shapely.union_all(geometries[debut:fin]))
+        debut = fin
+
+        # les propriétés des premières géométries du groupe l'emportent
+        fusion = {}
+        for p, _ in reversed(groupe):
+            fusion.update(p)
+        proprietes.append(fusion)
+
+    fusions = np.array(fusions, dtype=object)
+    polygones = shapely.get_type_id(fusions) == POLYGON
+    if polygones.any():
+        fusions[polygones] = shapely.multipolygons(
+            fusions[polygones], indices=np.arange(polygones.sum())
+        )
 
-    # fusionner géométries qui partagent la même clé et sérialiser
-    data = [
-        serialiser_geometrie(reduce(fusionner_geometries, gs))
-        for _, gs in groupby(geoms, key=itemgetter("cle"))
+    return [
+        {**p, "geometry": g}
+        for p, g in zip(proprietes, shapely.to_wkb(fusions, hex=True))
     ]
 
-    with outpath.open("w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=data[0].keys())
-        w.writeheader()
-        w.writerows(data)
+
+def trier_et_normaliser_geometries(
+    obj, cle, inpaths, outpath, max_processus=MAX_PROCESSUS
+):
+    # seules les propriétés et le WKB sont gardés en mémoire pour
+    # le tri : les géométries ne sont chargées que par les processus
+    geoms = sorted(
+        (
+            (cle(proprietes), proprietes, g)
+            for p in inpaths
+            for proprietes, g in depuis_simplification(p, obj)
+        ),
+        key=itemgetter(0),
+    )
+
+    groupes = (
+        [(proprietes, g) for _, proprietes, g in gs]
+        for _, gs in groupby(geoms, key=itemgetter(0))
+    )
+    lots = ((None, lot) for lot in par_lots(groupes))
+
+    with outpath.open("w", newline="") as f, ProcessPoolExecutor(
+        max_workers=max_processus
+    ) as executor:
+        w = None
+        for _, lignes in executer(executor, normaliser_lot, lots, 2 * max_processus):
+            if w is None:
+                w = csv.DictWriter(f, fieldnames=lignes[0].keys())
+                w.writeheader()
+            w.writerows(lignes)
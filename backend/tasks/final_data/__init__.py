@@ -1,7 +1,7 @@
 import contextlib
 import csv
 import json
-import lzma
+import os
 import re
 from datetime import datetime
 from operator import itemgetter
@@ -11,6 +11,9 @@ import pandas as pd
 from glom import glom, T, Invoke, Match, Switch, Regex, Not, Coalesce, Iter, Val
 from shapely.geometry import MultiPolygon, shape
 
+from data_france.data.compression import EXTENSIONS, nom_sans_compression, ouvrir
+from data_france.data.copie_binaire import EcrivainCopieBinaire, fichier_copie
+from data_france.data.geometries import EcrivainGeometries, fichier_geometries
 from data_france.utils import TypeNom
 from sources import BASE_DIR, SOURCE_DIR, PREPARE_DIR, SOURCES
 from tasks.admin_express import COMMUNES_GEOMETRY, CANTONS_GEOMETRY
@@ -33,29 +36,50 @@ DATA_DIR = BASE_DIR / "data_france" / "data"
 
 CTU = DATA_DIR / "ctu.csv"
 
-FINAL_REGIONS = DATA_DIR / "regions.csv.lzma"
-FINAL_DEPARTEMENTS = DATA_DIR / "departements.csv.lzma"
-FINAL_EPCI = DATA_DIR / "epci.csv.lzma"
-FINAL_COMMUNES = DATA_DIR / "communes.csv.lzma"
-FINAL_CODES_POSTAUX = DATA_DIR / "codes_postaux.csv.lzma"
-FINAL_CORRESPONDANCES_CODE_POSTAUX = DATA_DIR / "codes_postaux_communes.csv.lzma"
-FINAL_CANTONS = DATA_DIR / "cantons.csv.lzma"
-FINAL_CIRCONSCRIPTIONS_CONSULAIRES = DATA_DIR / "circonscriptions_consulaires.csv.lzma"
+# format de compression des fichiers de données : "lzma" ou "zstd" (voir
+# data_france.data.compression)
+COMPRESSION = os.environ.get("COMPRESSION", "lzma")
+EXTENSION = EXTENSIONS[COMPRESSION]
+
+FINAL_REGIONS = DATA_DIR / f"regions.csv{EXTENSION}"
+FINAL_DEPARTEMENTS = DATA_DIR / f"departements.csv{EXTENSION}"
+FINAL_EPCI = DATA_DIR / f"epci.csv{EXTENSION}"
+FINAL_COMMUNES = DATA_DIR / f"communes.csv{EXTENSION}"
+FINAL_CODES_POSTAUX = DATA_DIR / f"codes_postaux.csv{EXTENSION}"
+FINAL_CORRESPONDANCES_CODE_POSTAUX = (
+    DATA_DIR / f"codes_postaux_communes.csv{EXTENSION}"
+)
+FINAL_CANTONS = DATA_DIR / f"cantons.csv{EXTENSION}"
+FINAL_CIRCONSCRIPTIONS_CONSULAIRES = (
+    DATA_DIR / f"circonscriptions_consulaires.csv{EXTENSION}"
+)
 FINAL_CIRCONSCRIPTIONS_LEGISLATIVES = (
-    DATA_DIR / "circonscriptions_legislatives.csv.lzma"
+    DATA_DIR / f"circonscriptions_legislatives.csv{EXTENSION}"
 )
 FINAL_COLLECTIVITES_DEPARTEMENTALES = (
-    DATA_DIR / "collectivites_departementales.csv.lzma"
+    DATA_DIR / f"collectivites_departementales.csv{EXTENSION}"
+)
+FINAL_COLLECTIVITES_REGIONALES = (
+    DATA_DIR / f"collectivites_regionales.csv{EXTENSION}"
 )
-FINAL_COLLECTIVITES_REGIONALES = DATA_DIR / "collectivites_regionales.csv.lzma"
-FINAL_DEPUTES = DATA_DIR / "deputes.csv.lzma"
-FINAL_DEPUTES_EUROPEENS = DATA_DIR / "deputes_europeens.csv.lzma"
-FINAL_ELUS_MUNICIPAUX = DATA_DIR / "elus_municipaux.csv.lzma"
-FINAL_ELUS_DEPARTEMENTAUX = DATA_DIR / "elus_departementaux.csv.lzma"
-FINAL_ELUS_REGIONAUX = DATA_DIR / "elus_regionaux.csv.lzma"
+FINAL_DEPUTES = DATA_DIR / f"deputes.csv{EXTENSION}"
+FINAL_DEPUTES_EUROPEENS = DATA_DIR / f"deputes_europeens.csv{EXTENSION}"
+FINAL_ELUS_MUNICIPAUX = DATA_DIR / f"elus_municipaux.csv{EXTENSION}"
+FINAL_ELUS_DEPARTEMENTAUX = DATA_DIR / f"elus_departementaux.csv{EXTENSION}"
+FINAL_ELUS_REGIONAUX = DATA_DIR / f"elus_regionaux.csv{EXTENSION}"
 
 NULL = r"\N"
 
+# format de stockage des géométries : "wkb" pour un fichier binaire séparé
+# (voir data_france.data.geometries), "csv" pour les inclure en WKB
+# hexadécimal dans la colonne `geometry` du fichier CSV
+FORMAT_GEOMETRIES = os.environ.get("FORMAT_GEOMETRIES", "wkb")
+
+# format des fichiers de données : "csv", ou "binaire" pour produire des flux
+# COPY binaires (voir data_france.data.copie_binaire) pour les fichiers dont les
+# types de colonnes sont déclarés dans TYPES_COPIE
+FORMAT_COPIE = os.environ.get("FORMAT_COPIE", "csv")
+
 INTERIEUR_VERS_DEPARTEMENT = {
     "ZA": "971",
     "ZB": "972",
@@ -140,6 +164,94 @@ def id_from_file(path, read_only=False):
         w.writerows([*t, id] for t, id in reference.items())
 
 
+def supprimer_variantes(path, garder=None):
+    """Supprime les versions de `path` compressées dans chacun des formats
+
+    Un fichier resté d'un build précédent dans un autre format serait sinon
+    trouvé à l'import.
+    """
+    base = nom_sans_compression(path.name)
+    for extension in EXTENSIONS.values():
+        variante = path.with_name(base + extension)
+        if variante != garder:
+            variante.unlink(missing_ok=True)
+
+
+def sortie(path, mode="wt", **kwargs):
+    """Ouvre en écriture un fichier de données, compressé selon son extension"""
+    supprimer_variantes(path, garder=path)
+    return ouvrir(path, mode, **kwargs)
+
+
+def cibles_geometries(path):
+    """Renvoie les fichiers de géométries produits pour un fichier de données"""
+    if FORMAT_GEOMETRIES == "wkb":
+        return [path.with_name(fichier_geometries(path.name))]
+    return []
+
+
+def champs_csv(fieldnames):
+    if FORMAT_GEOMETRIES == "wkb":
+        return [f for f in fieldnames if f != "geometry"]
+    return list(fieldnames)
+
+
+@contextlib.contextmanager
+def sortie_geometries(path):
+    """Prépare l'écriture des géométries associées au fichier CSV `path`
+
+    Renvoie une fonction `(id, wkb_hex)` qui donne la valeur de la colonne
+    `geometry` du CSV ; au format "wkb", la géométrie est écrite dans le
+    fichier binaire et la colonne est ignorée.
+    """
+    binaire = path.with_name(fichier_geometries(path.name))
+
+    if FORMAT_GEOMETRIES != "wkb":
+        supprimer_variantes(binaire)
+        yield lambda id, wkb_hex: wkb_hex
+        return
+
+    supprimer_variantes(binaire, garder=binaire)
+    with EcrivainGeometries(binaire) as ecrivain:
+
+        def geometrie(id, wkb_hex):
+            if wkb_hex and wkb_hex != NULL:
+                ecrivain.ajouter(id, bytes.fromhex(wkb_hex))
+            return NULL
+
+        yield geometrie
+
+
+def fichier_donnees(path):
+    """Renvoie le fichier effectivement produit pour le fichier de données `path`"""
+    if FORMAT_COPIE == "binaire" and path in TYPES_COPIE:
+        return path.with_name(fichier_copie(path.name))
+    return path
+
+
+@contextlib.contextmanager
+def sortie_donnees(path, fieldnames, **kwargs):
+    """Ouvre le fichier de données `path` et renvoie un écrivain de type DictWriter
+
+    Selon `FORMAT_COPIE`, les lignes sont écrites en CSV ou en COPY binaire.
+    """
+    dest = fichier_donnees(path)
+    for variantes in [path, path.with_name(fichier_copie(path.name))]:
+        supprimer_variantes(variantes, garder=dest)
+
+    if dest == path:
+        with ouvrir(dest, "wt", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=fieldnames, **kwargs)
+            yield w
+    else:
+        with ouvrir(dest, "wb") as f:
+            w = EcrivainCopieBinaire(
+                f, {c: TYPES_COPIE[path][c] for c in fieldnames}, **kwargs
+            )
+            yield w
+            w.close()
+
+
 def task_generer_fichier_regions():
     src = REGIONS_COG
     return {
@@ -196,7 +308,10 @@ def task_generer_fichier_epci():
 def task_generer_fichier_communes():
     return {
         "file_dep": [COMMUNES_CSV, COMMUNES_GEOMETRY, MAIRIES_TRAITEES],
-        "targets": [FINAL_COMMUNES],
+        "targets": [
+            fichier_donnees(FINAL_COMMUNES),
+            *cibles_geometries(FINAL_COMMUNES),
+        ],
         "actions": [
             (
                 generer_fichier_communes,
@@ -227,7 +342,7 @@ def task_generer_fichier_codes_postaux():
 def task_generer_fichier_cantons():
     return {
         "file_dep": [CANTONS_CSV, REFERENCES_DIR / "communes.csv", CANTONS_GEOMETRY],
-        "targets": [FINAL_CANTONS],
+        "targets": [FINAL_CANTONS, *cibles_geometries(FINAL_CANTONS)],
         "actions": [
             (
                 generer_fichier_cantons,
@@ -259,7 +374,10 @@ def task_generer_fichier_circonscriptions_legislatives():
     )
     return {
         "file_dep": [source],
-        "targets": [FINAL_CIRCONSCRIPTIONS_LEGISLATIVES],
+        "targets": [
+            FINAL_CIRCONSCRIPTIONS_LEGISLATIVES,
+            *cibles_geometries(FINAL_CIRCONSCRIPTIONS_LEGISLATIVES),
+        ],
         "actions": [
             (
                 generer_fichier_circonscriptions_legislatives,
@@ -274,7 +392,7 @@ def task_generer_fichier_elus_municipaux():
     return {
         "file_dep": [source_file, COMMUNES_CSV],
         "task_dep": ["generer_fichier_communes"],
-        "targets": [FINAL_ELUS_MUNICIPAUX],
+        "targets": [fichier_donnees(FINAL_ELUS_MUNICIPAUX)],
         "actions": [
             (
                 generer_fichier_elus_municipaux,
@@ -342,7 +460,7 @@ def task_generer_fichier_deputes_europeens():
 
 
 def generer_fichier_regions(path, lzma_path):
-    with open(path, "r") as f, lzma.open(lzma_path, "wt") as l, id_from_file(
+    with open(path, "r") as f, sortie(lzma_path, "wt") as l, id_from_file(
         "regions.csv"
     ) as region_id, id_from_file("communes.csv", True) as commune_id:
         r = csv.DictReader(f)
@@ -363,7 +481,7 @@ def generer_fichier_regions(path, lzma_path):
 
 
 def generer_fichier_departements(path, lzma_path):
-    with open(path, "r") as f, lzma.open(lzma_path, "wt") as l, id_from_file(
+    with open(path, "r") as f, sortie(lzma_path, "wt") as l, id_from_file(
         "departements.csv"
     ) as departement_id, id_from_file("regions.csv", True) as region_id, id_from_file(
         "communes.csv", True
@@ -387,7 +505,7 @@ def generer_fichier_departements(path, lzma_path):
 
 
 def generer_fichier_collectivites_departementales(col_dep_path, lzma_path):
-    with open(col_dep_path) as f, lzma.open(lzma_path, "wt") as l, id_from_file(
+    with open(col_dep_path) as f, sortie(lzma_path, "wt") as l, id_from_file(
         "collectivites_departementales.csv"
     ) as id_coldep, id_from_file("regions.csv", read_only=True) as id_region:
         r = csv.DictReader(f)
@@ -443,11 +561,11 @@ def generer_fichier_collectivites_regionales(reg_path, ctu_path, lzma_path):
         }
     )
 
-    with lzma.open(lzma_path, "wb") as l:
+    with sortie(lzma_path, "wt", newline="") as l:
         colreg.to_csv(l, index=False)
 
 def generer_fichier_epci(path, lzma_path):
-    with open(path, "r") as f, lzma.open(lzma_path, "wt") as l, id_from_file(
+    with open(path, "r") as f, sortie(lzma_path, "wt") as l, id_from_file(
         "epci.csv"
     ) as get_id:
         r = csv.DictReader(f)
@@ -478,6 +596,29 @@ COMMUNES_FIELDS = [
     "mairie_site",
 ]
 
+# types des colonnes, tels que nommés par la fonction format_type de PostgreSQL
+COMMUNES_TYPES = {
+    "id": "integer",
+    "code": "character varying",
+    "type": "character varying",
+    "nom": "character varying",
+    "type_nom": "smallint",
+    "population_municipale": "integer",
+    "population_cap": "integer",
+    "departement_id": "integer",
+    "commune_parent_id": "integer",
+    "epci_id": "integer",
+    "geometry": "geography",
+    "mairie_adresse": "text",
+    "mairie_accessibilite": "character varying",
+    "mairie_accessibilite_details": "text",
+    "mairie_localisation": "geography",
+    "mairie_horaires": "jsonb",
+    "mairie_email": "character varying",
+    "mairie_telephone": "character varying",
+    "mairie_site": "character varying",
+}
+
 
 def _joiner_generator(r: csv.DictReader, key):
     current_entry = next(r)
@@ -503,15 +644,17 @@ def generer_fichier_communes(communes, communes_geo, mairies, dest):
 
     with open(communes, "r", newline="") as fc, open(
         communes_geo, "r", newline=""
-    ) as fg, open(mairies, "r", newline="") as fm, lzma.open(
-        dest, "wt"
-    ) as fl, id_from_file(
+    ) as fg, open(mairies, "r", newline="") as fm, sortie_donnees(
+        dest, champs_csv(COMMUNES_FIELDS), extrasaction="ignore"
+    ) as w, id_from_file(
         "communes.csv"
     ) as commune_id, id_from_file(
         "epci.csv", True
     ) as epci_id, id_from_file(
         "departements.csv", True
-    ) as departement_id:
+    ) as departement_id, sortie_geometries(
+        dest
+    ) as geometrie:
         rc = csv.DictReader(fc)
         rg = csv.DictReader(fg)
         rm = csv.DictReader(fm)
@@ -521,17 +664,17 @@ def generer_fichier_communes(communes, communes_geo, mairies, dest):
         next(geometry_cr)
         next(mairie_cr)
 
-        w = csv.DictWriter(fl, fieldnames=COMMUNES_FIELDS)
         w.writeheader()
 
         for commune in rc:
             k = commune_key(commune)
             geometry = geometry_cr.send(k)
             mairie = mairie_cr.send(k)
+            id = commune_id(type=commune["type"], code=commune["code"])
 
             w.writerow(
                 {
-                    "id": commune_id(type=commune["type"], code=commune["code"]),
+                    "id": id,
                     "code": commune["code"],
                     "type": commune["type"],
                     "nom": commune["nom"],
@@ -549,7 +692,7 @@ def generer_fichier_communes(communes, communes_geo, mairies, dest):
                     "epci_id": epci_id(code=commune["epci"])
                     if commune["epci"]
                     else NULL,
-                    "geometry": geometry.get("geometry", NULL),
+                    "geometry": geometrie(id, geometry.get("geometry", NULL)),
                     "mairie_adresse": mairie.get("adresse"),
                     "mairie_accessibilite": mairie.get("accessibilite"),
                     "mairie_accessibilite_details": mairie.get("accessibilite_details"),
@@ -593,7 +736,7 @@ def generer_fichiers_codes_postaux(
     with id_from_file("codes_postaux.csv") as id_code_postal, id_from_file(
         "communes.csv"
     ) as id_commune:
-        with lzma.open(final_code_postal, "wt", newline="") as fl:
+        with sortie(final_code_postal, "wt", newline="") as fl:
             w = csv.DictWriter(fl, fieldnames=["id", "code"])
             w.writeheader()
 
@@ -602,7 +745,7 @@ def generer_fichiers_codes_postaux(
                 for code in codes_postaux["Code_postal"].unique()
             )
 
-        with lzma.open(final_corr, "wt", newline="") as fl:
+        with sortie(final_corr, "wt", newline="") as fl:
             w = csv.DictWriter(fl, fieldnames=["codepostal_id", "commune_id"])
             w.writeheader()
 
@@ -631,9 +774,11 @@ def generer_fichier_cantons(
         cantons,
     ) as f_cantons, open(
         geometries
-    ) as f_geometries, lzma.open(
+    ) as f_geometries, sortie(
         final_cantons, "wt", newline=""
-    ) as fl:
+    ) as fl, sortie_geometries(
+        final_cantons
+    ) as geometrie:
         r = csv.DictReader(f_cantons)
         gr = csv.DictReader(f_geometries)
         gj = _joiner_generator(gr, itemgetter("code"))
@@ -641,17 +786,19 @@ def generer_fichier_cantons(
 
         w = csv.DictWriter(
             fl,
-            fieldnames=[
-                "id",
-                "code",
-                "type",
-                "composition",
-                "nom",
-                "type_nom",
-                "departement_id",
-                "bureau_centralisateur_id",
-                "geometry",
-            ],
+            fieldnames=champs_csv(
+                [
+                    "id",
+                    "code",
+                    "type",
+                    "composition",
+                    "nom",
+                    "type_nom",
+                    "departement_id",
+                    "bureau_centralisateur_id",
+                    "geometry",
+                ]
+            ),
             extrasaction="ignore",
         )
         w.writeheader()
@@ -667,7 +814,10 @@ def generer_fichier_cantons(
                 else r"\N",
                 "departement_id": departement_id(code=canton["departement"]),
                 "composition": canton["composition"] or r"\N",
-                "geometry": gj.send(canton["code"]).get("geometry", NULL),
+                "geometry": geometrie(
+                    canton_id(code=canton["code"]),
+                    gj.send(canton["code"]).get("geometry", NULL),
+                ),
             }
             for canton in r
         )
@@ -675,7 +825,7 @@ def generer_fichier_cantons(
 
 def generer_fichier_circonscriptions_consulaires(source, dest):
     """Le fichier source a été généré à partir de l'arrêté ministériel"""
-    with open(source, "r") as f_in, lzma.open(dest, "wt") as f_out:
+    with open(source, "r") as f_in, sortie(dest, "wt") as f_out:
         reader = csv.DictReader(f_in, delimiter=";")
         writer = csv.DictWriter(
             f_out,
@@ -733,11 +883,14 @@ def generer_fichier_circonscriptions_legislatives(source, dest):
             "geometry": ("geometry", geometrie_circonscription),
         }
 
-        with lzma.open(dest, "wt") as f:
-            w = csv.DictWriter(f, fieldnames=spec)
+        with sortie(dest, "wt") as f, sortie_geometries(dest) as geometrie:
+            w = csv.DictWriter(f, fieldnames=champs_csv(spec), extrasaction="ignore")
             w.writeheader()
             w.writerows(
-                sorted(glom(circos["features"], [spec]), key=itemgetter("code"))
+                {**c, "geometry": geometrie(c["id"], c["geometry"])}
+                for c in sorted(
+                    glom(circos["features"], [spec]), key=itemgetter("code")
+                )
             )
 
             for i in range(1, 12):
@@ -760,38 +913,41 @@ def normaliser_date(d):
     return d.strftime("%Y-%m-%d")
 
 
+ELUS_MUNICIPAUX_TYPES = {
+    "id": "integer",
+    "commune_id": "integer",
+    "nom": "character varying",
+    "prenom": "character varying",
+    "sexe": "character varying",
+    "date_naissance": "date",
+    "profession": "smallint",
+    "date_debut_mandat": "date",
+    "fonction": "character varying",
+    "ordre_fonction": "smallint",
+    "date_debut_fonction": "date",
+    "date_debut_mandat_epci": "date",
+    "fonction_epci": "character varying",
+    "date_debut_fonction_epci": "date",
+    "nationalite": "character varying",
+    "parrainage2017": "character varying",
+}
+
+TYPES_COPIE = {
+    FINAL_COMMUNES: COMMUNES_TYPES,
+    FINAL_ELUS_MUNICIPAUX: ELUS_MUNICIPAUX_TYPES,
+}
+
+
 def generer_fichier_elus_municipaux(elus_municipaux, communes, final_elus):
     coms = pd.read_csv(communes, usecols=["type", "code"], dtype={"code": str})
     coms = set(coms[coms.type == "COM"]["code"])
 
     with id_from_file("communes.csv", read_only=True) as id_commune, id_from_file(
         "elus_municipaux.csv"
-    ) as id_elu, open(elus_municipaux, newline="") as f, lzma.open(
-        final_elus, "wt", newline=""
-    ) as fl:
+    ) as id_elu, open(elus_municipaux, newline="") as f, sortie_donnees(
+        final_elus, list(ELUS_MUNICIPAUX_TYPES)
+    ) as w:
         r = csv.DictReader(f)
-
-        w = csv.DictWriter(
-            fl,
-            fieldnames=[
-                "id",
-                "commune_id",
-                "nom",
-                "prenom",
-                "sexe",
-                "date_naissance",
-                "profession",
-                "date_debut_mandat",
-                "fonction",
-                "ordre_fonction",
-                "date_debut_fonction",
-                "date_debut_mandat_epci",
-                "fonction_epci",
-                "date_debut_fonction_epci",
-                "nationalite",
-                "parrainage2017",
-            ],
-        )
         w.writeheader()
 
         for l in r:
@@ -840,7 +996,7 @@ MISSING_ELU_CODE_DEP = {
 def generer_fichier_elus_departementaux(source, dest):
     with id_from_file("cantons.csv") as id_canton, id_from_file(
         "elus_departementaux.csv"
-    ) as id_elu, source.open("r") as i, lzma.open(dest, "wt") as d:
+    ) as id_elu, source.open("r") as i, sortie(dest, "wt") as d:
         r = csv.DictReader(i)
         w = csv.DictWriter(
             d,
@@ -897,7 +1053,7 @@ def generer_fichier_elus_regionaux(source, ctu_path, dest):
         "collectivites_departementales.csv"
     ) as id_coldep, id_from_file("elus_regionaux.csv") as id_elu, source.open(
         "r"
-    ) as i, lzma.open(
+    ) as i, sortie(
         dest, "wt"
     ) as d:
         r = csv.DictReader(i, delimiter=',')
@@ -1002,7 +1158,7 @@ def generer_fichier_deputes(
         deputes_partis, on=["code"]
     )
 
-    with lzma.open(dest, "wt") as f, id_from_file(
+    with sortie(dest, "wt") as f, id_from_file(
         "circonscriptions_legislatives.csv"
     ) as id_circos, id_from_file("deputes.csv") as id_deputes:
         spec = {
@@ -1033,7 +1189,7 @@ def generer_fichier_deputes(
 
 
 def generer_fichiers_deputes_europeens(source, dest):
-    with open(source) as s_fd, lzma.open(dest, "wt") as d_fd, id_from_file(
+    with open(source) as s_fd, sortie(dest, "wt") as d_fd, id_from_file(
         "deputes_europeens.csv"
     ) as id:
         r = csv.DictReader(s_fd)
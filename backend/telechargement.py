@@ -0,0 +1,149 @@
+"""Téléchargement des sources
+
+Les sources sont téléchargées en parallèle, au plus `MAX_TELECHARGEMENTS` à la
+fois. Chaque fichier est d'abord écrit dans un fichier partiel (`<nom>.part`),
+renommé une fois le téléchargement terminé et vérifié : un téléchargement
+interrompu reprend là où il s'était arrêté, à l'aide d'une requête HTTP
+`Range`, si le serveur le permet. Une plage qui ne commence ni au début du
+fichier ni là où elle a été demandée est refusée, et le fichier est alors
+téléchargé à nouveau en entier.
+
+L'empreinte SHA-256 est calculée au fil du téléchargement, sans relire le
+fichier une fois celui-ci terminé.
+
+Rien n'est propre aux serveurs des sources : pour tester, il suffit de servir
+un dossier en local (`python -m http.server`, par exemple, qui ne gère pas les
+requêtes `Range` et oblige donc à reprendre au début) et d'appeler
+:py:func:`telecharger` sur ses URL.
+"""
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from sys import stderr
+
+import requests
+
+MAX_TELECHARGEMENTS = 4
+
+TAILLE_BLOC = 1 << 20
+
+# délais de connexion et de lecture, en secondes
+DELAIS = (30, 300)
+
+RE_CONTENT_RANGE = re.compile(r"bytes (\d+)-")
+RE_TAILLE_TOTALE = re.compile(r"bytes \*/(\d+)")
+
+
+class EmpreinteIncorrecte(Exception):
+    pass
+
+
+class PlageIncorrecte(Exception):
+    pass
+
+
+def fichier_partiel(dest: Path):
+    return dest.with_name(dest.name + ".part")
+
+
+def telecharger(
+    url, dest: Path, empreinte=None, session=None, taille_bloc=TAILLE_BLOC
+):
+    """Télécharge `url` dans `dest`, en reprenant un éventuel téléchargement interrompu
+
+    :param empreinte: l'empreinte SHA-256 attendue ; si elle ne correspond
+        pas, le fichier partiel est supprimé et :py:class:`EmpreinteIncorrecte`
+        est levée
+    :return: l'empreinte SHA-256 du fichier téléchargé
+    """
+    session = session or requests.Session()
+    partiel = fichier_partiel(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+
+    # l'empreinte de la partie déjà téléchargée doit être calculée pour
+    # pouvoir poursuivre le calcul au fil du téléchargement
+    hasher = hashlib.sha256()
+    debut = 0
+    if partiel.exists():
+        with partiel.open("rb") as f:
+            while bloc := f.read(taille_bloc):
+                hasher.update(bloc)
+                debut += len(bloc)
+
+    while True:
+        entetes = {"Range": f"bytes={debut}-"} if debut else {}
+        with session.get(url, headers=entetes, stream=True, timeout=DELAIS) as r:
+            if r.status_code == 416:
+                # le fichier partiel n'est complet que s'il a la taille annoncée
+                total = RE_TAILLE_TOTALE.match(r.headers.get("Content-Range", ""))
+                if total and int(total.group(1)) == debut:
+                    break
+            else:
+                r.raise_for_status()
+
+                # seule une réponse complète, ou une plage commençant au début
+                # ou à la fin du fichier partiel, peut être écrite
+                depart = 0
+                if r.status_code == 206:
+                    plage = RE_CONTENT_RANGE.match(r.headers.get("Content-Range", ""))
+                    depart = int(plage.group(1)) if plage else None
+
+                if depart in (0, debut):
+                    if depart == 0:
+                        hasher = hashlib.sha256()
+                    with partiel.open("ab" if depart else "wb") as f:
+                        for bloc in r.iter_content(taille_bloc):
+                            hasher.update(bloc)
+                            f.write(bloc)
+                    break
+
+        # réponse inattendue : on recommence au début, sans requête Range
+        if not debut:
+            raise PlageIncorrecte(
+                f"Réponse inattendue pour '{url}' : {r.status_code} "
+                f"{r.headers.get('Content-Range', '')}"
+            )
+        debut = 0
+        hasher = hashlib.sha256()
+
+    digest = hasher.hexdigest()
+    if empreinte is not None and digest != empreinte:
+        partiel.unlink()
+        raise EmpreinteIncorrecte(
+            f"Hash incorrect pour '{dest}', obtenu {digest} au lieu de {empreinte}"
+        )
+
+    partiel.replace(dest)
+    return digest
+
+
+def telecharger_tout(telechargements, max_telechargements=MAX_TELECHARGEMENTS):
+    """Télécharge en parallèle une liste de fichiers
+
+    :param telechargements: des triplets (url, destination, empreinte)
+    :return: l'empreinte SHA-256 de chaque fichier téléchargé, par destination
+    :raises RuntimeError: si au moins un téléchargement a échoué, une fois
+        tous les autres terminés
+    """
+    empreintes = {}
+    erreurs = []
+    with ThreadPoolExecutor(max_workers=max_telechargements) as executor:
+        futures = {
+            executor.submit(telecharger, url, dest, empreinte): dest
+            for url, dest, empreinte in telechargements
+        }
+        for future in as_completed(futures):
+            dest = futures[future]
+            try:
+                empreintes[dest] = future.result()
+            except Exception as e:
+                erreurs.append(f"{dest} : {e}")
+                stderr.write(f"Échec du téléchargement de {dest}\n")
+            else:
+                stderr.write(f"{dest} téléchargé\n")
+
+    if erreurs:
+        raise RuntimeError("\n".join(["Téléchargements en échec :", *erreurs]))
+
+    return empreintes
@@ -1,4 +1,6 @@
 import hashlib
+import json
+import os
 import re
 import unicodedata
 from collections import deque
@@ -7,27 +9,109 @@ from zipfile import ZipFile
 
 import pandas as pd
 
+from sources import PREPARE_DIR
+
 BLOCKSIZE = 65536
 
+# avec VERIFIER_EMPREINTES=1, les empreintes sont toujours recalculées
+VERIFIER_EMPREINTES = bool(os.environ.get("VERIFIER_EMPREINTES"))
+
+
+class CacheEmpreintes:
+    """Cache persistant des empreintes SHA-256 des fichiers sources
+
+    Une empreinte n'est réutilisée que si le fichier a gardé la même taille, la
+    même date de modification et le même inode que lors de son calcul.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._empreintes = None
+
+    @staticmethod
+    def _cle(stat):
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def _charger(self):
+        if self._empreintes is None:
+            try:
+                with self.path.open() as f:
+                    self._empreintes = json.load(f)
+            except (OSError, ValueError):
+                self._empreintes = {}
+        return self._empreintes
+
+    def get(self, filename: Path):
+        entree = self._charger().get(str(filename.resolve()))
+        try:
+            stat = filename.stat()
+        except FileNotFoundError:
+            return None
+        if entree is not None and entree["cle"] == self._cle(stat):
+            return entree["empreinte"]
+        return None
+
+    def set(self, filename: Path, digest):
+        self._charger()[str(filename.resolve())] = {
+            "cle": self._cle(filename.stat()),
+            "empreinte": digest,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporaire = self.path.with_name(self.path.name + ".tmp")
+        with temporaire.open("w") as f:
+            json.dump(self._empreintes, f, indent=1)
+        temporaire.replace(self.path)
+
+
+cache_empreintes = CacheEmpreintes(PREPARE_DIR / "empreintes.json")
+
+
+def calculer_empreinte(filename: Path):
+    hasher = hashlib.new("sha256")
+
+    with filename.open("rb") as f:
+        buf = f.read(BLOCKSIZE)
+        while buf:
+            hasher.update(buf)
+            buf = f.read(BLOCKSIZE)
+
+    return hasher.hexdigest()
+
 
 class check_hash:
-    def __init__(self, filename: Path, hash_digest):
+    def __init__(self, filename: Path, hash_digest, verifier_apres_execution=True):
         self.filename = filename
         self.hash_digest = hash_digest
+        # inutile quand l'action vérifie déjà l'empreinte elle-même
+        self.verifier_apres_execution = verifier_apres_execution
+        self.verifier_tout = VERIFIER_EMPREINTES
+        self.valide = None
 
     def _check(self):
-        hasher = hashlib.new("sha256")
+        self.valide = self._compute()
+        return self.valide
 
+    def est_valide(self):
+        """Indique si le fichier a l'empreinte attendue
+
+        L'empreinte n'est pas vérifiée à nouveau si doit l'a déjà fait.
+        """
+        if self.valide is None:
+            self._check()
+        return self.valide
+
+    def _compute(self):
         if not self.filename.exists():
             return False
 
-        with self.filename.open("rb") as f:
-            buf = f.read(BLOCKSIZE)
-            while buf:
-                hasher.update(buf)
-                buf = f.read(BLOCKSIZE)
+        self.computed_digest = None
+        if not self.verifier_tout:
+            self.computed_digest = cache_empreintes.get(self.filename)
+
+        if self.computed_digest is None:
+            self.computed_digest = calculer_empreinte(self.filename)
+            cache_empreintes.set(self.filename, self.computed_digest)
 
-        self.computed_digest = hasher.hexdigest()
         return self.computed_digest == self.hash_digest
 
     def _check_after_run(self):
@@ -39,7 +123,10 @@ class check_hash:
         return {}
 
     def __call__(self, task, values):
-        task.value_savers.append(self._check_after_run)
+        if (task.options or {}).get("verifier_tout"):
+            self.verifier_tout = True
+        if self.verifier_apres_execution:
+            task.value_savers.append(self._check_after_run)
         return self._check()
 
 
@@ -0,0 +1,41 @@
+"""Mesures de performance, hors de la suite de tests
+
+Chaque mesure se lance depuis la racine du dépôt, par exemple avec
+`python -m bench.compression`. Celles qui lisent la base de données utilisent
+la base configurée par `DATABASE_URL` (voir `test/django_settings.py`), dans
+laquelle les données doivent avoir été importées au préalable avec
+`./manage.py update_data_france`.
+"""
+import os
+import time
+import tracemalloc
+
+import django
+import dotenv
+
+
+def initialiser():
+    dotenv.load_dotenv()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test.django_settings")
+    django.setup()
+
+
+def mesurer(fonction):
+    """Renvoie la durée d'exécution de la fonction et son pic de mémoire Python"""
+    tracemalloc.start()
+    try:
+        debut = time.perf_counter()
+        fonction()
+        duree = time.perf_counter() - debut
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return duree, pic
+
+
+def afficher_tableau(entetes, lignes):
+    largeurs = [
+        max(len(str(l[i])) for l in [entetes, *lignes]) for i in range(len(entetes))
+    ]
+    for ligne in [entetes, *lignes]:
+        print("  ".join(f"{str(c):<{l}}" for c, l in zip(ligne, largeurs)))
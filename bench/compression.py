@@ -0,0 +1,57 @@
+"""Compare taille et durée de décompression des fichiers du paquet par format
+
+Nécessite le paquet `zstandard` (extra `zstd` de data-france).
+"""
+import io
+import lzma
+import time
+from importlib.resources import files
+
+from bench import afficher_tableau, initialiser
+
+
+def main():
+    initialiser()
+
+    import zstandard
+
+    from data_france.data.compression import (
+        nom_sans_compression,
+        ouvrir,
+        ouvrir_donnees,
+    )
+
+    fichiers = sorted(
+        {
+            nom_sans_compression(nom)
+            for nom in (f.name for f in files("data_france.data").iterdir())
+            if nom != nom_sans_compression(nom)
+        }
+    )
+    formats = {
+        "lzma": lambda contenu: lzma.compress(contenu, preset=6),
+        "zstd 3": zstandard.ZstdCompressor(level=3).compress,
+        "zstd 19": zstandard.ZstdCompressor(level=19).compress,
+    }
+
+    lignes = []
+    for fichier in fichiers:
+        with ouvrir_donnees(fichier) as f:
+            contenu = f.read()
+
+        colonnes = []
+        for compresser in formats.values():
+            compresse = compresser(contenu)
+            debut = time.perf_counter()
+            with ouvrir(io.BytesIO(compresse)) as f:
+                if f.read() != contenu:
+                    raise RuntimeError(f"{fichier} : décompression incorrecte")
+            duree = time.perf_counter() - debut
+            colonnes.append(f"{len(compresse) >> 10} Ko, {duree * 1000:.0f} ms")
+        lignes.append([fichier, *colonnes])
+
+    afficher_tableau(["fichier", *formats], lignes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compare les durées d'import des formats CSV et COPY binaire
+
+Les communes et les élus municipaux sont réimportés deux fois dans la base : une
+fois depuis le CSV du paquet, une fois depuis sa transcription en COPY binaire.
+"""
+import io
+import time
+
+from bench import afficher_tableau, initialiser
+
+TYPES_COLONNES_SQL = """
+    SELECT attname, format_type(atttypid, NULL)
+    FROM pg_attribute
+    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+"""
+
+
+def main():
+    initialiser()
+
+    from django.db import connection, transaction
+
+    from data_france.data import import_with_temp_table
+    from data_france.data.compression import ouvrir_donnees
+    from data_france.data.copie_binaire import transcrire_csv
+
+    lignes = []
+    for fichier, table in [
+        ("communes.csv.lzma", "data_france_commune"),
+        ("elus_municipaux.csv.lzma", "data_france_elumunicipal"),
+    ]:
+        with ouvrir_donnees(fichier, "rt") as f:
+            contenu = f.read()
+        with connection.cursor() as cursor:
+            cursor.execute(TYPES_COLONNES_SQL, [table])
+            types = dict(cursor.fetchall())
+        binaire = io.BytesIO()
+        transcrire_csv(io.StringIO(contenu), binaire, types)
+
+        for format, f, taille, options in [
+            ("CSV", io.StringIO(contenu), len(contenu.encode()), {}),
+            (
+                "binaire",
+                io.BytesIO(binaire.getvalue()),
+                len(binaire.getvalue()),
+                {"binaire": True},
+            ),
+        ]:
+            debut = time.perf_counter()
+            with transaction.atomic():
+                import_with_temp_table(f, table, using=None, **options)
+            duree = time.perf_counter() - debut
+            lignes.append([fichier, format, f"{duree:.2f} s", f"{taille >> 20} Mo"])
+
+    afficher_tableau(["fichier", "format", "durée", "taille"], lignes)
+
+
+if __name__ == "__main__":
+    main()
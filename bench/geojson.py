@@ -0,0 +1,67 @@
+"""Compare la sérialisation directe du GeoJSON à l'aller-retour `json.loads` →
+`JsonResponse`, sur la géométrie la plus lourde des départements et des régions
+"""
+import json
+
+from bench import afficher_tableau, initialiser, mesurer
+
+
+def main():
+    initialiser()
+
+    from django.db.models import Func, IntegerField
+    from django.http import JsonResponse
+    from django.test import RequestFactory
+
+    from data_france.models import Departement, Region
+    from data_france.views import DepartementParCodeView, RegionParCodeView
+
+    factory = RequestFactory()
+    lignes = []
+    for model, view_class in [
+        (Departement, DepartementParCodeView),
+        (Region, RegionParCodeView),
+    ]:
+        instance = (
+            model.objects.annotate(
+                taille=Func(
+                    "geometry",
+                    template="ST_NPoints(%(expressions)s::geometry)",
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("-taille")
+            .first()
+        )
+        view = view_class.as_view()
+
+        def aller_retour():
+            i = model.objects.get(pk=instance.pk)
+            JsonResponse(
+                {
+                    "type": "Feature",
+                    "properties": i.as_dict(),
+                    "geometry": json.loads(i.geometry.geojson),
+                }
+            )
+
+        def direct():
+            req = factory.get("/", {"code": instance.code, "geojson": "true"})
+            b"".join(view(req).streaming_content)
+
+        for methode, fonction in [("aller-retour", aller_retour), ("direct", direct)]:
+            duree, pic = mesurer(fonction)
+            lignes.append(
+                [
+                    f"{model.__name__} {instance.code}",
+                    methode,
+                    f"{duree * 1000:.1f} ms",
+                    f"{pic >> 10} Kio",
+                ]
+            )
+
+    afficher_tableau(["entité", "méthode", "durée", "pic de mémoire"], lignes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compare la localisation d'un lot de points par le `Localisateur` et en SQL
+
+Les points sont tirés dans un échantillon de communes. Nécessite shapely et
+numpy.
+"""
+import random
+import time
+
+import numpy as np
+
+from bench import afficher_tableau, initialiser
+
+NOMBRE_POINTS = 200
+
+
+def main():
+    initialiser()
+
+    from data_france.localisation import Localisateur, localiser
+    from data_france.models import Commune
+
+    localisateur = Localisateur.depuis_base()
+
+    random.seed(0)
+    communes = random.sample(
+        list(Commune.objects.filter(type="COM", geometry__isnull=False)),
+        NOMBRE_POINTS,
+    )
+    points = [c.geometry.point_on_surface for c in communes]
+    latitudes = np.array([p.y for p in points])
+    longitudes = np.array([p.x for p in points])
+
+    debut = time.perf_counter()
+    localisateur.localiser(latitudes, longitudes)
+    duree_memoire = time.perf_counter() - debut
+
+    debut = time.perf_counter()
+    localiser(zip(latitudes, longitudes))
+    duree_sql = time.perf_counter() - debut
+
+    print(
+        f"construction : {localisateur.duree_construction:.1f} s, "
+        f"{localisateur.taille_memoire() >> 20} Mo de coordonnées"
+    )
+    afficher_tableau(
+        ["méthode", f"{NOMBRE_POINTS} points"],
+        [
+            ["STRtree", f"{duree_memoire * 1000:.1f} ms"],
+            ["SQL", f"{duree_sql * 1000:.1f} ms"],
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
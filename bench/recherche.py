@@ -0,0 +1,40 @@
+"""Mesure la latence (p50/p99) des recherches de communes à 10 résultats,
+avec et sans recherche floue
+"""
+import statistics
+import time
+
+from bench import afficher_tableau, initialiser
+
+REQUETES = ["etalans", "marseile", "st etienne", "besancon", "Paris 13"]
+REPETITIONS = 20
+
+
+def main():
+    initialiser()
+
+    from data_france.models import Commune
+
+    lignes = []
+    for flou in (False, True):
+        durees = []
+        for _ in range(REPETITIONS):
+            for q in REQUETES:
+                debut = time.perf_counter()
+                list(Commune.objects.search(q, flou=flou)[:10])
+                durees.append(time.perf_counter() - debut)
+
+        centiles = statistics.quantiles(durees, n=100)
+        lignes.append(
+            [
+                "floue" if flou else "exacte",
+                f"{centiles[49] * 1000:.1f} ms",
+                f"{centiles[98] * 1000:.1f} ms",
+            ]
+        )
+
+    afficher_tableau(["recherche", "p50", "p99"], lignes)
+
+
+if __name__ == "__main__":
+    main()
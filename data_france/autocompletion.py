@@ -0,0 +1,291 @@
+"""Index de recherche des communes en mémoire
+
+Cet index est une alternative à la recherche plein texte de PostgreSQL
+(:py:meth:`data_france.models.SearchQueryset.search`) pour l'autocomplétion :
+il est construit une fois à partir des vecteurs de recherche de la table des
+communes, puis interrogé sans requête SQL.
+
+Les lexèmes indexés sont ceux calculés par PostgreSQL avec la configuration
+`data_france_search`, et le classement reproduit celui de `ts_rank` avec la
+normalisation utilisée par la recherche en base. La seule différence porte sur
+la racinisation des termes de la requête : elle repose sur un dictionnaire
+construit à partir des mots présents dans les noms de communes et de
+départements, et les termes inconnus de ce dictionnaire sont recherchés tels
+quels.
+
+L'index est choisi avec le paramètre `DATA_FRANCE_RECHERCHE_COMMUNES = "memoire"`
+et il est rechargé automatiquement lorsque la version des données change.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connections
+from django.db.models import TextField
+from django.db.models.functions import Cast
+
+from data_france.cache import version_donnees
+from data_france.models import Commune
+from data_france.search import RE_POSTGRES_ESCAPE_CHARS
+
+# poids par défaut de ts_rank pour les poids D, C, B et A
+POIDS = {"D": 0.1, "C": 0.2, "B": 0.4, "A": 1.0}
+
+# position fictive utilisée par ts_rank pour les lexèmes sans position
+MAXENTRYPOS = 1 << 14
+
+RE_LEXEME = re.compile(r"'((?:[^']|'')*)'(?::([0-9A-D,]+))?")
+RE_POSITION = re.compile(r"(\d+)([A-D]?)")
+RE_MOT = re.compile(r"\w+")
+
+DICTIONNAIRE_SQL = """
+    SELECT DISTINCT d.token, d.lexemes
+    FROM (
+        SELECT nom FROM data_france_commune
+        UNION
+        SELECT nom FROM data_france_departement
+    ) AS n,
+    LATERAL ts_debug('data_france_search', n.nom) AS d
+    WHERE d.lexemes IS NOT NULL;
+"""
+
+Positions = Optional[Tuple[Tuple[int, float], ...]]
+
+
+def normaliser(texte):
+    """Met en minuscules et retire les accents, comme `unaccent`"""
+    texte = unicodedata.normalize("NFKD", texte.lower())
+    texte = texte.replace("œ", "oe").replace("æ", "ae")
+    return "".join(c for c in texte if not unicodedata.combining(c))
+
+
+def lire_tsvector(texte) -> Dict[str, Positions]:
+    """Lit la représentation textuelle d'un tsvector
+
+    :return: un dictionnaire associant chaque lexème à ses positions et poids,
+        ou à None si le lexème n'a pas de position
+    """
+    lexemes = {}
+    for lexeme, positions in RE_LEXEME.findall(texte or ""):
+        lexemes[lexeme.replace("''", "'")] = (
+            tuple(
+                (int(p), POIDS[w or "D"]) for p, w in RE_POSITION.findall(positions)
+            )
+            if positions
+            else None
+        )
+    return lexemes
+
+
+def _distance(d):
+    if d > 100:
+        return 1e-30
+    return 1.0 / (1.005 + 0.05 * math.exp(d / 1.5 - 2))
+
+
+def _rang_ou(lexemes, termes):
+    # portage de calc_rank_or (src/backend/utils/adt/tsrank.c)
+    res = 0.0
+    for trouves in termes:
+        for lexeme in trouves:
+            positions = lexemes[lexeme] or ((0, POIDS["D"]),)
+            resj, wjm, jm = 0.0, -1.0, 0
+            for j, (_, w) in enumerate(positions):
+                resj += w / ((j + 1) * (j + 1))
+                if w > wjm:
+                    wjm, jm = w, j
+            res += (wjm + resj - wjm / ((jm + 1) * (jm + 1))) / 1.64493406685
+    return res / len(termes)
+
+
+def _rang_et(lexemes, termes):
+    # portage de calc_rank_and (src/backend/utils/adt/tsrank.c)
+    if len(termes) < 2:
+        return _rang_ou(lexemes, termes)
+
+    res = -1.0
+    pos = [None] * len(termes)
+    for i, trouves in enumerate(termes):
+        for lexeme in trouves:
+            positions = lexemes[lexeme]
+            pos[i] = (positions or ((MAXENTRYPOS - 1, POIDS["D"]),), positions is None)
+            for k in range(i):
+                if pos[k] is None:
+                    continue
+                for p_l, w_l in pos[i][0]:
+                    for p_p, w_p in pos[k][0]:
+                        dist = abs(p_l - p_p)
+                        if dist or pos[i][1] or pos[k][1]:
+                            curw = math.sqrt(w_l * w_p * _distance(dist or MAXENTRYPOS))
+                            res = curw if res < 0 else 1.0 - (1.0 - res) * (1.0 - curw)
+    return res
+
+
+@dataclass
+class Resultat:
+    id: int
+    rang: float
+    commune: dict
+
+
+@dataclass
+class _Document:
+    id: int
+    type: str
+    code: str
+    lexemes: Dict[str, Positions]
+    commune: dict
+
+
+class IndexCommunes:
+    """Index en mémoire des communes pour la recherche par préfixe"""
+
+    def __init__(self, documents: List[_Document], dictionnaire, version=None):
+        self.documents = documents
+        self.dictionnaire = dictionnaire
+        self.version = version
+
+        self.postings = {}
+        for i, document in enumerate(documents):
+            for lexeme in document.lexemes:
+                self.postings.setdefault(lexeme, []).append(i)
+        self.lexiques = sorted(self.postings)
+
+    @classmethod
+    def charger(cls, using=None, version=None):
+        """Construit l'index à partir de la base de données"""
+        qs = (
+            Commune.objects.using(using)
+            .select_related("departement", "commune_parent__departement")
+            .only(
+                "code",
+                "type",
+                "nom",
+                "type_nom",
+                "departement__code",
+                "departement__nom",
+                "commune_parent__departement__code",
+                "commune_parent__departement__nom",
+            )
+            .annotate(search_texte=Cast("search", output_field=TextField()))
+            .order_by("id")
+        )
+        documents = [
+            _Document(
+                id=c.id,
+                type=c.type,
+                code=c.code,
+                lexemes=lire_tsvector(c.search_texte),
+                commune=c.as_dict(),
+            )
+            for c in qs.iterator(chunk_size=2000)
+        ]
+
+        dictionnaire = {}
+        with connections[using or "default"].cursor() as cursor:
+            cursor.execute(DICTIONNAIRE_SQL)
+            for token, lexemes in cursor:
+                # une liste de lexèmes vide correspond à un mot vide ("de", "la"...)
+                dictionnaire[normaliser(token)] = lexemes[0] if lexemes else None
+
+        return cls(documents, dictionnaire, version=version)
+
+    def termes(self, texte):
+        """Découpe la requête en termes, comme :py:class:`PrefixSearchQuery`
+
+        :return: une liste de couples (lexème, recherche par préfixe)
+        """
+        mots = [
+            m
+            for mot in RE_POSTGRES_ESCAPE_CHARS.sub(" ", texte).split()
+            for m in RE_MOT.findall(normaliser(mot))
+        ]
+
+        termes = {}
+        for i, mot in enumerate(mots):
+            lexeme = self.dictionnaire.get(mot, mot)
+            if lexeme is not None:
+                prefixe = i == len(mots) - 1
+                termes[lexeme] = termes.get(lexeme, False) or prefixe
+        return sorted(termes.items())
+
+    def _lexemes(self, lexeme, prefixe):
+        if not prefixe:
+            return [lexeme] if lexeme in self.postings else []
+        debut = bisect.bisect_left(self.lexiques, lexeme)
+        fin = debut
+        while fin < len(self.lexiques) and self.lexiques[fin].startswith(lexeme):
+            fin += 1
+        return self.lexiques[debut:fin]
+
+    def rechercher(self, texte, types=None, limite=10) -> List[Resultat]:
+        """Recherche les communes correspondant au texte
+
+        :param texte: les termes à rechercher, le dernier étant un préfixe
+        :param types: les types de communes acceptés (tous par défaut)
+        :param limite: le nombre maximum de résultats
+        :return: les résultats, classés par pertinence décroissante
+        """
+        termes = self.termes(texte)
+        if not termes:
+            return []
+
+        lexemes_termes = [self._lexemes(l, p) for l, p in termes]
+        if not all(lexemes_termes):
+            return []
+
+        candidats = sorted(
+            (
+                set().union(*(self.postings[l] for l in lexemes))
+                for lexemes in lexemes_termes
+            ),
+            key=len,
+        )
+        candidats = candidats[0].intersection(*candidats[1:])
+
+        resultats = []
+        for i in candidats:
+            document = self.documents[i]
+            if types is not None and document.type not in types:
+                continue
+            trouves = [
+                [l for l in lexemes if l in document.lexemes]
+                for lexemes in lexemes_termes
+            ]
+            rang = _rang_et(document.lexemes, trouves)
+            if rang < 0:
+                rang = 1e-20
+            rang /= len(document.lexemes)
+            resultats.append((-rang, document.code, document.type, i))
+
+        return [
+            Resultat(
+                id=self.documents[i].id,
+                rang=-rang,
+                commune=self.documents[i].commune,
+            )
+            for rang, _, _, i in heapq.nsmallest(limite, resultats)
+        ]
+
+
+_index = None
+_verrou = threading.Lock()
+
+
+def index_communes() -> IndexCommunes:
+    """Renvoie l'index des communes du processus, rechargé si les données ont changé"""
+    global _index
+
+    version = version_donnees()
+    identifiant = version.identifiant if version is not None else None
+
+    if _index is None or _index.version != identifiant:
+        with _verrou:
+            if _index is None or _index.version != identifiant:
+                _index = IndexCommunes.charger(version=identifiant)
+    return _index
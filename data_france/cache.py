@@ -0,0 +1,155 @@
+"""Mise en cache des réponses des vues de data_france
+
+Les données ne changent qu'à l'exécution de `update_data_france`, qui
+enregistre une nouvelle :py:class:`~data_france.models.VersionDonnees` à la fin
+de l'import lorsque le contenu des tables a changé. Les clés de cache et les
+ETag dépendent de cette version : un import qui modifie les données invalide
+donc automatiquement toutes les réponses précédentes.
+
+Les requêtes conditionnelles (`If-None-Match`, `If-Modified-Since`) sont
+traitées sans lire d'autre table que celle des versions.
+
+Le cache des réponses est activé en indiquant l'alias du cache Django à
+utiliser dans le paramètre `DATA_FRANCE_CACHE`. Les en-têtes `ETag` et
+`Last-Modified` sont émis dans tous les cas.
+"""
+import hashlib
+import json
+from importlib import metadata
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date, urlencode
+
+from data_france.models import VersionDonnees
+
+CLE_VERSION = "data_france:version"
+
+
+def _cache():
+    alias = getattr(settings, "DATA_FRANCE_CACHE", None)
+    return caches[alias] if alias else None
+
+
+def version_donnees():
+    """Renvoie la version actuelle des données, ou None si aucune n'existe"""
+    cache = _cache()
+    if cache is not None:
+        version = cache.get(CLE_VERSION)
+        if version is not None:
+            return version
+
+    version = VersionDonnees.objects.order_by("-id").first()
+
+    if cache is not None and version is not None:
+        cache.set(CLE_VERSION, version)
+    return version
+
+
+def version_paquet():
+    try:
+        return metadata.version("data-france")
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def enregistrer_version_donnees(using=None, empreintes=None):
+    """Enregistre une nouvelle version des données
+
+    À appeler à la fin d'un import : les réponses mises en cache pour les
+    versions précédentes ne sont plus utilisées.
+
+    :param empreintes: l'empreinte du contenu de chaque table ; si le contenu
+        et la version du paquet sont identiques à ceux de la dernière version,
+        aucune nouvelle version n'est créée. Sans empreintes, une nouvelle
+        version est toujours créée.
+    :return: la version courante des données
+    """
+    version = VersionDonnees(version_paquet=version_paquet())
+
+    if empreintes is not None:
+        version.empreintes = dict(sorted(empreintes.items()))
+        version.empreinte = hashlib.md5(
+            json.dumps([version.version_paquet, version.empreintes]).encode()
+        ).hexdigest()
+
+        derniere = VersionDonnees.objects.using(using).order_by("-id").first()
+        if derniere is not None and derniere.empreinte == version.empreinte:
+            return derniere
+
+    version.save(using=using)
+
+    cache = _cache()
+    if cache is not None:
+        cache.delete(CLE_VERSION)
+
+    return version
+
+
+def empreinte_requete(request):
+    """Calcule une empreinte identifiant la réponse à une requête
+
+    Les paramètres de la requête sont normalisés (triés par nom puis par
+    valeur) pour que deux requêtes équivalentes partagent la même empreinte.
+    """
+    params = urlencode(
+        sorted((k, sorted(v)) for k, v in request.GET.lists()), doseq=True
+    )
+    return hashlib.md5(f"{request.path}?{params}".encode()).hexdigest()
+
+
+class CacheDonneesMixin:
+    """Mixin de vue ajoutant le cache des réponses et les requêtes conditionnelles
+
+    Seules les réponses réussies sont mises en cache et reçoivent un ETag ;
+    les réponses en streaming sont entièrement lues avant d'être mises en
+    cache.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        version = version_donnees()
+        if version is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        empreinte = empreinte_requete(request)
+        cle = f"data_france:{version.identifiant}:{empreinte}"
+        etag = quote_etag(f"{version.identifiant}-{empreinte}")
+        last_modified = int(version.date.timestamp())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            # une réponse 304 doit porter les mêmes validateurs que la réponse
+            # complète (RFC 9110, section 15.4.5)
+            if response.status_code == 304:
+                response["ETag"] = etag
+                response["Last-Modified"] = http_date(last_modified)
+            return response
+
+        cache = _cache()
+        contenu = cache.get(cle) if cache is not None else None
+
+        if contenu is not None:
+            response = HttpResponse(contenu, content_type="application/json")
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+            if cache is not None:
+                if response.streaming:
+                    response = HttpResponse(
+                        b"".join(response.streaming_content),
+                        content_type=response["Content-Type"],
+                    )
+                cache.set(cle, response.content)
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
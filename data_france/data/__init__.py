@@ -1,14 +1,25 @@
 import contextlib
-import lzma
 import os
-from dataclasses import dataclass
-from importlib.resources import open_binary
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
 from sys import stderr
-from typing import Tuple
+from typing import Tuple, Callable, Optional, Dict, List
 
-from django.db import transaction
+from django.apps import apps
+from django.contrib.gis.db.models import GeometryField
+from django.db import transaction, connections
 from django.db.transaction import get_connection
 from psycopg.sql import SQL, Identifier
+from data_france.data.compression import ouvrir_donnees, trouver_fichier
+from data_france.data.copie_binaire import fichier_copie, lire_entete
+from data_france.data.geometries import LecteurGeometries, fichier_geometries
+from data_france.data.triggers_recherche import (
+    synchroniser_triggers_recherche,
+    triggers_recherche_installes,
+)
 from data_france.utils import TypeNom
 
 COPY_SQL = SQL(
@@ -22,6 +33,16 @@ CREATE_TEMP_TABLE_SQL = SQL(
     """
 )
 
+# pour les fichiers COPY binaires, la table temporaire reçoit les types décrits
+# dans l'en-tête du fichier
+CREATE_TEMP_TABLE_TYPEE_SQL = SQL(
+    """
+    CREATE TEMPORARY TABLE {temp_table} ({columns});
+    """
+)
+
+COPY_BINAIRE_SQL = SQL("""COPY {table} ({columns}) FROM STDIN (FORMAT BINARY);""")
+
 DROP_TEMPORARY_TABLE_SQL = SQL(
     """
     DROP TABLE IF EXISTS {temp_table};
@@ -37,6 +58,52 @@ COPY_FROM_TEMP_TABLE = SQL(
     """
 )
 
+# taille (en caractères) des blocs envoyés à PostgreSQL lors des COPY : cela
+# évite de décompresser l'intégralité d'un fichier en mémoire avant envoi.
+TAILLE_BLOC = 1 << 20
+
+SUPPRIMER_ASSOCIATIONS = SQL(
+    """
+    DELETE FROM {table}
+    WHERE ({columns}) NOT IN (SELECT {columns} FROM {temp_table})
+    RETURNING id;
+    """
+)
+
+AJOUTER_ASSOCIATIONS = SQL(
+    """
+    INSERT INTO {table} ({columns})
+    SELECT {columns} FROM {temp_table}
+    EXCEPT
+    SELECT {columns} FROM {table}
+    RETURNING id;
+    """
+)
+
+# en mode incrémental, seules les lignes nouvelles ou dont l'empreinte a changé
+# sont réécrites : les autres sont laissées telles quelles, ce qui évite de
+# réécrire inutilement géométries et index.
+COPY_FROM_TEMP_TABLE_INCREMENTAL = SQL(
+    """
+    WITH modifications AS (
+        INSERT INTO {table} AS existant ({column_list})
+        SELECT {select_list}
+        FROM {temp_table}
+        ON CONFLICT({id_column}) DO UPDATE SET {setters}
+        WHERE {condition}
+        RETURNING {id_column} AS id, xmax = 0 AS insere
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE insere),
+        COUNT(*) FILTER (WHERE NOT insere),
+        (SELECT COUNT(*) FROM {temp_table}),
+        COALESCE(array_agg(id), '{{}}')
+    FROM modifications;
+    """
+)
+
+EMPREINTE_LIGNE = SQL("md5(CAST(ROW({columns}) AS text))")
+
 MARQUER_INACTIF = SQL(
     """
     UPDATE {table}
@@ -48,6 +115,53 @@ MARQUER_INACTIF = SQL(
 )
 
 
+# les géométries peuvent être fournies dans un fichier binaire séparé (voir
+# data_france.data.geometries), chargé en COPY binaire
+CREATE_TEMP_TABLE_GEOMETRIES_SQL = SQL(
+    """
+    CREATE TEMPORARY TABLE {temp_table} (id integer PRIMARY KEY, wkb bytea NOT NULL);
+    """
+)
+
+COPY_GEOMETRIES_SQL = SQL("""COPY {temp_table} (id, wkb) FROM STDIN (FORMAT BINARY);""")
+
+# seules les géométries qui ont changé sont réécrites
+METTRE_A_JOUR_GEOMETRIES = SQL(
+    """
+    UPDATE {table} AS t
+    SET geometry = ST_GeogFromWKB(g.wkb)
+    FROM {temp_table} g
+    WHERE t.id = g.id
+    AND (t.geometry IS NULL OR ST_AsBinary(t.geometry) <> g.wkb);
+    """
+)
+
+SUPPRIMER_GEOMETRIES = SQL(
+    """
+    UPDATE {table}
+    SET geometry = NULL
+    WHERE geometry IS NOT NULL AND id NOT IN (SELECT id FROM {temp_table});
+    """
+)
+
+
+@dataclass
+class BilanImport:
+    inseres: int = 0
+    mis_a_jour: int = 0
+    inchanges: int = 0
+    desactives: int = 0
+    # identifiants des lignes insérées ou mises à jour, connus seulement en
+    # mode incrémental
+    ids_modifies: Optional[List[int]] = field(default=None, repr=False)
+
+    def __str__(self):
+        return (
+            f"{self.inseres} insérés, {self.mis_a_jour} mis à jour, "
+            f"{self.inchanges} inchangés, {self.desactives} désactivés"
+        )
+
+
 @dataclass
 class SecteurPLM:
     code: str
@@ -124,30 +238,48 @@ VILLES_PLM = [
 
 @contextlib.contextmanager
 def console_message(message):
-    stderr.write(
-        f"{message}... ",
-    )
-    stderr.flush()
+    # en dehors du thread principal (import parallèle), le message n'est écrit
+    # qu'une fois l'opération terminée pour ne pas entremêler les lignes
+    principal = threading.current_thread() is threading.main_thread()
+    if principal:
+        stderr.write(
+            f"{message}... ",
+        )
+        stderr.flush()
+
+    details = []
+    yield details
 
-    yield
-    stderr.write(f"OK!{os.linesep}")
+    prefixe = "" if principal else f"{message}... "
+    details = "".join(f"({d}) " for d in details)
+    stderr.write(f"{prefixe}{details}OK!{os.linesep}")
 
 
 @contextlib.contextmanager
-def temporary_table(cursor, temp_table, reference_table, columns):
-    """Context manager for creating and dropping temp tables"""
+def temporary_table(cursor, temp_table, reference_table, columns, types=None):
+    """Context manager for creating and dropping temp tables
+
+    Without `types`, the temp table columns copy those of the reference table.
+    """
 
     temp_table = Identifier(temp_table)
     reference_table = Identifier(reference_table)
-    columns = SQL(",").join([Identifier(c) for c in columns])
 
-    cursor.execute(
-        CREATE_TEMP_TABLE_SQL.format(
+    if types is None:
+        create_sql = CREATE_TEMP_TABLE_SQL.format(
             temp_table=temp_table,
             reference_table=reference_table,
-            columns=columns,
-        ).as_string(cursor)
-    )
+            columns=SQL(",").join([Identifier(c) for c in columns]),
+        )
+    else:
+        create_sql = CREATE_TEMP_TABLE_TYPEE_SQL.format(
+            temp_table=temp_table,
+            columns=SQL(",").join(
+                [Identifier(c) + SQL(" ") + SQL(types[c]) for c in columns]
+            ),
+        )
+
+    cursor.execute(create_sql.as_string(cursor))
 
     try:
         yield
@@ -155,324 +287,765 @@ def temporary_table(cursor, temp_table, reference_table, columns):
         cursor.execute(DROP_TEMPORARY_TABLE_SQL.format(temp_table=temp_table))
 
 
+def copier_par_blocs(copy, f, taille_bloc=TAILLE_BLOC):
+    """Envoie le contenu du fichier `f` à l'objet `copy` bloc par bloc
+
+    Seul un bloc de `taille_bloc` caractères (ou octets, pour un fichier binaire)
+    est gardé en mémoire à la fois.
+    """
+    while bloc := f.read(taille_bloc):
+        copy.write(bloc)
+
+
 @console_message("Chargement des associations Communes/Codes postaux")
-def importer_associations_communes_codes_postaux(using):
-    with open_binary(
-        "data_france.data", "codes_postaux_communes.csv.lzma"
-    ) as _f, lzma.open(_f, "rt") as f:
+def importer_associations_communes_codes_postaux(using, taille_bloc=TAILLE_BLOC):
+    # plutôt que de vider la table, on ne supprime et n'ajoute que les
+    # associations qui ont changé : cela permet aux éventuels triggers de
+    # recherche de ne recalculer que les communes concernées.
+    with ouvrir_donnees("codes_postaux_communes.csv.lzma", "rt") as f:
         columns = f.readline().strip().split(",")
         table = "data_france_codepostal_communes"
-        with get_connection(using).cursor() as cursor:
-            cursor.execute(
-                SQL("TRUNCATE TABLE {table};").format(table=Identifier(table))
-            )
-
+        temp_table = f"{table}_temp"
+        with get_connection(using).cursor() as cursor, temporary_table(
+            cursor, temp_table, table, columns
+        ):
             with cursor.copy(COPY_SQL.format(
-                    table=Identifier(table),
+                    table=Identifier(temp_table),
                     columns=SQL(",").join(Identifier(c) for c in columns),
             )) as copy:
-                copy.write(f.read())
-
-def agreger_geometries_et_populations(using):
-    with get_connection(using).cursor() as cursor:
+                copier_par_blocs(copy, f, taille_bloc)
 
-        param_list = [
-            {
-                "arrondissements": list(secteur.arrondissements),
-                "secteur": secteur.code,
+            params = {
+                "table": Identifier(table),
+                "temp_table": Identifier(temp_table),
+                "columns": SQL(",").join(Identifier(c) for c in columns),
             }
-            for ville in VILLES_PLM
-            for secteur in ville.secteurs
-        ]
+            cursor.execute(SUPPRIMER_ASSOCIATIONS.format(**params))
+            ids_modifies = [id for id, in cursor.fetchall()]
+            cursor.execute(AJOUTER_ASSOCIATIONS.format(**params))
+            ids_modifies.extend(id for id, in cursor.fetchall())
 
-        with console_message("Calcul des géométries des secteurs électoraux"):
-            cursor.executemany(
-                """
-                UPDATE "data_france_commune"
-                SET
-                    geometry = (
-                        SELECT ST_Multi(ST_Union(geometry :: geometry))
-                        FROM "data_france_commune"
-                        WHERE code = ANY(%(arrondissements)s::text[])
-                    )
-                WHERE code = %(secteur)s;
-                """,
-                param_list,
-            )
+    return {table: ids_modifies}
 
-        with console_message("Calcul des populations et géométries par département"):
-            cursor.execute(
-                """
-                UPDATE "data_france_departement"
-                SET
-                    population = c.population,
-                    geometry = ST_Multi(c.geometry)
-                FROM (
-                    SELECT
-                        departement_id,
-                        SUM(population_municipale) AS population,
-                        ST_Union(geometry :: geometry) AS geometry
-                    FROM "data_france_commune"
-                    WHERE departement_id IS NOT NULL
-                    GROUP BY departement_id
-                ) AS c
-                WHERE id = c.departement_id;
-                """
-            )
 
-        with console_message("Calcul des populations et géométries par région"):
-            cursor.execute(
-                """
-                UPDATE "data_france_region"
-                SET
-                    population = d.population,
-                    geometry = ST_Multi(d.geometry)
-                FROM (
-                    SELECT
-                        region_id,
-                        SUM(population) AS population,
-                        ST_Union(geometry :: geometry) AS geometry
-                    FROM "data_france_departement"
-                    GROUP BY region_id
-                ) AS d
-                WHERE id = d.region_id;
-                """
-            )
+# empreinte du contenu d'une table, indépendante de l'ordre physique des lignes
+EMPREINTE_TABLE = SQL(
+    "SELECT md5(coalesce(string_agg({empreinte_ligne}, '' ORDER BY t.id), ''))"
+    " FROM {table} t;"
+)
+
+# les géométries n'interviennent que par l'empreinte de leur WKB
+EMPREINTE_GEOMETRIE = SQL("md5(ST_AsBinary({colonne}))")
 
-        with console_message("Calcul des populations et géométries par EPCI"):
+# tables dont le contenu ne fait pas partie des données de référence
+TABLES_HORS_VERSION = ["data_france_empreinteagregat", "data_france_versiondonnees"]
+
+
+def _empreinte_ligne(model):
+    """Expression SQL de l'empreinte d'une ligne de la table du modèle
+
+    Les colonnes de GeoJSON simplifié, calculées à partir de la géométrie, sont
+    ignorées, et les géométries ne sont pas converties en texte : seule
+    l'empreinte de leur WKB est prise en compte.
+    """
+    champs_geojson = set(getattr(model, "CHAMPS_GEOJSON", ()))
+    colonnes = []
+    for champ in model._meta.concrete_fields:
+        if champ.name in champs_geojson:
+            continue
+        colonne = Identifier("t", champ.column)
+        if isinstance(champ, GeometryField):
+            colonne = EMPREINTE_GEOMETRIE.format(colonne=colonne)
+        colonnes.append(colonne)
+    return EMPREINTE_LIGNE.format(columns=SQL(",").join(colonnes))
+
+
+def empreintes_tables(using):
+    """Calcule l'empreinte du contenu de chacune des tables de data_france"""
+    models = [
+        m
+        for m in apps.get_app_config("data_france").get_models(
+            include_auto_created=True
+        )
+        if m._meta.db_table not in TABLES_HORS_VERSION
+    ]
+
+    empreintes = {}
+    with get_connection(using).cursor() as cursor:
+        for model in models:
             cursor.execute(
-                """
-                UPDATE "data_france_epci"
-                SET
-                    population = c.population,
-                    geometry = ST_Multi(c.geometry)
-                FROM (
-                    SELECT
-                        epci_id,
-                        SUM(population_municipale) AS population,
-                        ST_Union(geometry :: geometry) AS geometry
-                    FROM "data_france_commune"
-                    WHERE epci_id IS NOT NULL
-                    GROUP BY epci_id
-                ) AS c
-                WHERE id = c.epci_id;
-                """
+                EMPREINTE_TABLE.format(
+                    table=Identifier(model._meta.db_table),
+                    empreinte_ligne=_empreinte_ligne(model),
+                )
             )
+            empreintes[model._meta.db_table] = cursor.fetchone()[0]
+    return empreintes
 
-        with console_message(
-            "Calcul des populations et géométries des collectivités départementales"
-        ):
-            # les conseils généraux et collectivités départementales qui correspondent à des départements
-            # cela inclut tous les conseils départementaux plus certaines collectivités uniques dont Paris (75C),
-            # les collectivités uniques d'outremer (972R, 973R, 976D)
-            # par contre il faut exclure le Rhône qui est un cas particulier
-            cursor.execute(
-                """
-                UPDATE "data_france_collectivitedepartementale" c
-                SET
-                    population = d.population,
-                    geometry = d.geometry
-                FROM "data_france_departement" d
-                WHERE d.code = TRIM(trailing 'DRC' from c.code)
-                AND d.code != '69D'
-                """,
+
+AGREGER_SECTEUR = """
+    UPDATE "data_france_commune"
+    SET
+        geometry = (
+            SELECT ST_Multi(ST_Union(geometry :: geometry))
+            FROM "data_france_commune"
+            WHERE code = ANY(%(arrondissements)s::text[])
+        )
+    WHERE code = %(secteur)s;
+"""
+
+AGREGER_DEPARTEMENT = """
+    UPDATE "data_france_departement"
+    SET
+        geometry = (
+            SELECT ST_Multi(ST_Union(geometry :: geometry))
+            FROM "data_france_commune"
+            WHERE departement_id = %(id)s
+        )
+    WHERE id = %(id)s;
+"""
+
+# les régions sont construites à partir des géométries des départements, déjà
+# calculées, plutôt qu'à partir des communes
+AGREGER_REGION = """
+    UPDATE "data_france_region"
+    SET
+        geometry = (
+            SELECT ST_Multi(ST_Union(geometry :: geometry))
+            FROM "data_france_departement"
+            WHERE region_id = %(id)s
+        )
+    WHERE id = %(id)s;
+"""
+
+AGREGER_EPCI = """
+    UPDATE "data_france_epci"
+    SET
+        geometry = (
+            SELECT ST_Multi(ST_Union(geometry :: geometry))
+            FROM "data_france_commune"
+            WHERE epci_id = %(id)s
+        )
+    WHERE id = %(id)s;
+"""
+
+# les conseils généraux et collectivités départementales qui correspondent à des départements
+# cela inclut tous les conseils départementaux plus certaines collectivités uniques dont Paris (75C),
+# les collectivités uniques d'outremer (972R, 973R, 976D)
+# par contre il faut exclure le Rhône qui est un cas particulier (calculé dans
+# une unité séparée, éventuellement en parallèle)
+AGREGER_COLLECTIVITES_DEPARTEMENTALES = """
+    UPDATE "data_france_collectivitedepartementale" c
+    SET geometry = d.geometry
+    FROM "data_france_departement" d
+    WHERE d.code = TRIM(trailing 'DRC' from c.code)
+    AND c.code != '69D'
+    AND md5(ST_AsBinary(c.geometry)) IS DISTINCT FROM md5(ST_AsBinary(d.geometry));
+"""
+
+# Le Rhône et la métropole de Lyon sont un cas particulier
+COMMUNES_METROPOLE_LYON = """
+    SELECT com.*
+    FROM "data_france_commune" com
+    JOIN "data_france_epci" epci ON com.epci_id = epci.id
+    JOIN "data_france_departement" dep ON com.departement_id = dep.id
+    WHERE com.type = 'COM'
+    AND dep.code = %(code_dep)s
+    AND epci.code = %(code_metropole)s
+"""
+
+COMMUNES_RHONE = """
+    SELECT com.*
+    FROM "data_france_commune" com
+    LEFT JOIN "data_france_epci" epci ON com.epci_id = epci.id
+    JOIN "data_france_departement" dep ON com.departement_id = dep.id
+    WHERE com.type = 'COM'
+    AND dep.code = %(code_dep)s
+    AND (epci.code IS NULL OR epci.code != %(code_metropole)s)
+"""
+
+AGREGER_COLLECTIVITE_COMMUNES = """
+    UPDATE "data_france_collectivitedepartementale"
+    SET geometry = (
+        SELECT ST_Multi(ST_Union(com.geometry :: geometry))
+        FROM ({communes}) com
+    )
+    WHERE code = %(code_c)s;
+"""
+
+PARAMS_METROPOLE_LYON = {
+    "code_c": "69M",
+    "code_dep": "69",
+    "code_metropole": "200046977",
+}
+PARAMS_RHONE = {**PARAMS_METROPOLE_LYON, "code_c": "69D"}
+
+# la collectivité européenne d'Alsace et l'Assemblée de Corse sont un cas particulier
+DEPARTEMENTS_COLLECTIVITE = """
+    SELECT * FROM "data_france_departement" WHERE code = ANY(%(codes_d)s::text[])
+"""
+
+AGREGER_COLLECTIVITE_DEPARTEMENTS = f"""
+    UPDATE "data_france_collectivitedepartementale"
+    SET geometry = (
+        SELECT ST_Multi(ST_Union(d.geometry :: geometry))
+        FROM ({DEPARTEMENTS_COLLECTIVITE}) d
+    )
+    WHERE code = %(code_c)s;
+"""
+
+COLLECTIVITES_DEPARTEMENTS = [
+    {"code_c": "6AE", "codes_d": ["67", "68"]},
+    {"code_c": "20R", "codes_d": ["2A", "2B"]},
+]
+
+
+def empreinte_sql(membres, cible):
+    """Construit la requête calculant l'empreinte d'une géométrie agrégée
+
+    L'empreinte couvre l'identité et la géométrie de chacun des membres
+    (requête `membres`), ainsi que la géométrie actuelle de l'agrégat (requête
+    `cible`) : elle change si un membre est ajouté, retiré ou modifié, ou si
+    la géométrie de l'agrégat a été écrasée depuis le dernier calcul.
+    """
+    return f"""
+    SELECT md5(
+        COALESCE(
+            string_agg(
+                m.id || ':' || COALESCE(md5(ST_AsBinary(m.geometry)), ''),
+                ',' ORDER BY m.id
+            ),
+            ''
+        )
+        || '|' || COALESCE((SELECT md5(ST_AsBinary(c.geometry)) FROM ({cible}) c), '')
+    )
+    FROM ({membres}) m;
+    """
+
+
+EMPREINTE_SECTEUR = empreinte_sql(
+    """SELECT * FROM "data_france_commune" WHERE code = ANY(%(arrondissements)s::text[])""",
+    """SELECT * FROM "data_france_commune" WHERE code = %(secteur)s""",
+)
+EMPREINTE_DEPARTEMENT = empreinte_sql(
+    """SELECT * FROM "data_france_commune" WHERE departement_id = %(id)s""",
+    """SELECT * FROM "data_france_departement" WHERE id = %(id)s""",
+)
+EMPREINTE_REGION = empreinte_sql(
+    """SELECT * FROM "data_france_departement" WHERE region_id = %(id)s""",
+    """SELECT * FROM "data_france_region" WHERE id = %(id)s""",
+)
+EMPREINTE_EPCI = empreinte_sql(
+    """SELECT * FROM "data_france_commune" WHERE epci_id = %(id)s""",
+    """SELECT * FROM "data_france_epci" WHERE id = %(id)s""",
+)
+COLLECTIVITE = (
+    """SELECT * FROM "data_france_collectivitedepartementale" WHERE code = %(code_c)s"""
+)
+EMPREINTE_METROPOLE_LYON = empreinte_sql(COMMUNES_METROPOLE_LYON, COLLECTIVITE)
+EMPREINTE_RHONE = empreinte_sql(COMMUNES_RHONE, COLLECTIVITE)
+EMPREINTE_COLLECTIVITE_DEPARTEMENTS = empreinte_sql(
+    DEPARTEMENTS_COLLECTIVITE, COLLECTIVITE
+)
+
+# les géométries simplifiées sont stockées directement au format GeoJSON
+SIMPLIFIER_GEOMETRIES = """
+    UPDATE "{table}" t
+    SET "{champ}" = s.geojson
+    FROM (
+        SELECT
+            id,
+            ST_AsGeoJSON(
+                ST_Multi(ST_SimplifyPreserveTopology(geometry :: geometry, {tolerance})),
+                {decimales}
+            ) AS geojson
+        FROM "{table}"
+    ) AS s
+    WHERE t.id = s.id
+    AND t."{champ}" IS DISTINCT FROM s.geojson;
+"""
+
+TABLES_GEOMETRIES_SIMPLIFIEES = [
+    "data_france_commune",
+    "data_france_epci",
+    "data_france_departement",
+    "data_france_region",
+    "data_france_collectivitedepartementale",
+]
+
+LIRE_EMPREINTE = """
+    SELECT empreinte FROM "data_france_empreinteagregat" WHERE nom = %(nom)s;
+"""
+
+ENREGISTRER_EMPREINTE = """
+    INSERT INTO "data_france_empreinteagregat" (nom, empreinte)
+    VALUES (%(nom)s, %(empreinte)s)
+    ON CONFLICT (nom) DO UPDATE SET empreinte = excluded.empreinte;
+"""
+
+# les populations ne sont que des sommes : il est bien moins coûteux de
+# toujours les recalculer que de vérifier si elles ont changé
+CALCULER_POPULATIONS = [
+    (
+        """
+        UPDATE "data_france_departement"
+        SET population = c.population
+        FROM (
+            SELECT departement_id, SUM(population_municipale) AS population
+            FROM "data_france_commune"
+            WHERE departement_id IS NOT NULL
+            GROUP BY departement_id
+        ) AS c
+        WHERE id = c.departement_id
+        AND "data_france_departement".population IS DISTINCT FROM c.population;
+        """,
+        None,
+    ),
+    (
+        """
+        UPDATE "data_france_region"
+        SET population = d.population
+        FROM (
+            SELECT region_id, SUM(population) AS population
+            FROM "data_france_departement"
+            GROUP BY region_id
+        ) AS d
+        WHERE id = d.region_id
+        AND "data_france_region".population IS DISTINCT FROM d.population;
+        """,
+        None,
+    ),
+    (
+        """
+        UPDATE "data_france_epci"
+        SET population = c.population
+        FROM (
+            SELECT epci_id, SUM(population_municipale) AS population
+            FROM "data_france_commune"
+            WHERE epci_id IS NOT NULL
+            GROUP BY epci_id
+        ) AS c
+        WHERE id = c.epci_id
+        AND "data_france_epci".population IS DISTINCT FROM c.population;
+        """,
+        None,
+    ),
+    (
+        """
+        UPDATE "data_france_collectivitedepartementale" c
+        SET population = d.population
+        FROM "data_france_departement" d
+        WHERE d.code = TRIM(trailing 'DRC' from c.code)
+        AND c.code != '69D'
+        AND c.population IS DISTINCT FROM d.population;
+        """,
+        None,
+    ),
+    *(
+        (
+            f"""
+            UPDATE "data_france_collectivitedepartementale"
+            SET population = (
+                SELECT SUM(com.population_municipale) FROM ({communes}) com
+            )
+            WHERE code = %(code_c)s;
+            """,
+            params,
+        )
+        for communes, params in [
+            (COMMUNES_METROPOLE_LYON, PARAMS_METROPOLE_LYON),
+            (COMMUNES_RHONE, PARAMS_RHONE),
+        ]
+    ),
+    *(
+        (
+            f"""
+            UPDATE "data_france_collectivitedepartementale"
+            SET population = (
+                SELECT SUM(d.population) FROM ({DEPARTEMENTS_COLLECTIVITE}) d
             )
+            WHERE code = %(code_c)s;
+            """,
+            params,
+        )
+        for params in COLLECTIVITES_DEPARTEMENTS
+    ),
+]
 
-            # Le Rhône et la métropole de Lyon sont un cas particulier
+
+@dataclass
+class Unite:
+    """Une unité de calcul indépendante, exécutée dans sa propre transaction
+
+    En cas d'échec, seule l'unité concernée doit être relancée. Si une requête
+    `empreinte` est indiquée, l'unité n'est exécutée que si l'empreinte de ses
+    données a changé depuis la dernière exécution.
+    """
+
+    nom: str
+    requete: str
+    params: Optional[dict] = None
+    empreinte: Optional[str] = None
+
+
+def _executer_unite(unite, using, forcer=False):
+    """Exécute l'unité, et renvoie sa durée ou None si elle était à jour"""
+    debut = time.perf_counter()
+    with transaction.atomic(using=using), get_connection(using).cursor() as cursor:
+        if unite.empreinte is not None and not forcer:
+            cursor.execute(unite.empreinte, unite.params)
+            (empreinte,) = cursor.fetchone()
+            cursor.execute(LIRE_EMPREINTE, {"nom": unite.nom})
+            if cursor.fetchone() == (empreinte,):
+                return None
+
+        cursor.execute(unite.requete, unite.params)
+
+        if unite.empreinte is not None:
+            cursor.execute(unite.empreinte, unite.params)
+            (empreinte,) = cursor.fetchone()
             cursor.execute(
-                """
-                UPDATE "data_france_collectivitedepartementale"
-                SET
-                    population = m.population,
-                    geometry = m.geometry
-                FROM (
-                    SELECT
-                        SUM(population_municipale) AS population,
-                        ST_Multi(ST_Union(com.geometry :: geometry)) as geometry
-                    FROM "data_france_commune" com
-                    JOIN "data_france_epci" epci ON com.epci_id = epci.id
-                    JOIN "data_france_departement" dep ON com.departement_id = dep.id
-                    WHERE com.type = 'COM'
-                    AND dep.code = %(code_dep)s
-                    AND epci.code = %(code_metropole)s
-                ) AS m
-                WHERE code = '69M';
-
-                UPDATE "data_france_collectivitedepartementale"
-                SET
-                    population = m.population,
-                    geometry = m.geometry
-                FROM (
-                    SELECT
-                        SUM(population_municipale) AS population,
-                        ST_Multi(ST_Union(com.geometry :: geometry)) as geometry
-                    FROM "data_france_commune" com
-                    LEFT JOIN "data_france_epci" epci ON com.epci_id = epci.id
-                    JOIN "data_france_departement" dep ON com.departement_id = dep.id
-                    WHERE com.type = 'COM'
-                    AND dep.code = %(code_dep)s
-                    AND (epci.code IS NULL OR epci.code != %(code_metropole)s)
-                ) AS m
-                WHERE code = '69D';
-                """,
-                {
-                    "code_dep": "69",
-                    "code_metropole": "200046977",
-                },
+                ENREGISTRER_EMPREINTE, {"nom": unite.nom, "empreinte": empreinte}
             )
 
-            # la collectivité européenne d'Alsace et l'Assemblée de Corse sont un cas particulier
-            cursor.executemany(
-                """
-                UPDATE "data_france_collectivitedepartementale" c
-                SET
-                    population = m.population,
-                    geometry = m.geometry
-                FROM (
-                    SELECT
-                       SUM(population) AS population,
-                       ST_Multi(ST_Union(geometry :: geometry)) as geometry
-                    FROM "data_france_departement"
-                    WHERE code = ANY(%(codes_d)s::text[])
-                ) m
-                WHERE code = %(code_c)s;
-                """,
-                [
-                    {"code_c": "6AE", "codes_d": ["67", "68"]},
-                    {"code_c": "20R", "codes_d": ["2A", "2B"]},
-                ],
-            )
+    return time.perf_counter() - debut
+
+
+def _travailleur_unites(file, using, forcer, durees, echecs):
+    try:
+        while True:
+            try:
+                unite = file.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                durees[unite.nom] = _executer_unite(unite, using, forcer)
+            except Exception as e:
+                echecs.append((unite, e))
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+
+
+def executer_unites(unites, using, jobs=1, tentatives=2, forcer=False):
+    """Exécute des unités de calcul indépendantes sur `jobs` connexions
+
+    Les unités en échec sont relancées jusqu'à `tentatives` fois au total. Avec
+    `forcer`, les unités sont exécutées même si leur empreinte n'a pas changé.
+
+    :return: la durée d'exécution de chaque unité, par nom (None pour les
+        unités qui étaient déjà à jour)
+    """
+    durees = {}
+
+    for _ in range(tentatives):
+        file = queue.Queue()
+        for unite in unites:
+            file.put(unite)
+        echecs = []
+
+        if jobs <= 1:
+            _travailleur_unites(file, using, forcer, durees, echecs)
+        else:
+            travailleurs = [
+                threading.Thread(
+                    target=_travailleur_unites,
+                    args=(file, using, forcer, durees, echecs),
+                )
+                for _ in range(min(jobs, len(unites)))
+            ]
+            for t in travailleurs:
+                t.start()
+            for t in travailleurs:
+                t.join()
+
+        if not echecs:
+            return durees
+        unites = [unite for unite, _ in echecs]
+
+    _, erreur = echecs[0]
+    raise RuntimeError(
+        f"Échec du calcul pour {', '.join(u.nom for u, _ in echecs)}"
+    ) from erreur
+
+
+def _resume_durees(durees):
+    calculees = {n: d for n, d in durees.items() if d is not None}
+    resume = f"{len(calculees)} unités recalculées, {len(durees) - len(calculees)} à jour"
+    if calculees:
+        nom, duree = max(calculees.items(), key=lambda d: d[1])
+        resume += (
+            f", en {sum(calculees.values()):.1f} s"
+            f", la plus longue : {nom} en {duree:.1f} s"
+        )
+    return resume
+
+
+def agreger_geometries_et_populations(using, jobs=1, forcer=False):
+    """Calcule populations et géométries des entités composées de communes
+
+    Chaque département, région, EPCI, secteur électoral ou collectivité
+    constitue une unité de calcul indépendante : les unités sont réparties
+    sur `jobs` connexions, et seules celles dont les communes membres ont
+    changé sont recalculées, sauf si `forcer` est vrai.
 
+    :return: la durée de calcul de chaque unité, par nom
+    """
+    from data_france.models import SIMPLIFICATIONS
 
-@console_message("Mise à jour de l'index de recherche")
-def creer_index_recherche(using):
     with get_connection(using).cursor() as cursor:
-        # L'index des communes
-        cursor.execute(
-            """
-            WITH cps AS (
-                SELECT data_france_tsvector_agg(code :: tsvector) AS codes_postaux, commune_id
-                FROM data_france_codepostal AS dfcp
-                INNER JOIN data_france_codepostal_communes AS dfcc
-                ON dfcp.id = dfcc.codepostal_id
-                GROUP BY commune_id
-
-                UNION
-
-                SELECT NULL AS codes_postaux, dfc.id AS commune_id
-                FROM data_france_commune dfc
-                LEFT JOIN data_france_codepostal_communes dfcc
-                ON dfc.id = dfcc.commune_id
-                WHERE dfcc.commune_id IS NULL
+        cursor.execute('SELECT id, code FROM "data_france_departement";')
+        departements = cursor.fetchall()
+        cursor.execute('SELECT id, code FROM "data_france_region";')
+        regions = cursor.fetchall()
+        cursor.execute('SELECT id, code FROM "data_france_epci";')
+        epcis = cursor.fetchall()
+
+    durees = {}
+
+    with console_message(
+        "Calcul des géométries des secteurs électoraux, des départements et des EPCI"
+    ) as details:
+        unites = [
+            *(
+                Unite(
+                    f"secteur {secteur.code}",
+                    AGREGER_SECTEUR,
+                    {
+                        "arrondissements": list(secteur.arrondissements),
+                        "secteur": secteur.code,
+                    },
+                    EMPREINTE_SECTEUR,
+                )
+                for ville in VILLES_PLM
+                for secteur in ville.secteurs
+            ),
+            *(
+                Unite(
+                    f"département {code}",
+                    AGREGER_DEPARTEMENT,
+                    {"id": id},
+                    EMPREINTE_DEPARTEMENT,
+                )
+                for id, code in departements
+            ),
+            *(
+                Unite(f"EPCI {code}", AGREGER_EPCI, {"id": id}, EMPREINTE_EPCI)
+                for id, code in epcis
+            ),
+        ]
+        d = executer_unites(unites, using, jobs=jobs, forcer=forcer)
+        details.append(_resume_durees(d))
+        durees.update(d)
+
+    with console_message(
+        "Calcul des géométries des régions et des collectivités départementales"
+    ) as details:
+        unites = [
+            *(
+                Unite(f"région {code}", AGREGER_REGION, {"id": id}, EMPREINTE_REGION)
+                for id, code in regions
+            ),
+            Unite(
+                "collectivités départementales", AGREGER_COLLECTIVITES_DEPARTEMENTALES
+            ),
+            *(
+                Unite(
+                    f"collectivité {params['code_c']}",
+                    AGREGER_COLLECTIVITE_COMMUNES.format(communes=communes),
+                    params,
+                    empreinte,
+                )
+                for communes, params, empreinte in [
+                    (
+                        COMMUNES_METROPOLE_LYON,
+                        PARAMS_METROPOLE_LYON,
+                        EMPREINTE_METROPOLE_LYON,
+                    ),
+                    (COMMUNES_RHONE, PARAMS_RHONE, EMPREINTE_RHONE),
+                ]
+            ),
+            *(
+                Unite(
+                    f"collectivité {params['code_c']}",
+                    AGREGER_COLLECTIVITE_DEPARTEMENTS,
+                    params,
+                    EMPREINTE_COLLECTIVITE_DEPARTEMENTS,
+                )
+                for params in COLLECTIVITES_DEPARTEMENTS
             ),
-            deps AS (
-                SELECT dfc.id AS commune_id, dfd.nom AS nom, dfd.code AS code FROM data_france_commune dfc
-                LEFT JOIN data_france_departement dfd
-                ON dfc.departement_id = dfd.id
-
-                UNION
-
-                SELECT dfc.id AS commune_id, dfd.nom AS nom, dfd.code AS code FROM data_france_commune dfc
-                LEFT JOIN data_france_commune dfp
-                ON dfc.commune_parent_id = dfp.id
-                LEFT JOIN data_france_departement dfd
-                ON dfp.departement_id = dfd.id
+        ]
+        d = executer_unites(unites, using, jobs=jobs, forcer=forcer)
+        details.append(_resume_durees(d))
+        durees.update(d)
+
+    # seules les géométries simplifiées qui ont changé sont réécrites
+    with console_message("Calcul des géométries simplifiées") as details:
+        unites = [
+            Unite(
+                f"simplification {niveau} {table.removeprefix('data_france_')}",
+                SIMPLIFIER_GEOMETRIES.format(
+                    table=table,
+                    champ=f"geojson_{niveau}",
+                    tolerance=tolerance,
+                    decimales=decimales,
+                ),
             )
+            for table in TABLES_GEOMETRIES_SIMPLIFIEES
+            for niveau, (tolerance, decimales) in SIMPLIFICATIONS.items()
+        ]
+        d = executer_unites(unites, using, jobs=jobs)
+        details.append(_resume_durees(d))
+        durees.update(d)
+
+    with console_message("Calcul des populations"):
+        with get_connection(using).cursor() as cursor:
+            for requete, params in CALCULER_POPULATIONS:
+                cursor.execute(requete, params)
+
+    return durees
 
-            UPDATE data_france_commune AS dfc
-            SET search =
-                setweight(to_tsvector('data_france_search' :: regconfig, dfc.nom), 'A') ||
-                setweight(to_tsvector('data_france_search' :: regconfig, dfc.code), 'C') ||
-                setweight(COALESCE(cps.codes_postaux, '' :: tsvector), 'B') ||
-                setweight(to_tsvector(deps.code), 'C') ||
-                setweight(to_tsvector('data_france_search', deps.nom), 'D')
-            FROM cps, deps
-            WHERE dfc.id = cps.commune_id
-            AND dfc.id = deps.commune_id;
+
+# Les requêtes calculant le vecteur de recherche de chaque table : elles
+# doivent renvoyer une colonne `id` et une colonne `search`.
+INDEX_RECHERCHE = [
+    # L'index des communes
+    (
+        "data_france_commune",
         """
+        WITH cps AS (
+            SELECT data_france_tsvector_agg(code :: tsvector) AS codes_postaux, commune_id
+            FROM data_france_codepostal AS dfcp
+            INNER JOIN data_france_codepostal_communes AS dfcc
+            ON dfcp.id = dfcc.codepostal_id
+            GROUP BY commune_id
+
+            UNION
+
+            SELECT NULL AS codes_postaux, dfc.id AS commune_id
+            FROM data_france_commune dfc
+            LEFT JOIN data_france_codepostal_communes dfcc
+            ON dfc.id = dfcc.commune_id
+            WHERE dfcc.commune_id IS NULL
+        ),
+        deps AS (
+            -- les communes déléguées, associées et les arrondissements n'ont pas
+            -- de département propre : on utilise celui de la commune parente
+            SELECT
+                dfc.id AS commune_id,
+                COALESCE(dfd.nom, dfdp.nom) AS nom,
+                COALESCE(dfd.code, dfdp.code) AS code
+            FROM data_france_commune dfc
+            LEFT JOIN data_france_departement dfd
+            ON dfc.departement_id = dfd.id
+            LEFT JOIN data_france_commune dfp
+            ON dfc.commune_parent_id = dfp.id
+            LEFT JOIN data_france_departement dfdp
+            ON dfp.departement_id = dfdp.id
         )
 
-        # L'index des circonscriptions consulaires
-        cursor.execute(
-            """
-        UPDATE data_france_circonscriptionconsulaire c
-        SET search =
+        SELECT
+            dfc.id AS id,
+            setweight(to_tsvector('data_france_search' :: regconfig, dfc.nom), 'A') ||
+            setweight(to_tsvector('data_france_search' :: regconfig, dfc.code), 'C') ||
+            setweight(COALESCE(cps.codes_postaux, '' :: tsvector), 'B') ||
+            setweight(to_tsvector(deps.code), 'C') ||
+            setweight(to_tsvector('data_france_search', deps.nom), 'D')
+            AS search
+        FROM data_france_commune AS dfc, cps, deps
+        WHERE dfc.id = cps.commune_id
+        AND dfc.id = deps.commune_id
+        """,
+    ),
+    # L'index des circonscriptions consulaires
+    (
+        "data_france_circonscriptionconsulaire",
+        """
+        SELECT
+            c.id AS id,
             setweight(to_tsvector('data_france_search', COALESCE(c.nom, '')), 'A')
-         || setweight(to_tsvector('data_france_search', ARRAY_TO_STRING(c.consulats, ' ')), 'B');
-"""
-        )
-
-        # l'index des élus municipaux
-        cursor.execute(
-            """
-            WITH cps AS (
-                SELECT data_france_tsvector_agg(code :: tsvector) AS codes_postaux, commune_id
-                FROM data_france_codepostal AS dfcp
-                INNER JOIN data_france_codepostal_communes AS dfcc
-                ON dfcp.id = dfcc.codepostal_id
-                GROUP BY commune_id
-
-                UNION
-
-                SELECT NULL AS codes_postaux, dfc.id AS commune_id
-                FROM data_france_commune dfc
-                LEFT JOIN data_france_codepostal_communes dfcc
-                ON dfc.id = dfcc.commune_id
-                WHERE dfcc.commune_id IS NULL
-            ),
-            deps AS (
-                SELECT dfc.id AS commune_id, dfd.nom AS nom, dfd.code AS code FROM data_france_commune dfc
-                LEFT JOIN data_france_departement dfd
-                ON dfc.departement_id = dfd.id
-            )
-
-            UPDATE data_france_elumunicipal em
-            SET search =
-                   setweight(to_tsvector('data_france_search', COALESCE(em."nom", '')), 'A')
-                || setweight(to_tsvector('data_france_search', COALESCE(em."prenom", '')), 'A')
-                || setweight(to_tsvector('data_france_search', COALESCE(c."nom", '')), 'B')
-                || setweight(COALESCE(cps.codes_postaux, '' :: tsvector), 'C')
-                || setweight(to_tsvector(deps.code), 'C')
-                || setweight(to_tsvector('data_france_search', deps.nom), 'D')
-            FROM data_france_commune c, cps, deps
-            WHERE c.id = em.commune_id AND c.id = cps.commune_id AND c.id = deps.commune_id;"""
+         || setweight(to_tsvector('data_france_search', ARRAY_TO_STRING(c.consulats, ' ')), 'B')
+            AS search
+        FROM data_france_circonscriptionconsulaire c
+        """,
+    ),
+    # l'index des élus municipaux
+    (
+        "data_france_elumunicipal",
+        """
+        WITH cps AS (
+            SELECT data_france_tsvector_agg(code :: tsvector) AS codes_postaux, commune_id
+            FROM data_france_codepostal AS dfcp
+            INNER JOIN data_france_codepostal_communes AS dfcc
+            ON dfcp.id = dfcc.codepostal_id
+            GROUP BY commune_id
+
+            UNION
+
+            SELECT NULL AS codes_postaux, dfc.id AS commune_id
+            FROM data_france_commune dfc
+            LEFT JOIN data_france_codepostal_communes dfcc
+            ON dfc.id = dfcc.commune_id
+            WHERE dfcc.commune_id IS NULL
+        ),
+        deps AS (
+            SELECT dfc.id AS commune_id, dfd.nom AS nom, dfd.code AS code FROM data_france_commune dfc
+            LEFT JOIN data_france_departement dfd
+            ON dfc.departement_id = dfd.id
         )
 
-        # l'index des élus départementaux
-        cursor.execute(
-            """
-        UPDATE data_france_eludepartemental e
-        SET search = setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+        SELECT
+            em.id AS id,
+               setweight(to_tsvector('data_france_search', COALESCE(em."nom", '')), 'A')
+            || setweight(to_tsvector('data_france_search', COALESCE(em."prenom", '')), 'A')
+            || setweight(to_tsvector('data_france_search', COALESCE(c."nom", '')), 'B')
+            || setweight(COALESCE(cps.codes_postaux, '' :: tsvector), 'C')
+            || setweight(to_tsvector(deps.code), 'C')
+            || setweight(to_tsvector('data_france_search', deps.nom), 'D')
+            AS search
+        FROM data_france_elumunicipal em, data_france_commune c, cps, deps
+        WHERE c.id = em.commune_id AND c.id = cps.commune_id AND c.id = deps.commune_id
+        """,
+    ),
+    # l'index des élus départementaux
+    (
+        "data_france_eludepartemental",
+        """
+        SELECT
+            e.id AS id,
+            setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE(c."nom", '')), 'B')
          || setweight(to_tsvector('data_france_search', COALESCE(d."nom", '')), 'C')
          || setweight(to_tsvector('data_france_search', COALESCE(d."code", '')), 'C')
-        FROM data_france_canton c, data_france_departement d
+            AS search
+        FROM data_france_eludepartemental e, data_france_canton c, data_france_departement d
         WHERE c.id = e.canton_id
           AND d.id = c.departement_id
+        """,
+    ),
+    # l'index des élus régionaux
+    (
+        "data_france_eluregional",
         """
-        )
-
-        # l'index des élus régionaux
-        cursor.execute(
-            """
-        UPDATE data_france_eluregional e
-        SET search =
+        SELECT
+            e.id AS id,
             setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE(r."nom", '')), 'B')
-        FROM data_france_collectiviteregionale cr
+            AS search
+        FROM data_france_eluregional e
+        JOIN data_france_collectiviteregionale cr ON e.collectivite_regionale_id = cr.id
         LEFT JOIN data_france_region r ON cr.region_id = r.id
-        WHERE e.collectivite_regionale_id = cr.id
+        """,
+    ),
+    # l'index des députés
+    # Il y a des circonscriptions sans départements (français de l'étranger
+    # et collectivités d'outremer), d'où l'obligation de recourir à une
+    # sous-requête pour pouvoir faire une jointure à gauche
+    (
+        "data_france_depute",
         """
-        )
-
-        # l'index des députés
-        # Il y a des circonscriptions sans départements (français de l'étranger
-        # et collectivités d'outremer), d'où l'obligation de recourir à une
-        # sous-requête pour pouvoir faire une jointure à gauche
-        cursor.execute(
-            """
         WITH circonscription AS (
           SELECT
             c.id AS id,
@@ -482,39 +1055,173 @@ def creer_index_recherche(using):
           FROM data_france_circonscriptionlegislative c
           LEFT JOIN data_france_departement d ON c.departement_id = d.id
         )
-        UPDATE data_france_depute e
-        SET search =
+        SELECT
+            e.id AS id,
             setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
          || c.search
-        FROM circonscription c
+            AS search
+        FROM data_france_depute e, circonscription c
         WHERE c.id = e.circonscription_id
+        """,
+    ),
+    # l'index des députés européens
+    (
+        "data_france_deputeeuropeen",
         """
-        )
-
-        # l'index des députés européens
-        cursor.execute(
-            """
-        UPDATE data_france_deputeeuropeen
-        SET search =
+        SELECT
+            id,
             setweight(to_tsvector('data_france_search', COALESCE("nom", '')), 'A')
          || setweight(to_tsvector('data_france_search', COALESCE("prenom", '')), 'A')
-        """
+            AS search
+        FROM data_france_deputeeuropeen
+        """,
+    ),
+]
+
+# Les autres tables dont dépend le vecteur de recherche de chaque table. Le
+# vecteur d'une commune dépend aussi de sa commune parente : la table des
+# communes figure donc parmi ses propres dépendances.
+DEPENDANCES_RECHERCHE = {
+    "data_france_commune": (
+        "data_france_commune",
+        "data_france_codepostal",
+        "data_france_codepostal_communes",
+        "data_france_departement",
+    ),
+    "data_france_circonscriptionconsulaire": (),
+    "data_france_elumunicipal": (
+        "data_france_commune",
+        "data_france_codepostal",
+        "data_france_codepostal_communes",
+        "data_france_departement",
+    ),
+    "data_france_eludepartemental": ("data_france_canton", "data_france_departement"),
+    "data_france_eluregional": (
+        "data_france_collectiviteregionale",
+        "data_france_region",
+    ),
+    "data_france_depute": (
+        "data_france_circonscriptionlegislative",
+        "data_france_departement",
+    ),
+    "data_france_deputeeuropeen": (),
+}
+
+# Seules les lignes dont le vecteur de recherche change sont réécrites, sauf
+# si l'on demande explicitement une réindexation complète.
+METTRE_A_JOUR_RECHERCHE = SQL(
+    """
+    WITH nouveaux AS (SELECT * FROM ({requete}) AS r{restriction})
+    UPDATE {table} AS t
+    SET search = nouveaux.search
+    FROM nouveaux
+    WHERE t.id = nouveaux.id{filtre};
+    """
+)
+
+FILTRE_RECHERCHE_MODIFIEE = SQL(" AND t.search IS DISTINCT FROM nouveaux.search")
+
+# limite le calcul des vecteurs aux lignes modifiées par l'import
+RESTRICTION_RECHERCHE = SQL(" WHERE r.id = ANY(%(ids)s)")
+
+
+def _lignes_a_indexer(table, modifications):
+    """Les identifiants des lignes dont le vecteur de recherche peut avoir changé
+
+    Renvoie `None` si toutes les lignes doivent être recalculées, c'est-à-dire si
+    l'on ignore ce que l'import a modifié ou si l'une des tables dont dépend le
+    vecteur a changé.
+    """
+    if modifications is None:
+        return None
+
+    for dependance in DEPENDANCES_RECHERCHE[table]:
+        # une table absente n'a pas été importée de façon incrémentale
+        if modifications.get(dependance) != []:
+            return None
+
+    return modifications.get(table)
+
+
+def creer_index_recherche(using, reindexation_complete=False, modifications=None):
+    """Met à jour les vecteurs de recherche
+
+    Par défaut, seules les lignes dont le vecteur de recherche a changé sont
+    réécrites.
+
+    :param modifications: les identifiants des lignes modifiées par un import
+        incrémental, par table ; s'il est fourni, le vecteur de recherche n'est
+        recalculé que pour les lignes concernées.
+    :return: le nombre de lignes mises à jour, par table
+    """
+    filtre = SQL("") if reindexation_complete else FILTRE_RECHERCHE_MODIFIEE
+    if reindexation_complete:
+        modifications = None
+    mises_a_jour = {}
+
+    with console_message("Mise à jour de l'index de recherche") as details:
+        with get_connection(using).cursor() as cursor:
+            for table, requete in INDEX_RECHERCHE:
+                ids = _lignes_a_indexer(table, modifications)
+                if ids == []:
+                    mises_a_jour[table] = 0
+                    continue
+
+                cursor.execute(
+                    METTRE_A_JOUR_RECHERCHE.format(
+                        requete=SQL(requete),
+                        table=Identifier(table),
+                        filtre=filtre,
+                        restriction=(SQL("") if ids is None else RESTRICTION_RECHERCHE),
+                    ),
+                    None if ids is None else {"ids": ids},
+                )
+                mises_a_jour[table] = cursor.rowcount
+
+        details.extend(
+            f"{t.removeprefix('data_france_')} : {n}" for t, n in mises_a_jour.items()
         )
 
+    return mises_a_jour
+
+
+def import_with_temp_table(
+    csv_file,
+    table,
+    using,
+    marquer_inactif=False,
+    taille_bloc=TAILLE_BLOC,
+    incremental=False,
+    binaire=False,
+):
+    """Importe un fichier CSV dans une table en passant par une table temporaire
+
+    En mode incrémental, seules les lignes qui diffèrent de celles déjà présentes
+    sont écrites, et la fonction renvoie un :py:class:`BilanImport` décomptant
+    les lignes insérées, mises à jour, inchangées et désactivées.
 
-def import_with_temp_table(csv_file, table, using, marquer_inactif=False):
+    Avec `binaire`, le fichier (ouvert en mode binaire) est au format COPY
+    binaire décrit dans :py:mod:`data_france.data.copie_binaire`.
+    """
     temp_table = f"{table}_temp"
-    columns = csv_file.readline().strip().split(",")
+    if binaire:
+        types = lire_entete(csv_file)
+        columns = list(types)
+        copy_sql = COPY_BINAIRE_SQL
+    else:
+        types = None
+        columns = csv_file.readline().strip().split(",")
+        copy_sql = COPY_SQL
 
     with get_connection(using).cursor() as cursor, temporary_table(
-        cursor, temp_table, table, columns
+        cursor, temp_table, table, columns, types
     ):
-        with cursor.copy(COPY_SQL.format(
+        with cursor.copy(copy_sql.format(
                 table=Identifier(temp_table),
                 columns=SQL(",").join(Identifier(c) for c in columns),
         )) as copy:
-            copy.write(csv_file.read())
+            copier_par_blocs(copy, csv_file, taille_bloc)
 
         setters = [
             Identifier(c) + SQL(" = ") + Identifier("excluded", c) for c in columns[1:]
@@ -527,16 +1234,39 @@ def import_with_temp_table(csv_file, table, using, marquer_inactif=False):
             column_list = [*column_list, Identifier("actif")]
             setters.append(Identifier("actif") + SQL(" = true"))
 
-        cursor.execute(
-            COPY_FROM_TEMP_TABLE.format(
-                table=Identifier(table),
-                temp_table=Identifier(temp_table),
-                column_list=SQL(",").join(column_list),
-                select_list=SQL(",").join(select_list),
-                id_column=Identifier(columns[0]),
-                setters=SQL(",").join(setters),
-            ),
-        )
+        params = {
+            "table": Identifier(table),
+            "temp_table": Identifier(temp_table),
+            "column_list": SQL(",").join(column_list),
+            "select_list": SQL(",").join(select_list),
+            "id_column": Identifier(columns[0]),
+            "setters": SQL(",").join(setters),
+        }
+
+        bilan = BilanImport()
+
+        if incremental:
+            condition = SQL(" IS DISTINCT FROM ").join(
+                EMPREINTE_LIGNE.format(
+                    columns=SQL(",").join(Identifier(t, c) for c in columns[1:])
+                )
+                for t in ["existant", "excluded"]
+            )
+            if marquer_inactif:
+                condition = condition + SQL(" OR NOT ") + Identifier("existant", "actif")
+
+            cursor.execute(
+                COPY_FROM_TEMP_TABLE_INCREMENTAL.format(**params, condition=condition)
+            )
+            (
+                bilan.inseres,
+                bilan.mis_a_jour,
+                total,
+                bilan.ids_modifies,
+            ) = cursor.fetchone()
+            bilan.inchanges = total - bilan.inseres - bilan.mis_a_jour
+        else:
+            cursor.execute(COPY_FROM_TEMP_TABLE.format(**params))
 
         if marquer_inactif:
             cursor.execute(
@@ -544,141 +1274,378 @@ def import_with_temp_table(csv_file, table, using, marquer_inactif=False):
                     table=Identifier(table), temp_table=Identifier(temp_table)
                 )
             )
+            bilan.desactives = cursor.rowcount
+
+    return bilan
+
+
+def import_standard(
+    data_file,
+    table,
+    message,
+    marquer_inactif=False,
+    using=None,
+    taille_bloc=TAILLE_BLOC,
+    incremental=False,
+):
+    # le fichier COPY binaire, s'il existe, remplace le fichier CSV
+    copie = trouver_fichier(fichier_copie(data_file))
+
+    with console_message(message) as details:
+        with ouvrir_donnees(copie or data_file, "rb" if copie else "rt") as f:
+            bilan = import_with_temp_table(
+                f,
+                table,
+                marquer_inactif=marquer_inactif,
+                using=using,
+                taille_bloc=taille_bloc,
+                incremental=incremental,
+                binaire=copie is not None,
+            )
+        if incremental:
+            details.append(bilan)
 
+        geometries = trouver_fichier(fichier_geometries(data_file))
+        if geometries is not None:
+            with ouvrir_donnees(geometries) as f:
+                modifiees = importer_geometries(f, table, using=using)
+            if incremental:
+                details.append(f"{modifiees} géométries modifiées")
+    return bilan
 
-def import_standard(lzma_file, table, message, marquer_inactif=False, using=None):
-    with console_message(message):
-        with open_binary("data_france.data", lzma_file) as _f, lzma.open(_f, "rt") as f:
-            import_with_temp_table(
-                f, table, marquer_inactif=marquer_inactif, using=using
-            )
 
+def importer_geometries(f, table, using):
+    """Charge les géométries d'un fichier binaire dans la colonne `geometry`
 
-def importer_donnees(using=None):
-    auto_commit = transaction.get_autocommit(using=using)
-    if not auto_commit:
-        transaction.set_autocommit(True, using=using)
+    Les couples (id, WKB) sont envoyés en COPY binaire dans une table
+    temporaire : PostgreSQL n'a ainsi ni CSV ni hexadécimal à analyser.
 
-    try:
-        # à importer avant les communes
-        import_standard(
-            "epci.csv.lzma", "data_france_epci", "Chargement des EPCI", using=using
-        )
+    :param f: le fichier de géométries, décompressé
+    :return: le nombre de lignes dont la géométrie a été modifiée
+    """
+    lecteur = LecteurGeometries(f)
+    temp_table = Identifier(f"{table}_geometries_temp")
+    params = {"table": Identifier(table), "temp_table": temp_table}
 
-        # ces trois tables ont des foreign key croisées
-        # Django crée les contraintes de clés étrangères
-        # en mode "différable", ce qui permet d'importer
-        # facilement ces tables en les groupant dans une
-        # transaction
-        with transaction.atomic():
-            import_standard(
-                "regions.csv.lzma",
-                "data_france_region",
-                "Chargement des régions",
-                using=using,
-            )
-            import_standard(
+    with get_connection(using).cursor() as cursor:
+        cursor.execute(CREATE_TEMP_TABLE_GEOMETRIES_SQL.format(**params))
+        try:
+            with cursor.copy(COPY_GEOMETRIES_SQL.format(**params)) as copy:
+                copy.set_types(["int4", "bytea"])
+                for ligne in lecteur:
+                    copy.write_row(ligne)
+
+            cursor.execute(METTRE_A_JOUR_GEOMETRIES.format(**params))
+            modifiees = cursor.rowcount
+            cursor.execute(SUPPRIMER_GEOMETRIES.format(**params))
+            modifiees += cursor.rowcount
+        finally:
+            cursor.execute(DROP_TEMPORARY_TABLE_SQL.format(temp_table=temp_table))
+
+    return modifiees
+
+
+@dataclass
+class Fichier:
+    fichier: str
+    table: str
+    message: str
+    marquer_inactif: bool = False
+
+
+@dataclass
+class Etape:
+    """Une étape de l'import des données
+
+    Les fichiers d'une même étape sont importés dans une seule transaction ;
+    une étape n'est lancée qu'une fois toutes ses dépendances importées.
+    """
+
+    nom: str
+    fichiers: Tuple[Fichier, ...] = ()
+    dependances: Tuple[str, ...] = ()
+    fonction: Optional[Callable] = None
+
+
+ETAPES_IMPORT = [
+    # à importer avant les communes
+    Etape(
+        "epci",
+        (Fichier("epci.csv.lzma", "data_france_epci", "Chargement des EPCI"),),
+    ),
+    # ces trois tables ont des foreign key croisées
+    # Django crée les contraintes de clés étrangères
+    # en mode "différable", ce qui permet d'importer
+    # facilement ces tables en les groupant dans une
+    # transaction
+    Etape(
+        "communes",
+        (
+            Fichier("regions.csv.lzma", "data_france_region", "Chargement des régions"),
+            Fichier(
                 "departements.csv.lzma",
                 "data_france_departement",
                 "Chargement des départements",
+            ),
+            Fichier(
+                "communes.csv.lzma", "data_france_commune", "Chargement des communes"
+            ),
+        ),
+        dependances=("epci",),
+    ),
+    Etape(
+        "collectivites_departementales",
+        (
+            Fichier(
+                "collectivites_departementales.csv.lzma",
+                "data_france_collectivitedepartementale",
+                "Chargement des collectivités départementales",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("communes",),
+    ),
+    Etape(
+        "collectivites_regionales",
+        (
+            Fichier(
+                "collectivites_regionales.csv.lzma",
+                "data_france_collectiviteregionale",
+                "Chargement des collectivités régionales",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("communes",),
+    ),
+    Etape(
+        "codes_postaux",
+        (
+            Fichier(
+                "codes_postaux.csv.lzma",
+                "data_france_codepostal",
+                "Chargement des codes postaux",
+            ),
+        ),
+    ),
+    Etape(
+        "codes_postaux_communes",
+        dependances=("codes_postaux", "communes"),
+        fonction=importer_associations_communes_codes_postaux,
+    ),
+    Etape(
+        "cantons",
+        (Fichier("cantons.csv.lzma", "data_france_canton", "Chargement des cantons"),),
+        dependances=("communes", "collectivites_departementales"),
+    ),
+    Etape(
+        "circonscriptions_legislatives",
+        (
+            Fichier(
+                "circonscriptions_legislatives.csv.lzma",
+                "data_france_circonscriptionlegislative",
+                "Chargement des circonscriptions législatives",
+            ),
+        ),
+        dependances=("communes",),
+    ),
+    Etape(
+        "circonscriptions_consulaires",
+        (
+            Fichier(
+                "circonscriptions_consulaires.csv.lzma",
+                "data_france_circonscriptionconsulaire",
+                "Chargement des circonscriptions consulaires",
+            ),
+        ),
+        dependances=("circonscriptions_legislatives",),
+    ),
+    Etape(
+        "elus_municipaux",
+        (
+            Fichier(
+                "elus_municipaux.csv.lzma",
+                "data_france_elumunicipal",
+                "Chargement des élus municipaux",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("communes",),
+    ),
+    Etape(
+        "elus_departementaux",
+        (
+            Fichier(
+                "elus_departementaux.csv.lzma",
+                "data_france_eludepartemental",
+                "Chargement des élus départementaux",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("cantons",),
+    ),
+    Etape(
+        "elus_regionaux",
+        (
+            Fichier(
+                "elus_regionaux.csv.lzma",
+                "data_france_eluregional",
+                "Chargement des élus régionaux",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("collectivites_regionales", "collectivites_departementales"),
+    ),
+    Etape(
+        "deputes",
+        (
+            Fichier(
+                "deputes.csv.lzma",
+                "data_france_depute",
+                "Chargement des députés",
+                marquer_inactif=True,
+            ),
+        ),
+        dependances=("circonscriptions_legislatives",),
+    ),
+    Etape(
+        "deputes_europeens",
+        (
+            Fichier(
+                "deputes_europeens.csv.lzma",
+                "data_france_deputeeuropeen",
+                "Chargement des députés européens",
+                marquer_inactif=True,
+            ),
+        ),
+    ),
+]
+
+
+def executer_etape(etape, using, taille_bloc=TAILLE_BLOC, incremental=False):
+    """Exécute une étape d'import
+
+    :return: les identifiants des lignes insérées ou modifiées, par table, ou
+        `None` pour une table qui n'a pas été importée de façon incrémentale
+    """
+    if etape.fonction is not None:
+        return etape.fonction(using, taille_bloc=taille_bloc)
+
+    modifications = {}
+    with transaction.atomic(using=using):
+        for f in etape.fichiers:
+            bilan = import_standard(
+                f.fichier,
+                f.table,
+                f.message,
+                marquer_inactif=f.marquer_inactif,
                 using=using,
+                taille_bloc=taille_bloc,
+                incremental=incremental,
             )
-            import_standard(
-                "communes.csv.lzma",
-                "data_france_commune",
-                "Chargement des communes",
-                using=using,
-            )
+            modifications[f.table] = bilan.ids_modifies
+    return modifications
 
-        import_standard(
-            "collectivites_departementales.csv.lzma",
-            "data_france_collectivitedepartementale",
-            "Chargement des collectivités départementales",
-            marquer_inactif=True,
-            using=using,
-        )
 
-        import_standard(
-            "collectivites_regionales.csv.lzma",
-            "data_france_collectiviteregionale",
-            "Chargement des collectivités régionales",
-            marquer_inactif=True,
-            using=using,
-        )
+def _executer_etape_thread(etape, using, **options):
+    # chaque thread utilise sa propre connexion, qu'il faut refermer
+    try:
+        return executer_etape(etape, using, **options)
+    finally:
+        connections.close_all()
 
-        import_standard(
-            "codes_postaux.csv.lzma",
-            "data_france_codepostal",
-            "Chargement des codes postaux",
-            using=using,
-        )
 
-        importer_associations_communes_codes_postaux(using)
+def executer_etapes(etapes, using, jobs=1, **options):
+    """Exécute les étapes d'import en respectant leurs dépendances
 
-        import_standard(
-            "cantons.csv.lzma",
-            "data_france_canton",
-            "Chargement des cantons",
-            using=using,
-        )
+    Avec `jobs` supérieur à 1, les étapes indépendantes sont importées en
+    parallèle, chacune sur sa propre connexion.
 
-        import_standard(
-            "circonscriptions_legislatives.csv.lzma",
-            "data_france_circonscriptionlegislative",
-            "Chargement des circonscriptions législatives",
-            using=using,
-        )
+    :return: les identifiants des lignes modifiées, par table (voir
+        :py:func:`executer_etape`)
+    """
+    modifications = {}
+
+    if jobs <= 1:
+        for etape in etapes:
+            modifications.update(executer_etape(etape, using, **options))
+        return modifications
+
+    restantes = list(etapes)
+    terminees = set()
+    en_cours = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while restantes or en_cours:
+            pretes = [e for e in restantes if terminees.issuperset(e.dependances)]
+            for etape in pretes:
+                restantes.remove(etape)
+                future = executor.submit(
+                    _executer_etape_thread, etape, using, **options
+                )
+                en_cours[future] = etape
 
-        import_standard(
-            "circonscriptions_consulaires.csv.lzma",
-            "data_france_circonscriptionconsulaire",
-            "Chargement des circonscriptions consulaires",
-            using=using,
-        )
+            if not en_cours:
+                raise ValueError(
+                    f"Dépendances impossibles à satisfaire pour les étapes "
+                    f"{', '.join(e.nom for e in restantes)}"
+                )
 
-        import_standard(
-            "elus_municipaux.csv.lzma",
-            "data_france_elumunicipal",
-            "Chargement des élus municipaux",
-            marquer_inactif=True,
-            using=using,
-        )
+            finies, _ = wait(en_cours, return_when=FIRST_COMPLETED)
+            for future in finies:
+                etape = en_cours.pop(future)
+                # propage les éventuelles exceptions levées par l'étape
+                modifications.update(future.result())
+                terminees.add(etape.nom)
 
-        import_standard(
-            "elus_departementaux.csv.lzma",
-            "data_france_eludepartemental",
-            "Chargement des élus départementaux",
-            marquer_inactif=True,
-            using=using,
-        )
+    return modifications
 
-        import_standard(
-            "elus_regionaux.csv.lzma",
-            "data_france_eluregional",
-            "Chargement des élus régionaux",
-            marquer_inactif=True,
-            using=using,
-        )
 
-        import_standard(
-            "deputes.csv.lzma",
-            "data_france_depute",
-            "Chargement des députés",
-            marquer_inactif=True,
-            using=using,
+def importer_donnees(
+    using=None,
+    taille_bloc=TAILLE_BLOC,
+    incremental=False,
+    jobs=1,
+    reindexation_complete=False,
+    recalculer_geometries=False,
+):
+    from data_france.cache import enregistrer_version_donnees
+
+    auto_commit = transaction.get_autocommit(using=using)
+    if not auto_commit:
+        transaction.set_autocommit(True, using=using)
+
+    try:
+        with console_message("Triggers de l'index de recherche") as details:
+            if synchroniser_triggers_recherche(using):
+                details.append(
+                    "installés" if triggers_recherche_installes(using) else "supprimés"
+                )
+
+        modifications = executer_etapes(
+            ETAPES_IMPORT,
+            using,
+            jobs=jobs,
+            taille_bloc=taille_bloc,
+            incremental=incremental,
         )
 
-        import_standard(
-            "deputes_europeens.csv.lzma",
-            "data_france_deputeeuropeen",
-            "Chargement des députés européens",
-            marquer_inactif=True,
-            using=using,
+        agreger_geometries_et_populations(
+            using, jobs=jobs, forcer=recalculer_geometries
         )
 
-        agreger_geometries_et_populations(using)
+        # les triggers maintiennent déjà les vecteurs de recherche à jour
+        if reindexation_complete or not triggers_recherche_installes(using):
+            creer_index_recherche(
+                using,
+                reindexation_complete=reindexation_complete,
+                modifications=modifications,
+            )
 
-        creer_index_recherche(using)
+        # invalide les réponses mises en cache par les vues si les données ont
+        # changé
+        with console_message("Calcul de la version des données") as details:
+            version = enregistrer_version_donnees(using, empreintes_tables(using))
+            details.append(version.identifiant)
 
     finally:
         if not auto_commit:
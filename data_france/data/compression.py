@@ -0,0 +1,116 @@
+"""Compression des fichiers de données du paquet
+
+Les fichiers de données peuvent être compressés en LZMA (`communes.csv.lzma`)
+ou en Zstandard (`communes.csv.zst`), bien plus rapide à décompresser. Le
+format est choisi au build ; à l'import, le fichier présent dans le paquet est
+trouvé quelle que soit son extension, et le format est détecté d'après les
+premiers octets du fichier.
+
+La lecture et l'écriture en Zstandard nécessitent le paquet `zstandard`, qui
+n'est pas une dépendance obligatoire de data-france (extra `zstd`).
+"""
+import contextlib
+import io
+import lzma
+from importlib.resources import is_resource, open_binary
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {"lzma": ".lzma", "zstd": ".zst"}
+
+SIGNATURES = {"lzma": b"\xfd7zXZ\x00", "zstd": b"\x28\xb5\x2f\xfd"}
+
+# niveau de compression utilisé à l'écriture
+NIVEAUX = {"lzma": 6, "zstd": 19}
+
+
+class FormatCompressionInconnu(ValueError):
+    pass
+
+
+def nom_sans_compression(nom):
+    """Retire l'extension de compression d'un nom de fichier"""
+    for extension in EXTENSIONS.values():
+        if nom.endswith(extension):
+            return nom[: -len(extension)]
+    return nom
+
+
+def codec_du_nom(nom):
+    """Renvoie le format de compression correspondant à l'extension du fichier"""
+    for codec, extension in EXTENSIONS.items():
+        if str(nom).endswith(extension):
+            return codec
+    raise FormatCompressionInconnu(f"Extension de compression inconnue : {nom}")
+
+
+def detecter_codec(debut: bytes):
+    """Renvoie le format de compression d'après les premiers octets du fichier"""
+    for codec, signature in SIGNATURES.items():
+        if debut.startswith(signature):
+            return codec
+    raise FormatCompressionInconnu("Format de compression non reconnu.")
+
+
+def _verifier_zstandard():
+    if zstandard is None:
+        raise ImportError(
+            "Le paquet zstandard est nécessaire pour les fichiers compressés "
+            "en Zstandard."
+        )
+
+
+def ouvrir(f, mode="rb", codec=None, **kwargs):
+    """Ouvre un fichier compressé, comme `lzma.open`
+
+    :param f: un chemin ou un fichier binaire déjà ouvert
+    :param codec: le format de compression ; par défaut, il est détecté à partir
+        du contenu en lecture, et de l'extension du nom en écriture
+    """
+    if codec is None:
+        taille_signature = max(map(len, SIGNATURES.values()))
+        if "r" not in mode:
+            codec = codec_du_nom(f)
+        elif hasattr(f, "read"):
+            if not hasattr(f, "peek"):
+                f = io.BufferedReader(f)
+            codec = detecter_codec(f.peek(taille_signature))
+        else:
+            with open(f, "rb") as brut:
+                codec = detecter_codec(brut.read(taille_signature))
+
+    if codec == "lzma":
+        if "w" in mode:
+            kwargs.setdefault("preset", NIVEAUX["lzma"])
+        return lzma.open(f, mode, **kwargs)
+
+    _verifier_zstandard()
+    if "w" in mode:
+        kwargs.setdefault("cctx", zstandard.ZstdCompressor(level=NIVEAUX["zstd"]))
+    return zstandard.open(f, mode, **kwargs)
+
+
+def trouver_fichier(nom, package="data_france.data") -> Optional[str]:
+    """Renvoie le nom du fichier de données présent dans le paquet, ou None
+
+    :param nom: le nom du fichier, avec ou sans extension de compression
+    """
+    base = nom_sans_compression(nom)
+    for extension in EXTENSIONS.values():
+        if is_resource(package, base + extension):
+            return base + extension
+    return None
+
+
+@contextlib.contextmanager
+def ouvrir_donnees(nom, mode="rb", package="data_france.data", **kwargs):
+    """Ouvre un fichier de données du paquet, quel que soit son format de compression"""
+    trouve = trouver_fichier(nom, package)
+    if trouve is None:
+        raise FileNotFoundError(f"Fichier de données introuvable : {nom}")
+    with open_binary(package, trouve) as _f, ouvrir(_f, mode, **kwargs) as f:
+        yield f
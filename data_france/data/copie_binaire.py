@@ -0,0 +1,208 @@
+"""Fichiers de données au format COPY binaire de PostgreSQL
+
+Au format CSV, PostgreSQL doit analyser le texte de chaque entier, date ou
+géométrie (en WKB hexadécimal). Les fichiers au format COPY binaire
+(`communes.copy.lzma`, par exemple) contiennent au contraire les valeurs déjà
+encodées dans la représentation binaire de PostgreSQL, et sont chargés avec
+`COPY ... (FORMAT BINARY)`.
+
+Une fois décompressé, le fichier commence par une ligne d'en-tête donnant le
+nom et le type de chaque colonne (`id:integer,code:character varying,...`),
+suivie d'un flux COPY binaire standard. Les types, qui doivent faire partie de
+:py:data:`ENCODEURS`, servent à créer la table temporaire de l'import : celle-ci
+reçoit donc exactement les types encodés, et la conversion vers les types de
+la table finale est faite par PostgreSQL lors de l'insertion.
+"""
+import csv
+import struct
+from datetime import date
+from typing import BinaryIO, Dict, Iterable, Iterator, Mapping, TextIO
+
+NULL = r"\N"
+
+SIGNATURE_COPIE = b"PGCOPY\n\xff\r\n\x00"
+EN_TETE_COPIE = SIGNATURE_COPIE + struct.pack("!ii", 0, 0)
+FIN_COPIE = struct.pack("!h", -1)
+
+EPOQUE_POSTGRES = date(2000, 1, 1).toordinal()
+
+
+def _texte(v):
+    return str(v).encode()
+
+
+def _entier(format):
+    s = struct.Struct(format)
+    return lambda v: s.pack(int(v))
+
+
+def _booleen(v):
+    return b"\x01" if str(v).lower() in ("t", "true", "1") else b"\x00"
+
+
+def _date(v):
+    return struct.pack("!i", date.fromisoformat(str(v)).toordinal() - EPOQUE_POSTGRES)
+
+
+def _jsonb(v):
+    # le premier octet donne la version du format binaire de jsonb
+    return b"\x01" + str(v).encode()
+
+
+def _wkb(v):
+    # geography_recv accepte directement le WKB (ou EWKB)
+    return v if isinstance(v, bytes) else bytes.fromhex(v)
+
+
+# types acceptés, nommés comme par la fonction format_type de PostgreSQL
+ENCODEURS = {
+    "smallint": _entier("!h"),
+    "integer": _entier("!i"),
+    "bigint": _entier("!q"),
+    "double precision": lambda v: struct.pack("!d", float(v)),
+    "boolean": _booleen,
+    "text": _texte,
+    "character varying": _texte,
+    "date": _date,
+    "jsonb": _jsonb,
+    "bytea": _wkb,
+    "geography": _wkb,
+}
+
+
+class FormatCopieInvalide(ValueError):
+    pass
+
+
+def _lire_entier(format):
+    s = struct.Struct(format)
+    return lambda contenu: s.unpack(contenu)[0]
+
+
+# seuls les types nécessaires à la relecture des fichiers sont décodés, les
+# autres valeurs sont renvoyées telles quelles
+DECODEURS = {
+    "smallint": _lire_entier("!h"),
+    "integer": _lire_entier("!i"),
+    "bigint": _lire_entier("!q"),
+    "text": bytes.decode,
+    "character varying": bytes.decode,
+}
+
+
+def fichier_copie(fichier_csv):
+    """Renvoie le nom du fichier COPY binaire associé à un fichier CSV"""
+    return fichier_csv.replace(".csv.", ".copy.")
+
+
+def lire_entete(f: BinaryIO) -> Dict[str, str]:
+    """Lit la ligne d'en-tête et renvoie le type de chaque colonne, dans l'ordre"""
+    colonnes = {}
+    for colonne in f.readline().decode().strip().split(","):
+        nom, _, type = colonne.partition(":")
+        if type not in ENCODEURS:
+            raise FormatCopieInvalide(f"Type inconnu pour la colonne {nom} : {type!r}")
+        colonnes[nom] = type
+    return colonnes
+
+
+def _lire_exactement(f: BinaryIO, taille):
+    contenu = f.read(taille)
+    if len(contenu) != taille:
+        raise FormatCopieInvalide("Fichier COPY binaire tronqué.")
+    return contenu
+
+
+def lire_copie(f: BinaryIO) -> Iterator[Dict[str, object]]:
+    """Relit un fichier COPY binaire ligne par ligne
+
+    :return: un itérateur de dictionnaires ; les valeurs NULL valent None, et
+        les valeurs dont le type n'a pas de décodeur sont renvoyées en `bytes`
+    """
+    types = lire_entete(f)
+    if _lire_exactement(f, len(EN_TETE_COPIE))[: len(SIGNATURE_COPIE)] != (
+        SIGNATURE_COPIE
+    ):
+        raise FormatCopieInvalide("Signature de flux COPY binaire invalide.")
+
+    decodeurs = [(c, DECODEURS.get(t, bytes)) for c, t in types.items()]
+    while True:
+        (nombre,) = struct.unpack("!h", _lire_exactement(f, 2))
+        if nombre == -1:
+            return
+        if nombre != len(decodeurs):
+            raise FormatCopieInvalide(
+                f"{nombre} colonnes au lieu des {len(decodeurs)} annoncées."
+            )
+
+        ligne = {}
+        for colonne, decodeur in decodeurs:
+            (taille,) = struct.unpack("!i", _lire_exactement(f, 4))
+            ligne[colonne] = (
+                None if taille == -1 else decodeur(_lire_exactement(f, taille))
+            )
+        yield ligne
+
+
+class EcrivainCopieBinaire:
+    """Écrit des lignes au format COPY binaire, comme le ferait `csv.DictWriter`
+
+    Les valeurs sont données telles qu'elles seraient écrites dans un CSV :
+    seul `\\N` correspond à NULL, et None ou une colonne absente donnent une
+    chaîne vide.
+    """
+
+    def __init__(self, f: BinaryIO, types: Mapping[str, str], extrasaction="raise"):
+        inconnus = [t for t in types.values() if t not in ENCODEURS]
+        if inconnus:
+            raise FormatCopieInvalide(f"Types inconnus : {', '.join(inconnus)}")
+
+        self.f = f
+        self.types = dict(types)
+        self.fieldnames = list(self.types)
+        self.extrasaction = extrasaction
+        self._encodeurs = [ENCODEURS[t] for t in self.types.values()]
+        self._nombre = struct.pack("!h", len(self.fieldnames))
+
+    def writeheader(self):
+        self.f.write(
+            ",".join(f"{c}:{t}" for c, t in self.types.items()).encode() + b"\n"
+        )
+        self.f.write(EN_TETE_COPIE)
+
+    def writerow(self, ligne: Mapping):
+        if self.extrasaction == "raise":
+            extras = set(ligne).difference(self.fieldnames)
+            if extras:
+                raise ValueError(f"Colonnes inconnues : {', '.join(extras)}")
+
+        morceaux = [self._nombre]
+        for nom, encoder in zip(self.fieldnames, self._encodeurs):
+            valeur = ligne.get(nom)
+            if valeur == NULL:
+                morceaux.append(b"\xff\xff\xff\xff")
+            else:
+                contenu = encoder("" if valeur is None else valeur)
+                morceaux.append(struct.pack("!i", len(contenu)))
+                morceaux.append(contenu)
+        self.f.write(b"".join(morceaux))
+
+    def writerows(self, lignes: Iterable[Mapping]):
+        for ligne in lignes:
+            self.writerow(ligne)
+
+    def close(self):
+        """Écrit la marque de fin du flux COPY"""
+        self.f.write(FIN_COPIE)
+
+
+def transcrire_csv(source: TextIO, dest: BinaryIO, types: Mapping[str, str]):
+    """Transcrit un fichier CSV de données au format COPY binaire
+
+    :param types: le type de chaque colonne du CSV
+    """
+    r = csv.DictReader(source)
+    w = EcrivainCopieBinaire(dest, {c: types[c] for c in r.fieldnames})
+    w.writeheader()
+    w.writerows(r)
+    w.close()
@@ -0,0 +1,136 @@
+"""Fichiers binaires de géométries
+
+Plutôt que d'inclure les géométries en WKB hexadécimal dans les fichiers CSV,
+ce qui double leur taille avant compression, les géométries des communes, des
+cantons et des circonscriptions législatives peuvent être stockées dans un
+fichier binaire à part (`communes.wkb.lzma`, par exemple), compressé comme
+les autres fichiers de données (voir :py:mod:`data_france.data.compression`).
+
+Une fois décompressé, le fichier est organisé comme suit (entiers petit-boutistes) :
+
+- un en-tête : la signature `DFWKB001` suivie du nombre `n` de géométries (uint32) ;
+- un index de `n` entrées (id int32, décalage uint64, longueur uint32), trié par
+  décalage ; le décalage est compté à partir du début de la zone de données ;
+- la zone de données : les géométries en WKB, mises bout à bout dans l'ordre de
+  l'index.
+
+Les entités sans géométrie n'apparaissent pas dans le fichier. L'index permet
+de lire les géométries dans l'ordre sans rien garder en mémoire, ou d'accéder
+directement à une géométrie particulière.
+"""
+import shutil
+import struct
+import tempfile
+from typing import BinaryIO, Dict, Iterable, Iterator, Tuple
+
+from data_france.data.compression import ouvrir
+
+SIGNATURE = b"DFWKB001"
+EN_TETE = struct.Struct("<8sI")
+ENTREE_INDEX = struct.Struct("<iQI")
+
+
+class FormatGeometriesInvalide(ValueError):
+    pass
+
+
+def fichier_geometries(fichier_csv):
+    """Renvoie le nom du fichier binaire de géométries associé à un fichier CSV"""
+    return fichier_csv.replace(".csv.", ".wkb.")
+
+
+class EcrivainGeometries:
+    """Écrit un fichier binaire de géométries compressé
+
+    Les géométries ajoutées sont d'abord écrites dans un fichier temporaire,
+    pour que l'index puisse être placé en tête sans garder les WKB en mémoire ;
+    le fichier final n'est écrit qu'à la sortie du bloc `with`. Le format de
+    compression est déduit de l'extension du fichier `dest`.
+    """
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.index = []
+        self._decalage = 0
+        self._donnees = None
+
+    def __enter__(self):
+        self._donnees = tempfile.TemporaryFile()
+        return self
+
+    def ajouter(self, id, wkb: bytes):
+        self._donnees.write(wkb)
+        self.index.append((id, self._decalage, len(wkb)))
+        self._decalage += len(wkb)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._donnees.seek(0)
+                with ouvrir(self.dest, "wb") as f:
+                    f.write(EN_TETE.pack(SIGNATURE, len(self.index)))
+                    for entree in self.index:
+                        f.write(ENTREE_INDEX.pack(*entree))
+                    shutil.copyfileobj(self._donnees, f)
+        finally:
+            self._donnees.close()
+
+
+def ecrire_geometries(dest, geometries: Iterable[Tuple[int, bytes]]):
+    """Écrit un fichier binaire de géométries à partir de couples (id, WKB)
+
+    Les couples dont le WKB est vide ou None sont ignorés.
+
+    :return: le nombre de géométries écrites
+    """
+    with EcrivainGeometries(dest) as ecrivain:
+        for id, wkb in geometries:
+            if wkb:
+                ecrivain.ajouter(id, wkb)
+    return len(ecrivain.index)
+
+
+def _lire_exactement(f: BinaryIO, taille):
+    contenu = f.read(taille)
+    if len(contenu) != taille:
+        raise FormatGeometriesInvalide("Fichier de géométries tronqué.")
+    return contenu
+
+
+class LecteurGeometries:
+    """Lecteur d'un fichier binaire de géométries décompressé
+
+    L'index est lu à la création ; l'itération renvoie les couples (id, WKB)
+    dans l'ordre du fichier.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        signature, n = EN_TETE.unpack(_lire_exactement(f, EN_TETE.size))
+        if signature != SIGNATURE:
+            raise FormatGeometriesInvalide(
+                f"Signature de fichier de géométries inconnue : {signature!r}"
+            )
+
+        contenu = _lire_exactement(f, n * ENTREE_INDEX.size)
+        self.index = list(ENTREE_INDEX.iter_unpack(contenu))
+        self.debut_donnees = EN_TETE.size + len(contenu)
+        self._position = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def positions(self) -> Dict[int, Tuple[int, int]]:
+        """Renvoie, pour chaque id, le couple (décalage, longueur) de sa géométrie"""
+        return {id: (decalage, longueur) for id, decalage, longueur in self.index}
+
+    def lire(self, decalage, longueur) -> bytes:
+        """Lit une géométrie à partir de sa position dans la zone de données"""
+        if decalage != self._position:
+            self.f.seek(self.debut_donnees + decalage)
+        self._position = decalage + longueur
+        return _lire_exactement(self.f, longueur)
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        for id, decalage, longueur in self.index:
+            yield id, self.lire(decalage, longueur)
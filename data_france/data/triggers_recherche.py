@@ -0,0 +1,372 @@
+"""Triggers de maintenance des vecteurs de recherche
+
+Avec le paramètre `DATA_FRANCE_RECHERCHE_TRIGGERS`, les vecteurs de recherche
+(champs `search`) sont maintenus à jour ligne par ligne par des triggers
+PostgreSQL, y compris pour les lignes modifiées en dehors de l'import, et
+l'import n'a plus besoin de les recalculer pour toute la table.
+
+Les fonctions de calcul des vecteurs (`<table>_search`) sont créées par la
+migration `0038_triggers_recherche` ; les triggers qui les appellent sont
+installés ou supprimés selon le paramètre par
+:py:func:`synchroniser_triggers_recherche`, appelée au début de chaque import
+et par la commande `triggers_recherche`.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.transaction import get_connection
+
+CREER_TRIGGERS = """
+-- un seul trigger générique pour calculer le vecteur de recherche d'une ligne :
+-- il appelle la fonction <nom de la table>_search créée par la migration 0038
+CREATE OR REPLACE FUNCTION data_france_calculer_search()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    EXECUTE 'SELECT ' || quote_ident(TG_TABLE_NAME || '_search') || '($1)'
+    INTO NEW.search
+    USING NEW;
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER data_france_commune_search_insert
+BEFORE INSERT ON data_france_commune
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_commune_search_update
+BEFORE UPDATE ON data_france_commune
+FOR EACH ROW
+WHEN (
+    (OLD.nom, OLD.code, OLD.departement_id, OLD.commune_parent_id)
+    IS DISTINCT FROM (NEW.nom, NEW.code, NEW.departement_id, NEW.commune_parent_id)
+)
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_circonscriptionconsulaire_search_insert
+BEFORE INSERT ON data_france_circonscriptionconsulaire
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_circonscriptionconsulaire_search_update
+BEFORE UPDATE ON data_france_circonscriptionconsulaire
+FOR EACH ROW
+WHEN ((OLD.nom, OLD.consulats) IS DISTINCT FROM (NEW.nom, NEW.consulats))
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_elumunicipal_search_insert
+BEFORE INSERT ON data_france_elumunicipal
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_elumunicipal_search_update
+BEFORE UPDATE ON data_france_elumunicipal
+FOR EACH ROW
+WHEN (
+    (OLD.nom, OLD.prenom, OLD.commune_id)
+    IS DISTINCT FROM (NEW.nom, NEW.prenom, NEW.commune_id)
+)
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_eludepartemental_search_insert
+BEFORE INSERT ON data_france_eludepartemental
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_eludepartemental_search_update
+BEFORE UPDATE ON data_france_eludepartemental
+FOR EACH ROW
+WHEN (
+    (OLD.nom, OLD.prenom, OLD.canton_id)
+    IS DISTINCT FROM (NEW.nom, NEW.prenom, NEW.canton_id)
+)
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_eluregional_search_insert
+BEFORE INSERT ON data_france_eluregional
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_eluregional_search_update
+BEFORE UPDATE ON data_france_eluregional
+FOR EACH ROW
+WHEN (
+    (OLD.nom, OLD.prenom, OLD.collectivite_regionale_id)
+    IS DISTINCT FROM (NEW.nom, NEW.prenom, NEW.collectivite_regionale_id)
+)
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_depute_search_insert
+BEFORE INSERT ON data_france_depute
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_depute_search_update
+BEFORE UPDATE ON data_france_depute
+FOR EACH ROW
+WHEN (
+    (OLD.nom, OLD.prenom, OLD.circonscription_id)
+    IS DISTINCT FROM (NEW.nom, NEW.prenom, NEW.circonscription_id)
+)
+EXECUTE FUNCTION data_france_calculer_search();
+
+CREATE TRIGGER data_france_deputeeuropeen_search_insert
+BEFORE INSERT ON data_france_deputeeuropeen
+FOR EACH ROW EXECUTE FUNCTION data_france_calculer_search();
+CREATE TRIGGER data_france_deputeeuropeen_search_update
+BEFORE UPDATE ON data_france_deputeeuropeen
+FOR EACH ROW
+WHEN ((OLD.nom, OLD.prenom) IS DISTINCT FROM (NEW.nom, NEW.prenom))
+EXECUTE FUNCTION data_france_calculer_search();
+
+-- Les vecteurs dépendent aussi de tables liées : codes postaux, noms des
+-- communes, départements, cantons, régions et circonscriptions. Il faut
+-- donc propager les modifications de ces tables.
+
+-- les associations entre codes postaux et communes sont réécrites par lots à
+-- l'import : les triggers sont déclenchés une fois par requête, et chaque
+-- commune concernée n'est mise à jour qu'une fois, grâce aux tables de
+-- transition (une par opération, PostgreSQL n'en permettant pas sur un
+-- trigger déclenché par plusieurs opérations)
+CREATE OR REPLACE FUNCTION data_france_propager_codes_postaux()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_commune c
+    SET search = data_france_commune_search(c)
+    WHERE c.id IN (SELECT commune_id FROM associations);
+
+    UPDATE data_france_elumunicipal e
+    SET search = data_france_elumunicipal_search(e)
+    WHERE e.commune_id IN (SELECT commune_id FROM associations);
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_codepostal_communes_propager_insert
+AFTER INSERT ON data_france_codepostal_communes
+REFERENCING NEW TABLE AS associations
+FOR EACH STATEMENT EXECUTE FUNCTION data_france_propager_codes_postaux();
+CREATE TRIGGER data_france_codepostal_communes_propager_delete
+AFTER DELETE ON data_france_codepostal_communes
+REFERENCING OLD TABLE AS associations
+FOR EACH STATEMENT EXECUTE FUNCTION data_france_propager_codes_postaux();
+
+CREATE OR REPLACE FUNCTION data_france_propager_codepostal()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_commune c
+    SET search = data_france_commune_search(c)
+    FROM data_france_codepostal_communes cc
+    WHERE cc.commune_id = c.id AND cc.codepostal_id = NEW.id;
+
+    UPDATE data_france_elumunicipal e
+    SET search = data_france_elumunicipal_search(e)
+    FROM data_france_codepostal_communes cc
+    WHERE cc.commune_id = e.commune_id AND cc.codepostal_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_codepostal_propager
+AFTER UPDATE ON data_france_codepostal
+FOR EACH ROW
+WHEN (OLD.code IS DISTINCT FROM NEW.code)
+EXECUTE FUNCTION data_france_propager_codepostal();
+
+CREATE OR REPLACE FUNCTION data_france_propager_commune()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_elumunicipal e
+    SET search = data_france_elumunicipal_search(e)
+    WHERE e.commune_id = NEW.id;
+
+    -- les communes déléguées et associées utilisent le département de leur
+    -- commune parente
+    UPDATE data_france_commune c
+    SET search = data_france_commune_search(c)
+    WHERE c.commune_parent_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_commune_propager
+AFTER UPDATE ON data_france_commune
+FOR EACH ROW
+WHEN ((OLD.nom, OLD.departement_id) IS DISTINCT FROM (NEW.nom, NEW.departement_id))
+EXECUTE FUNCTION data_france_propager_commune();
+
+CREATE OR REPLACE FUNCTION data_france_propager_departement()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_commune c
+    SET search = data_france_commune_search(c)
+    WHERE c.departement_id = NEW.id
+    OR c.commune_parent_id IN (
+        SELECT id FROM data_france_commune WHERE departement_id = NEW.id
+    );
+
+    UPDATE data_france_elumunicipal e
+    SET search = data_france_elumunicipal_search(e)
+    FROM data_france_commune c
+    WHERE c.id = e.commune_id AND c.departement_id = NEW.id;
+
+    UPDATE data_france_eludepartemental e
+    SET search = data_france_eludepartemental_search(e)
+    FROM data_france_canton c
+    WHERE c.id = e.canton_id AND c.departement_id = NEW.id;
+
+    UPDATE data_france_depute e
+    SET search = data_france_depute_search(e)
+    FROM data_france_circonscriptionlegislative c
+    WHERE c.id = e.circonscription_id AND c.departement_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_departement_propager
+AFTER UPDATE ON data_france_departement
+FOR EACH ROW
+WHEN ((OLD.nom, OLD.code) IS DISTINCT FROM (NEW.nom, NEW.code))
+EXECUTE FUNCTION data_france_propager_departement();
+
+CREATE OR REPLACE FUNCTION data_france_propager_canton()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_eludepartemental e
+    SET search = data_france_eludepartemental_search(e)
+    WHERE e.canton_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_canton_propager
+AFTER UPDATE ON data_france_canton
+FOR EACH ROW
+WHEN ((OLD.nom, OLD.departement_id) IS DISTINCT FROM (NEW.nom, NEW.departement_id))
+EXECUTE FUNCTION data_france_propager_canton();
+
+CREATE OR REPLACE FUNCTION data_france_propager_region()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_eluregional e
+    SET search = data_france_eluregional_search(e)
+    FROM data_france_collectiviteregionale cr
+    WHERE cr.id = e.collectivite_regionale_id AND cr.region_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_region_propager
+AFTER UPDATE ON data_france_region
+FOR EACH ROW
+WHEN (OLD.nom IS DISTINCT FROM NEW.nom)
+EXECUTE FUNCTION data_france_propager_region();
+
+CREATE OR REPLACE FUNCTION data_france_propager_collectiviteregionale()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_eluregional e
+    SET search = data_france_eluregional_search(e)
+    WHERE e.collectivite_regionale_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_collectiviteregionale_propager
+AFTER UPDATE ON data_france_collectiviteregionale
+FOR EACH ROW
+WHEN (OLD.region_id IS DISTINCT FROM NEW.region_id)
+EXECUTE FUNCTION data_france_propager_collectiviteregionale();
+
+CREATE OR REPLACE FUNCTION data_france_propager_circonscriptionlegislative()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_france_depute e
+    SET search = data_france_depute_search(e)
+    WHERE e.circonscription_id = NEW.id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_france_circonscriptionlegislative_propager
+AFTER UPDATE ON data_france_circonscriptionlegislative
+FOR EACH ROW
+WHEN ((OLD.code, OLD.departement_id) IS DISTINCT FROM (NEW.code, NEW.departement_id))
+EXECUTE FUNCTION data_france_propager_circonscriptionlegislative();
+"""
+
+TABLES_RECHERCHE = [
+    "data_france_commune",
+    "data_france_circonscriptionconsulaire",
+    "data_france_elumunicipal",
+    "data_france_eludepartemental",
+    "data_france_eluregional",
+    "data_france_depute",
+    "data_france_deputeeuropeen",
+]
+
+TABLES_PROPAGATION = [
+    "data_france_codepostal",
+    "data_france_commune",
+    "data_france_departement",
+    "data_france_canton",
+    "data_france_region",
+    "data_france_collectiviteregionale",
+    "data_france_circonscriptionlegislative",
+]
+
+SUPPRIMER_TRIGGERS = "\n".join(
+    [
+        *(
+            f"DROP TRIGGER IF EXISTS {t}_search_{op} ON {t};"
+            for t in TABLES_RECHERCHE
+            for op in ("insert", "update")
+        ),
+        *(f"DROP TRIGGER IF EXISTS {t}_propager ON {t};" for t in TABLES_PROPAGATION),
+        *(
+            "DROP TRIGGER IF EXISTS data_france_codepostal_communes_propager_"
+            f"{op} ON data_france_codepostal_communes;"
+            for op in ("insert", "delete")
+        ),
+        *(
+            f"DROP FUNCTION IF EXISTS data_france_propager_{t.removeprefix('data_france_')}();"
+            for t in TABLES_PROPAGATION
+        ),
+        "DROP FUNCTION IF EXISTS data_france_propager_codes_postaux();",
+        "DROP FUNCTION IF EXISTS data_france_calculer_search();",
+    ]
+)
+
+TRIGGERS_INSTALLES_SQL = """
+    SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = %s);
+"""
+
+
+def triggers_recherche_installes(using):
+    """Indique si les triggers de maintenance des vecteurs de recherche sont installés"""
+    with get_connection(using).cursor() as cursor:
+        cursor.execute(TRIGGERS_INSTALLES_SQL, ("data_france_commune_search_insert",))
+        return cursor.fetchone()[0]
+
+
+def installer_triggers_recherche(using):
+    with transaction.atomic(using=using), get_connection(using).cursor() as cursor:
+        cursor.execute(SUPPRIMER_TRIGGERS)
+        cursor.execute(CREER_TRIGGERS)
+
+
+def supprimer_triggers_recherche(using):
+    with transaction.atomic(using=using), get_connection(using).cursor() as cursor:
+        cursor.execute(SUPPRIMER_TRIGGERS)
+
+
+def synchroniser_triggers_recherche(using):
+    """Installe ou supprime les triggers selon `DATA_FRANCE_RECHERCHE_TRIGGERS`
+
+    :return: True si les triggers ont été installés ou supprimés, False s'ils
+        étaient déjà dans l'état demandé
+    """
+    demandes = getattr(settings, "DATA_FRANCE_RECHERCHE_TRIGGERS", False)
+    if demandes == triggers_recherche_installes(using):
+        return False
+
+    if demandes:
+        installer_triggers_recherche(using)
+    else:
+        supprimer_triggers_recherche(using)
+    return True
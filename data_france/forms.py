@@ -1,20 +1,101 @@
 from django import forms
+from django.contrib.postgres.forms import SimpleArrayField
 
-from data_france.models import Commune
+from data_france.models import Commune, NiveauSimplification
 
+# nombre maximum de codes acceptés par les vues de recherche groupée
+NOMBRE_MAX_CODES = 1000
+
+
+class GeometrieParametresForm(forms.Form):
+    """Paramètres communs contrôlant le format des géométries renvoyées
+
+    Le niveau de simplification peut être demandé explicitement, ou déduit
+    d'un niveau de zoom.
+    """
+
+    CHAMPS_GEOMETRIE = ("geojson", "simplification", "zoom")
 
-class CommuneParametresForm(forms.Form):
-    q = forms.CharField(required=True)
     geojson = forms.BooleanField(required=False)
+    simplification = forms.ChoiceField(
+        choices=NiveauSimplification.choices, required=False
+    )
+    zoom = forms.IntegerField(min_value=0, max_value=24, required=False)
+
+    def niveau_simplification(self):
+        if self.cleaned_data.get("simplification"):
+            return NiveauSimplification(self.cleaned_data["simplification"])
+        if self.cleaned_data.get("zoom") is not None:
+            return NiveauSimplification.pour_zoom(self.cleaned_data["zoom"])
+        return None
+
+    def filtres(self):
+        """Renvoie les paramètres qui ne concernent pas le format des géométries"""
+        return {
+            k: v
+            for k, v in self.cleaned_data.items()
+            if k not in self.CHAMPS_GEOMETRIE
+        }
+
+
+class CommuneParametresForm(GeometrieParametresForm):
+    q = forms.CharField(required=True)
+    flou = forms.BooleanField(required=False)
     type = forms.MultipleChoiceField(
         choices=Commune.TypeCommune.choices, required=False,
     )
 
 
-class ParCodeParametresForm(forms.Form):
+class ParCodeParametresForm(GeometrieParametresForm):
     code = forms.CharField(required=True)
-    geojson = forms.BooleanField(required=False)
 
 
 class CommuneParCodeParametresForm(ParCodeParametresForm):
     type = forms.ChoiceField(choices=Commune.TypeCommune.choices, required=True)
+
+
+class ParCodesParametresForm(GeometrieParametresForm):
+    codes = SimpleArrayField(
+        forms.CharField(), required=True, max_length=NOMBRE_MAX_CODES
+    )
+
+
+class CommuneParCodesParametresForm(ParCodesParametresForm):
+    type = forms.ChoiceField(choices=Commune.TypeCommune.choices, required=True)
+
+
+# nombre maximum de points acceptés par la vue de géocodage inverse groupée
+NOMBRE_MAX_POINTS = 1000
+
+
+class LocaliserParametresForm(forms.Form):
+    latitude = forms.FloatField(min_value=-90, max_value=90, required=True)
+    longitude = forms.FloatField(min_value=-180, max_value=180, required=True)
+
+
+class LocaliserLotParametresForm(forms.Form):
+    """Liste de points sous la forme `[{"latitude": ..., "longitude": ...}, ...]`"""
+
+    points = forms.JSONField(required=True)
+
+    def clean_points(self):
+        points = self.cleaned_data["points"]
+
+        if not isinstance(points, list):
+            raise forms.ValidationError("Une liste de points est attendue.")
+        if len(points) > NOMBRE_MAX_POINTS:
+            raise forms.ValidationError(
+                f"Au plus {NOMBRE_MAX_POINTS} points peuvent être localisés à la fois."
+            )
+
+        resultat = []
+        for i, point in enumerate(points):
+            form = LocaliserParametresForm(
+                data=point if isinstance(point, dict) else {}
+            )
+            if not form.is_valid():
+                raise forms.ValidationError(f"Le point n°{i + 1} est invalide.")
+            resultat.append(
+                (form.cleaned_data["latitude"], form.cleaned_data["longitude"])
+            )
+        return resultat
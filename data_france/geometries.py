@@ -0,0 +1,144 @@
+"""Cache des géométries préparées des modèles géographiques
+
+Les tests d'inclusion répétés sur une même entité (par exemple « ce point
+est-il dans cette commune ? ») sont bien plus rapides sur une géométrie GEOS
+préparée. Ce module garde, pour tout le processus, les dernières géométries
+préparées utilisées, indexées par modèle et clé primaire : une entité déjà
+présente dans le cache n'a besoin ni d'être relue en base, ni d'être
+désérialisée, ni d'être préparée à nouveau.
+
+Le cache est vidé lorsque la version des données change ; cette version n'est
+vérifiée qu'à intervalles réguliers pour ne pas ajouter de requête à chaque
+test.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+
+# nombre de géométries préparées conservées par défaut
+TAILLE_CACHE_GEOMETRIES = 1000
+
+# intervalle minimal, en secondes, entre deux vérifications de la version
+DELAI_VERIFICATION_VERSION = 60
+
+
+class CacheGeometriesPreparees:
+    """Cache LRU de géométries préparées, vidé à chaque changement de version
+
+    Les attributs `succes` et `echecs` décomptent les géométries trouvées dans
+    le cache et celles qu'il a fallu charger depuis le dernier appel à
+    :py:meth:`vider`.
+    """
+
+    def __init__(self, taille=None, delai_verification=DELAI_VERIFICATION_VERSION):
+        self.taille = taille
+        self.delai_verification = delai_verification
+        self.succes = 0
+        self.echecs = 0
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self._version = None
+        self._derniere_verification = None
+
+    def _taille(self):
+        if self.taille is not None:
+            return self.taille
+        return getattr(
+            settings, "DATA_FRANCE_CACHE_GEOMETRIES", TAILLE_CACHE_GEOMETRIES
+        )
+
+    def _verifier_version(self):
+        maintenant = time.monotonic()
+        if (
+            self._derniere_verification is not None
+            and maintenant - self._derniere_verification < self.delai_verification
+        ):
+            return
+
+        from data_france.cache import version_donnees
+
+        version = version_donnees()
+        identifiant = version.identifiant if version is not None else None
+
+        with self._verrou:
+            self._derniere_verification = maintenant
+            if identifiant != self._version:
+                self._entrees.clear()
+                self._version = identifiant
+
+    def obtenir(self, cle, charger):
+        """Renvoie la géométrie préparée associée à la clé
+
+        :param cle: la clé de l'entité, par exemple `(label du modèle, pk)`
+        :param charger: fonction appelée en cas d'absence dans le cache, qui
+            renvoie la géométrie GEOS (ou None)
+        :return: la géométrie préparée, ou None si l'entité n'a pas de géométrie
+        """
+        self._verifier_version()
+
+        with self._verrou:
+            if cle in self._entrees:
+                self.succes += 1
+                self._entrees.move_to_end(cle)
+                return self._entrees[cle]
+            self.echecs += 1
+
+        geometrie = charger()
+        preparee = geometrie.prepared if geometrie is not None else None
+
+        with self._verrou:
+            self._entrees[cle] = preparee
+            while len(self._entrees) > self._taille():
+                self._entrees.popitem(last=False)
+
+        return preparee
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._derniere_verification = None
+            self.succes = 0
+            self.echecs = 0
+
+    def __len__(self):
+        return len(self._entrees)
+
+
+cache_geometries = CacheGeometriesPreparees()
+
+
+class GeometriePrepareeMixin:
+    """Mixin pour les modèles avec un champ `geometry`
+
+    Ajoute des tests d'inclusion qui utilisent la géométrie préparée mise en
+    cache pour l'entité. Pour profiter pleinement du cache, les instances
+    peuvent être chargées avec `.defer("geometry")` : la géométrie n'est alors
+    lue en base qu'en cas d'absence du cache.
+    """
+
+    def geometrie_preparee(self):
+        """Renvoie la géométrie préparée de l'entité, ou None"""
+
+        def charger():
+            if "geometry" not in self.get_deferred_fields():
+                return self.geometry
+            return (
+                type(self)
+                ._base_manager.filter(pk=self.pk)
+                .values_list("geometry", flat=True)
+                .first()
+            )
+
+        return cache_geometries.obtenir((self._meta.label, self.pk), charger)
+
+    def contient(self, geometrie) -> bool:
+        """Indique si la géométrie (frontière comprise) est dans l'entité"""
+        preparee = self.geometrie_preparee()
+        return preparee is not None and preparee.covers(geometrie)
+
+    def contient_point(self, latitude: float, longitude: float) -> bool:
+        """Indique si le point (WGS84) est dans l'entité"""
+        return self.contient(Point(longitude, latitude, srid=4326))
@@ -0,0 +1,277 @@
+"""Géocodage inverse : circonscriptions et collectivités contenant un point
+
+La fonction :py:func:`localiser` détermine les entités contenant chaque point
+en une seule requête SQL, en s'appuyant sur les index spatiaux des colonnes
+`geometry`. Pour l'EPCI, le département et la région, ce sont les
+rattachements de la commune trouvée qui sont utilisés.
+
+Pour les traitements par lots de plusieurs millions de points, la classe
+:py:class:`Localisateur` charge les géométries des communes et des cantons en
+mémoire, dans des index `STRtree` de shapely, et localise les points par
+tableaux NumPy sans aucune requête SQL. Elle nécessite shapely (2.0 ou plus) et
+NumPy, qui ne sont pas des dépendances obligatoires de data-france.
+"""
+import csv
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connections
+
+from data_france.data.compression import ouvrir_donnees, trouver_fichier
+from data_france.data.copie_binaire import fichier_copie, lire_copie
+from data_france.data.geometries import LecteurGeometries, fichier_geometries
+from data_france.utils import TypeNom
+
+try:
+    import numpy as np
+    import shapely
+except ImportError:
+    np = shapely = None
+
+LOCALISER_SQL = """
+    WITH points AS (
+        SELECT
+            p.ordre,
+            ST_SetSRID(ST_MakePoint(p.longitude, p.latitude), 4326) :: geography AS point
+        FROM unnest(%(longitudes)s :: float8[], %(latitudes)s :: float8[])
+        WITH ORDINALITY AS p(longitude, latitude, ordre)
+    )
+    SELECT
+        com.code, com.nom, com.type_nom,
+        sub.code, sub.type, sub.nom, sub.type_nom,
+        epci.code, epci.nom,
+        can.code, can.nom, can.type_nom,
+        circo.code,
+        dep.code, dep.nom, dep.type_nom,
+        reg.code, reg.nom, reg.type_nom
+    FROM points p
+    LEFT JOIN LATERAL (
+        SELECT c.id, c.code, c.nom, c.type_nom, c.epci_id, c.departement_id
+        FROM data_france_commune c
+        WHERE c.type = 'COM' AND ST_Covers(c.geometry, p.point)
+        LIMIT 1
+    ) com ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT c.code, c.type, c.nom, c.type_nom
+        FROM data_france_commune c
+        WHERE c.commune_parent_id = com.id
+        AND c.type IN ('COMD', 'COMA', 'ARM')
+        AND ST_Covers(c.geometry, p.point)
+        LIMIT 1
+    ) sub ON TRUE
+    LEFT JOIN data_france_epci epci ON epci.id = com.epci_id
+    LEFT JOIN data_france_departement dep ON dep.id = com.departement_id
+    LEFT JOIN data_france_region reg ON reg.id = dep.region_id
+    LEFT JOIN LATERAL (
+        SELECT c.code, c.nom, c.type_nom
+        FROM data_france_canton c
+        WHERE ST_Covers(c.geometry, p.point)
+        ORDER BY c.code
+        LIMIT 1
+    ) can ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT c.code
+        FROM data_france_circonscriptionlegislative c
+        WHERE ST_Covers(c.geometry, p.point)
+        LIMIT 1
+    ) circo ON TRUE
+    ORDER BY p.ordre;
+"""
+
+
+def _entite(code, nom, type_nom=None, **autres) -> Optional[dict]:
+    if code is None:
+        return None
+    if type_nom is not None:
+        nom = f"{TypeNom(type_nom).article}{nom}"
+    return {"code": code, **autres, "nom": nom}
+
+
+def _ligne_vers_dict(ligne) -> dict:
+    sub_code, sub_type, sub_nom, sub_type_nom = ligne[3:7]
+    circonscription = ligne[12]
+
+    return {
+        "commune": _entite(*ligne[0:3]),
+        "subdivision": _entite(sub_code, sub_nom, sub_type_nom, type=sub_type),
+        "epci": _entite(*ligne[7:9]),
+        "canton": _entite(*ligne[9:12]),
+        "circonscription_legislative": (
+            {"code": circonscription} if circonscription is not None else None
+        ),
+        "departement": _entite(*ligne[13:16]),
+        "region": _entite(*ligne[16:19]),
+    }
+
+
+def localiser(points: Iterable[Tuple[float, float]], using=None) -> List[dict]:
+    """Détermine les entités administratives contenant chacun des points
+
+    :param points: des couples (latitude, longitude) en WGS84
+    :return: pour chaque point, dans le même ordre, un dictionnaire donnant la
+        commune, la commune déléguée, associée ou l'arrondissement
+        (`subdivision`), l'EPCI, le canton, la circonscription législative, le
+        département et la région ; les entités non trouvées valent None.
+    """
+    points = list(points)
+    if not points:
+        return []
+
+    with connections[using or "default"].cursor() as cursor:
+        cursor.execute(
+            LOCALISER_SQL,
+            {
+                "latitudes": [float(lat) for lat, _ in points],
+                "longitudes": [float(lon) for _, lon in points],
+            },
+        )
+        return [_ligne_vers_dict(ligne) for ligne in cursor.fetchall()]
+
+
+# les géométries peuvent être encodées en WKB hexadécimal dans les fichiers CSV
+TAILLE_MAX_CHAMP_CSV = 5 * 131072
+
+# niveau -> (fichier, table, condition sur les lignes)
+SOURCES_LOCALISATEUR = {
+    "commune": ("communes.csv.lzma", "data_france_commune", {"type": "COM"}),
+    "canton": ("cantons.csv.lzma", "data_france_canton", {}),
+}
+
+GEOMETRIES_SQL = """
+    SELECT code, ST_AsBinary(geometry :: geometry)
+    FROM {table}
+    WHERE geometry IS NOT NULL {condition};
+"""
+
+
+def _lignes(fichier):
+    # le fichier COPY binaire, s'il existe, remplace le fichier CSV
+    copie = trouver_fichier(fichier_copie(fichier))
+    if copie is not None:
+        with ouvrir_donnees(copie) as f:
+            yield from lire_copie(f)
+    else:
+        csv.field_size_limit(TAILLE_MAX_CHAMP_CSV)
+        with ouvrir_donnees(fichier, "rt", newline="") as f:
+            yield from csv.DictReader(f)
+
+
+class Localisateur:
+    """Localise des lots de points dans les communes et cantons, en mémoire
+
+    Les géométries sont chargées une fois pour toutes, préparées et indexées
+    dans un `STRtree` par niveau (`commune`, `canton`).
+
+    L'occupation mémoire est dominée par les coordonnées des géométries (16
+    octets par sommet, puis à peu près autant pour leur préparation) ; elle est
+    donnée par :py:meth:`taille_memoire`. La durée de construction est
+    conservée dans l'attribut `duree_construction`, en secondes.
+    """
+
+    def __init__(self, geometries: Dict[str, Tuple["np.ndarray", "np.ndarray"]]):
+        """
+        :param geometries: pour chaque niveau, un couple (codes, géométries) de
+            tableaux NumPy de même longueur
+        """
+        if shapely is None:
+            raise ImportError(
+                "Le Localisateur nécessite les paquets shapely (>= 2.0) et numpy."
+            )
+
+        debut = time.perf_counter()
+        self.codes = {}
+        self.geometries = {}
+        self.index = {}
+        for niveau, (codes, geoms) in geometries.items():
+            self.codes[niveau] = np.asarray(codes, dtype=object)
+            self.geometries[niveau] = np.asarray(geoms, dtype=object)
+            shapely.prepare(self.geometries[niveau])
+            self.index[niveau] = shapely.STRtree(self.geometries[niveau])
+        self.duree_construction = time.perf_counter() - debut
+
+    @classmethod
+    def depuis_fichiers(cls, niveaux=tuple(SOURCES_LOCALISATEUR)):
+        """Construit le localisateur à partir des fichiers de données du paquet
+
+        Les géométries sont lues dans le fichier binaire de géométries s'il
+        existe, et sinon dans la colonne `geometry` du fichier de données.
+        """
+        geometries = {}
+        for niveau in niveaux:
+            fichier, _, condition = SOURCES_LOCALISATEUR[niveau]
+            fichier_separe = trouver_fichier(fichier_geometries(fichier))
+
+            codes, wkb = [], []
+            for ligne in _lignes(fichier):
+                if any(ligne[k] != v for k, v in condition.items()):
+                    continue
+                if fichier_separe is not None:
+                    codes.append((int(ligne["id"]), ligne["code"]))
+                elif ligne["geometry"] not in (None, "\\N"):
+                    codes.append(ligne["code"])
+                    wkb.append(ligne["geometry"])
+
+            if fichier_separe is not None:
+                codes_par_id = dict(codes)
+                codes = []
+                with ouvrir_donnees(fichier_separe) as f:
+                    for id, geometrie in LecteurGeometries(f):
+                        if id in codes_par_id:
+                            codes.append(codes_par_id[id])
+                            wkb.append(geometrie)
+
+            geometries[niveau] = (codes, shapely.from_wkb(wkb))
+        return cls(geometries)
+
+    @classmethod
+    def depuis_base(cls, niveaux=tuple(SOURCES_LOCALISATEUR), using=None):
+        """Construit le localisateur à partir des géométries en base"""
+        geometries = {}
+        with connections[using or "default"].cursor() as cursor:
+            for niveau in niveaux:
+                _, table, condition = SOURCES_LOCALISATEUR[niveau]
+                cursor.execute(
+                    GEOMETRIES_SQL.format(
+                        table=table,
+                        condition="".join(f" AND {k} = %s" for k in condition),
+                    ),
+                    list(condition.values()),
+                )
+                lignes = cursor.fetchall()
+                geometries[niveau] = (
+                    [code for code, _ in lignes],
+                    shapely.from_wkb([bytes(wkb) for _, wkb in lignes]),
+                )
+        return cls(geometries)
+
+    def localiser(self, latitudes, longitudes) -> Dict[str, "np.ndarray"]:
+        """Localise un lot de points
+
+        :param latitudes: tableau des latitudes (WGS84)
+        :param longitudes: tableau des longitudes (WGS84)
+        :return: pour chaque niveau, un tableau des codes des entités contenant
+            chaque point, ou None pour les points hors de toute entité
+        """
+        points = shapely.points(
+            np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float)
+        )
+
+        resultats = {}
+        for niveau, index in self.index.items():
+            indices_points, indices_geometries = index.query(
+                points, predicate="intersects"
+            )
+            # un point sur une frontière est rattaché à la première entité
+            indices_points, premiers = np.unique(indices_points, return_index=True)
+
+            codes = np.full(len(points), None, dtype=object)
+            codes[indices_points] = self.codes[niveau][indices_geometries[premiers]]
+            resultats[niveau] = codes
+        return resultats
+
+    def taille_memoire(self) -> int:
+        """Estime la mémoire occupée par les coordonnées des géométries, en octets"""
+        return sum(
+            16 * int(shapely.get_num_coordinates(geoms).sum())
+            for geoms in self.geometries.values()
+        )
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from data_france.data.triggers_recherche import (
+    synchroniser_triggers_recherche,
+    triggers_recherche_installes,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Installe ou supprime les triggers de maintenance des vecteurs de "
+        "recherche selon le paramètre DATA_FRANCE_RECHERCHE_TRIGGERS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-u", "--using")
+
+    def handle(self, *args, using, **options):
+        modifies = synchroniser_triggers_recherche(using)
+        installes = triggers_recherche_installes(using)
+
+        if modifies:
+            etat = "installés" if installes else "supprimés"
+        else:
+            etat = "déjà installés" if installes else "non installés"
+        self.stdout.write(f"Triggers de l'index de recherche {etat}")
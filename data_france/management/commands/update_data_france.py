@@ -1,11 +1,61 @@
 from django.core.management import BaseCommand
 
-from data_france.data import importer_donnees
+from data_france.data import importer_donnees, TAILLE_BLOC
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("-u", "--using")
+        parser.add_argument(
+            "--taille-bloc",
+            type=int,
+            default=TAILLE_BLOC,
+            help="Taille (en caractères) des blocs envoyés à PostgreSQL lors des COPY",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="N'écrire que les lignes nouvelles ou modifiées depuis le dernier import",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help=(
+                "Nombre de connexions utilisées en parallèle pour l'import et le "
+                "calcul des géométries"
+            ),
+        )
+        parser.add_argument(
+            "--full-reindex",
+            action="store_true",
+            dest="reindexation_complete",
+            help="Recalculer l'index de recherche de toutes les lignes, même inchangées",
+        )
+        parser.add_argument(
+            "--recalculer-geometries",
+            action="store_true",
+            help="Recalculer toutes les géométries agrégées, même si leurs communes "
+            "n'ont pas changé",
+        )
 
-    def handle(self, *args, using, **options):
-        importer_donnees(using=using)
+    def handle(
+        self,
+        *args,
+        using,
+        taille_bloc,
+        incremental,
+        jobs,
+        reindexation_complete,
+        recalculer_geometries,
+        **options,
+    ):
+        importer_donnees(
+            using=using,
+            taille_bloc=taille_bloc,
+            incremental=incremental,
+            jobs=jobs,
+            reindexation_complete=reindexation_complete,
+            recalculer_geometries=recalculer_geometries,
+        )
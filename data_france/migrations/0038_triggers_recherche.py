@@ -0,0 +1,152 @@
+from django.db import migrations
+
+# Fonctions calculant le vecteur de recherche d'une ligne, utilisées par les
+# triggers de data_france.data.triggers_recherche. Ces triggers ne sont pas
+# installés ici : ils le sont, selon le paramètre
+# DATA_FRANCE_RECHERCHE_TRIGGERS, à chaque import ou par la commande
+# triggers_recherche. La migration inverse les supprime s'ils existent.
+
+creer_fonctions = """
+CREATE OR REPLACE FUNCTION data_france_codes_postaux_commune(integer)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(data_france_tsvector_agg(cp.code :: tsvector), '' :: tsvector)
+    FROM data_france_codepostal cp
+    INNER JOIN data_france_codepostal_communes cc
+    ON cp.id = cc.codepostal_id
+    WHERE cc.commune_id = $1
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_commune_search(c data_france_commune)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search' :: regconfig, c.nom), 'A') ||
+        setweight(to_tsvector('data_france_search' :: regconfig, c.code), 'C') ||
+        setweight(data_france_codes_postaux_commune(c.id), 'B') ||
+        setweight(to_tsvector(d.code), 'C') ||
+        setweight(to_tsvector('data_france_search', d.nom), 'D')
+    FROM (SELECT 1) AS _
+    LEFT JOIN data_france_commune p ON p.id = c.commune_parent_id
+    LEFT JOIN data_france_departement d
+    ON d.id = COALESCE(c.departement_id, p.departement_id)
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_circonscriptionconsulaire_search(
+    c data_france_circonscriptionconsulaire
+)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(c.nom, '')), 'A')
+     || setweight(to_tsvector('data_france_search', ARRAY_TO_STRING(c.consulats, ' ')), 'B')
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_elumunicipal_search(e data_france_elumunicipal)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(c."nom", '')), 'B')
+     || setweight(data_france_codes_postaux_commune(c.id), 'C')
+     || setweight(to_tsvector(d.code), 'C')
+     || setweight(to_tsvector('data_france_search', d.nom), 'D')
+    FROM data_france_commune c
+    LEFT JOIN data_france_departement d ON c.departement_id = d.id
+    WHERE c.id = e.commune_id
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_eludepartemental_search(e data_france_eludepartemental)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(c."nom", '')), 'B')
+     || setweight(to_tsvector('data_france_search', COALESCE(d."nom", '')), 'C')
+     || setweight(to_tsvector('data_france_search', COALESCE(d."code", '')), 'C')
+    FROM data_france_canton c, data_france_departement d
+    WHERE c.id = e.canton_id
+      AND d.id = c.departement_id
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_eluregional_search(e data_france_eluregional)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(r."nom", '')), 'B')
+    FROM data_france_collectiviteregionale cr
+    LEFT JOIN data_france_region r ON cr.region_id = r.id
+    WHERE cr.id = e.collectivite_regionale_id
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_depute_search(e data_france_depute)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(c."code", '')), 'C')
+     || setweight(to_tsvector('data_france_search', COALESCE(d."nom", '')), 'C')
+    FROM data_france_circonscriptionlegislative c
+    LEFT JOIN data_france_departement d ON c.departement_id = d.id
+    WHERE c.id = e.circonscription_id
+$$;
+
+CREATE OR REPLACE FUNCTION data_france_deputeeuropeen_search(e data_france_deputeeuropeen)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('data_france_search', COALESCE(e."nom", '')), 'A')
+     || setweight(to_tsvector('data_france_search', COALESCE(e."prenom", '')), 'A')
+$$;
+"""
+
+TABLES_RECHERCHE = [
+    "data_france_commune",
+    "data_france_circonscriptionconsulaire",
+    "data_france_elumunicipal",
+    "data_france_eludepartemental",
+    "data_france_eluregional",
+    "data_france_depute",
+    "data_france_deputeeuropeen",
+]
+
+TABLES_PROPAGATION = [
+    "data_france_codepostal",
+    "data_france_commune",
+    "data_france_departement",
+    "data_france_canton",
+    "data_france_region",
+    "data_france_collectiviteregionale",
+    "data_france_circonscriptionlegislative",
+]
+
+supprimer_fonctions = "\n".join(
+    [
+        *(
+            f"DROP TRIGGER IF EXISTS {t}_search_{op} ON {t};"
+            for t in TABLES_RECHERCHE
+            for op in ("insert", "update")
+        ),
+        *(f"DROP TRIGGER IF EXISTS {t}_propager ON {t};" for t in TABLES_PROPAGATION),
+        *(
+            "DROP TRIGGER IF EXISTS data_france_codepostal_communes_propager_"
+            f"{op} ON data_france_codepostal_communes;"
+            for op in ("insert", "delete")
+        ),
+        *(
+            f"DROP FUNCTION IF EXISTS data_france_propager_{t.removeprefix('data_france_')}();"
+            for t in TABLES_PROPAGATION
+        ),
+        "DROP FUNCTION IF EXISTS data_france_propager_codes_postaux();",
+        "DROP FUNCTION IF EXISTS data_france_calculer_search();",
+        *(f"DROP FUNCTION IF EXISTS {t}_search({t});" for t in TABLES_RECHERCHE),
+        "DROP FUNCTION IF EXISTS data_france_codes_postaux_commune(integer);",
+    ]
+)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0037_alter_deputeeuropeen_options"),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=creer_fonctions, reverse_sql=supprimer_fonctions),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0038_triggers_recherche"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmpreinteAgregat",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "nom",
+                    models.CharField(
+                        max_length=100, unique=True, verbose_name="Nom de l'agrégat"
+                    ),
+                ),
+                (
+                    "empreinte",
+                    models.CharField(max_length=32, verbose_name="Empreinte"),
+                ),
+            ],
+            options={
+                "verbose_name": "Empreinte d'agrégat",
+                "verbose_name_plural": "Empreintes d'agrégats",
+            },
+        ),
+    ]
@@ -0,0 +1,115 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0039_empreinteagregat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commune",
+            name="geojson_forte",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification forte)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="commune",
+            name="geojson_moyenne",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification moyenne)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="commune",
+            name="geojson_faible",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification faible)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="epci",
+            name="geojson_forte",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification forte)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="epci",
+            name="geojson_moyenne",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification moyenne)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="epci",
+            name="geojson_faible",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification faible)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="departement",
+            name="geojson_forte",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification forte)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="departement",
+            name="geojson_moyenne",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification moyenne)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="departement",
+            name="geojson_faible",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification faible)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="region",
+            name="geojson_forte",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification forte)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="region",
+            name="geojson_moyenne",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification moyenne)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="region",
+            name="geojson_faible",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification faible)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="collectivitedepartementale",
+            name="geojson_forte",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification forte)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="collectivitedepartementale",
+            name="geojson_moyenne",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification moyenne)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="collectivitedepartementale",
+            name="geojson_faible",
+            field=models.TextField(
+                editable=False, null=True, verbose_name="GeoJSON (simplification faible)"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0040_geometries_simplifiees"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VersionDonnees",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Date de l'import"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Version des données",
+                "verbose_name_plural": "Versions des données",
+                "get_latest_by": "date",
+            },
+        ),
+    ]
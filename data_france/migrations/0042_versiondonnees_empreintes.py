@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0041_versiondonnees"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="versiondonnees",
+            name="version_paquet",
+            field=models.CharField(
+                blank=True,
+                max_length=50,
+                verbose_name="Version du paquet data-france",
+            ),
+        ),
+        migrations.AddField(
+            model_name="versiondonnees",
+            name="empreintes",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                verbose_name="Empreinte du contenu de chaque table",
+            ),
+        ),
+        migrations.AddField(
+            model_name="versiondonnees",
+            name="empreinte",
+            field=models.CharField(
+                blank=True, max_length=32, verbose_name="Empreinte globale"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+creer_fonction_normalisation = """
+CREATE OR REPLACE FUNCTION data_france_normaliser(text) RETURNS text
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$ SELECT lower(unaccent('unaccent' :: regdictionary, $1)) $$;
+"""
+
+supprimer_fonction_normalisation = "DROP FUNCTION data_france_normaliser(text);"
+
+# l'index est créé en SQL : l'expression OpClass de django.contrib.postgres
+# n'est correctement traduite que si cette application est installée
+creer_index_trigrammes = """
+CREATE INDEX data_france_commune_nom_trgm ON data_france_commune
+USING gin (data_france_normaliser(nom) gin_trgm_ops);
+"""
+
+supprimer_index_trigrammes = "DROP INDEX data_france_commune_nom_trgm;"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_france", "0042_versiondonnees_empreintes"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            sql=creer_fonction_normalisation, reverse_sql=supprimer_fonction_normalisation
+        ),
+        migrations.RunSQL(
+            sql=creer_index_trigrammes, reverse_sql=supprimer_index_trigrammes
+        ),
+    ]
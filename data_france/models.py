@@ -1,12 +1,23 @@
 from django.contrib.gis.db.models import MultiPolygonField, PointField
+from django.contrib.gis.geos import Point
 from django.contrib.postgres.fields.array import ArrayField
 from django.contrib.postgres.indexes import GinIndex
-from django.contrib.postgres.search import SearchRank, SearchVectorField
+from django.contrib.postgres.search import (
+    SearchRank,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
 from django.db import models
 from django.utils.html import format_html_join
 from django_countries.fields import CountryField
 
-from .search import PrefixSearchQuery
+from .geometries import GeometriePrepareeMixin
+from .search import (
+    PrefixSearchQuery,
+    MotProche,
+    NomNormalise,
+    developper_abreviations,
+)
 from .typologies import CodeSexe, Fonction, RelationGroupe, CSP
 from .utils import ORDINAUX_LETTRES, JOURS_SEMAINE, NomType, TypeNom, genrer
 
@@ -136,23 +147,122 @@ class MandatLocalMixin(models.Model):
         abstract = True
 
 
+class NiveauSimplification(models.TextChoices):
+    """Niveaux de simplification des géométries précalculés à l'import"""
+
+    FORTE = "forte", "Simplification forte"
+    MOYENNE = "moyenne", "Simplification moyenne"
+    FAIBLE = "faible", "Simplification faible"
+
+    @classmethod
+    def pour_zoom(cls, zoom):
+        """Renvoie le niveau de simplification adapté à un niveau de zoom
+
+        Les niveaux de zoom sont ceux des tuiles web usuelles (0 à 24).
+
+        :return: le niveau de simplification, ou None si la géométrie complète
+            est nécessaire
+        """
+        if zoom <= 7:
+            return cls.FORTE
+        if zoom <= 10:
+            return cls.MOYENNE
+        if zoom <= 13:
+            return cls.FAIBLE
+        return None
+
+
+# tolérance (en degrés) et nombre de décimales utilisés pour chaque niveau
+SIMPLIFICATIONS = {
+    NiveauSimplification.FORTE: (1e-2, 3),
+    NiveauSimplification.MOYENNE: (1e-3, 4),
+    NiveauSimplification.FAIBLE: (1e-4, 5),
+}
+
+
+class GeometriesSimplifieesMixin(models.Model):
+    """Mixin de modèle pour stocker des versions simplifiées de la géométrie
+
+    Ces versions sont calculées à l'import et stockées directement au format
+    GeoJSON, pour pouvoir être renvoyées telles quelles par les vues.
+    """
+
+    CHAMPS_GEOJSON = [f"geojson_{n}" for n in NiveauSimplification.values]
+
+    geojson_forte = models.TextField(
+        "GeoJSON (simplification forte)", null=True, editable=False
+    )
+    geojson_moyenne = models.TextField(
+        "GeoJSON (simplification moyenne)", null=True, editable=False
+    )
+    geojson_faible = models.TextField(
+        "GeoJSON (simplification faible)", null=True, editable=False
+    )
+
+    def geojson_simplifie(self, niveau):
+        """Renvoie la géométrie simplifiée au niveau demandé, au format GeoJSON"""
+        return getattr(self, f"geojson_{NiveauSimplification(niveau).value}")
+
+    class Meta:
+        abstract = True
+
+
+class GeometrieQueryset(models.QuerySet):
+    def localiser(self, latitude: float, longitude: float):
+        """Filtre le queryset sur les entités dont la géométrie contient un point
+
+        :param latitude: la latitude du point (WGS84)
+        :param longitude: la longitude du point (WGS84)
+        :return: le queryset filtré
+        """
+        return self.filter(geometry__covers=Point(longitude, latitude, srid=4326))
+
+
 class SearchQueryset(models.QuerySet):
-    def search(self, termes: str):
+    def search(self, termes: str, flou: bool = False):
         """Réalise une recherche plein texte dans le queryset
 
+        En mode flou, les entités dont le nom est proche des termes recherchés
+        (au sens des trigrammes de `pg_trgm`) sont aussi renvoyées, ce qui
+        permet de tolérer les fautes de frappe et les abréviations courantes.
+
         :param termes: Les termes à rechercher
+        :param flou: Si la recherche doit tolérer les fautes de frappe
         :return: le queryset filtré et ordonné selon les termes à rechercher
         """
+        if not flou:
+            query = PrefixSearchQuery(termes, config="data_france_search")
+            return (
+                self.filter(search=query)
+                .annotate(rank=SearchRank(models.F("search"), query, normalization=8))
+                .order_by("-rank")
+            )
+
+        termes = developper_abreviations(termes)
         query = PrefixSearchQuery(termes, config="data_france_search")
+        termes_normalises = NomNormalise(models.Value(termes))
 
         return (
-            self.filter(search=query)
-            .annotate(rank=SearchRank(models.F("search"), query, normalization=8))
+            self.annotate(nom_normalise=NomNormalise("nom"))
+            .filter(
+                models.Q(search=query)
+                | MotProche(models.F("nom_normalise"), termes_normalises)
+            )
+            .annotate(
+                rank=SearchRank(models.F("search"), query, normalization=8)
+                + TrigramWordSimilarity(termes_normalises, "nom_normalise")
+            )
             .order_by("-rank")
         )
 
 
-class Commune(TypeNomMixin, models.Model):
+class CommuneQueryset(SearchQueryset, GeometrieQueryset):
+    pass
+
+
+class Commune(
+    TypeNomMixin, GeometriesSimplifieesMixin, GeometriePrepareeMixin, models.Model
+):
     class TypeCommune(models.TextChoices):
         """Enum des différents types d'entité référencées comme communes"""
 
@@ -168,7 +278,7 @@ class Commune(TypeNomMixin, models.Model):
     TYPE_ARRONDISSEMENT_PLM = TypeCommune.ARRONDISSEMENT_PLM
     TYPE_SECTEUR_PLM = TypeCommune.SECTEUR_PLM
 
-    objects = SearchQueryset.as_manager()
+    objects = CommuneQueryset.as_manager()
 
     code = models.CharField("Code INSEE", max_length=10, editable=False)
     type = models.CharField(
@@ -324,7 +434,11 @@ class Commune(TypeNomMixin, models.Model):
 
         ordering = ("code", "nom", "type")
 
-        indexes = (GinIndex(fields=["search"]),)
+        indexes = (
+            GinIndex(fields=["search"]),
+            # l'index par trigrammes du nom normalisé est créé par la migration
+            # 0043_recherche_floue
+        )
         constraints = (
             models.CheckConstraint(
                 check=(
@@ -347,7 +461,7 @@ class Commune(TypeNomMixin, models.Model):
         )
 
 
-class EPCI(models.Model):
+class EPCI(GeometriesSimplifieesMixin, GeometriePrepareeMixin, models.Model):
     class TypeEPCI(models.TextChoices):
         CA = "CA", "Communauté d'agglomération"
         CC = "CC", "Communauté de communes"
@@ -359,6 +473,8 @@ class EPCI(models.Model):
     TYPE_CU = "CU"
     TYPE_METROPOLE = "ME"
 
+    objects = GeometrieQueryset.as_manager()
+
     code = models.CharField("Code SIREN", max_length=10, editable=False, unique=True)
 
     type = models.CharField("Type d'EPCI", max_length=2, choices=TypeEPCI.choices)
@@ -391,7 +507,11 @@ class EPCI(models.Model):
         ordering = ("code", "nom")
 
 
-class Departement(TypeNomMixin, models.Model):
+class Departement(
+    TypeNomMixin, GeometriesSimplifieesMixin, GeometriePrepareeMixin, models.Model
+):
+    objects = GeometrieQueryset.as_manager()
+
     code = models.CharField("Code INSEE", max_length=3, editable=False, unique=True)
     nom = models.CharField("Nom du département", max_length=200, editable=False)
 
@@ -435,7 +555,11 @@ class Departement(TypeNomMixin, models.Model):
         ordering = ("code",)
 
 
-class Region(TypeNomMixin, models.Model):
+class Region(
+    TypeNomMixin, GeometriesSimplifieesMixin, GeometriePrepareeMixin, models.Model
+):
+    objects = GeometrieQueryset.as_manager()
+
     code = models.CharField("Code INSEE", max_length=3, editable=False, unique=True)
     nom = models.CharField("Nom de la région", max_length=200, editable=False)
 
@@ -495,7 +619,9 @@ class CodePostal(models.Model):
         ordering = ("code",)
 
 
-class CollectiviteDepartementale(TypeNomMixin, models.Model):
+class CollectiviteDepartementale(
+    TypeNomMixin, GeometriesSimplifieesMixin, models.Model
+):
     TYPE_CONSEIL_DEPARTEMENTAL = "D"
     TYPE_STATUT_PARTICULIER = "S"
     TYPE_CHOICES = (
@@ -571,7 +697,7 @@ class CollectiviteRegionale(TypeNomMixin, models.Model):
         return {"code": self.code, "nom": self.nom_complet, "type": self.type}
 
 
-class Canton(TypeNomMixin, models.Model):
+class Canton(TypeNomMixin, GeometriePrepareeMixin, models.Model):
     TYPE_CANTON = "C"
     TYPE_CANTON_VILLE = "V"
     TYPE_CANTON_FICTIF = "N"
@@ -600,6 +726,8 @@ class Canton(TypeNomMixin, models.Model):
         (COMPOSITION_FRACTIONS, "Canton composé de fractions de plusieurs communes"),
     )
 
+    objects = GeometrieQueryset.as_manager()
+
     code = models.CharField("Code INSEE", max_length=5, unique=True)
     type = models.CharField(
         "Type de canton",
@@ -659,7 +787,9 @@ class Canton(TypeNomMixin, models.Model):
         ordering = ("code",)
 
 
-class CirconscriptionLegislative(models.Model):
+class CirconscriptionLegislative(GeometriePrepareeMixin, models.Model):
+    objects = GeometrieQueryset.as_manager()
+
     code = models.CharField(
         verbose_name="Numéro de la circonscription",
         max_length=10,
@@ -946,3 +1076,52 @@ class DeputeEuropeen(IdentiteMixin):
         verbose_name = "Député‧e européen‧ne"
         verbose_name_plural = "Député·es européen·nes"
         ordering = ("nom", "prenom", "date_naissance")
+
+
+class EmpreinteAgregat(models.Model):
+    """Empreinte des données ayant servi à calculer une géométrie agrégée
+
+    Utilisé lors de l'import pour ne recalculer que les géométries des
+    départements, régions, EPCI, etc. dont les communes membres ont changé.
+    """
+
+    nom = models.CharField("Nom de l'agrégat", max_length=100, unique=True)
+    empreinte = models.CharField("Empreinte", max_length=32)
+
+    def __str__(self):
+        return self.nom
+
+    class Meta:
+        verbose_name = "Empreinte d'agrégat"
+        verbose_name_plural = "Empreintes d'agrégats"
+
+
+class VersionDonnees(models.Model):
+    """Version des données importées
+
+    Une version est enregistrée à la fin de chaque import si les données ont
+    changé : elle sert à invalider les réponses mises en cache par les vues et
+    à construire leurs ETag.
+    """
+
+    date = models.DateTimeField("Date de l'import", auto_now_add=True)
+    version_paquet = models.CharField(
+        "Version du paquet data-france", max_length=50, blank=True
+    )
+    empreintes = models.JSONField(
+        "Empreinte du contenu de chaque table", default=dict, blank=True
+    )
+    empreinte = models.CharField("Empreinte globale", max_length=32, blank=True)
+
+    @property
+    def identifiant(self):
+        """Identifiant de la version, utilisé dans les clés de cache et les ETag"""
+        return self.empreinte or str(self.pk)
+
+    def __str__(self):
+        return f"Version {self.identifiant} ({self.date:%d/%m/%Y %H:%M})"
+
+    class Meta:
+        verbose_name = "Version des données"
+        verbose_name_plural = "Versions des données"
+        get_latest_by = "date"
@@ -1,6 +1,7 @@
 import re
 
 from django.contrib.postgres.search import SearchQuery
+from django.db.models import BooleanField, Func, TextField
 
 # taken from django-watson: https://github.com/etianen/django-watson/blob/2226de139b6e177bfbe2824b1749478dbcce3318/watson/backends.py#L26
 RE_POSTGRES_ESCAPE_CHARS = re.compile(r"[&:(|)!><'-]", re.UNICODE)
@@ -37,3 +38,47 @@ class PrefixSearchQuery(SearchQuery):
         # qualifying a term with :* means searching it as a prefix
         words[-1] = f"{words[-1]}:*"
         return " & ".join(words)
+
+
+# abréviations courantes développées avant une recherche floue
+ABREVIATIONS = {
+    "st": "saint",
+    "ste": "sainte",
+    "sts": "saints",
+    "stes": "saintes",
+}
+
+RE_SEPARATEURS = re.compile(r"[\s'’-]+", re.UNICODE)
+
+
+def developper_abreviations(text):
+    """Remplace les abréviations courantes ("st", "ste") par les mots complets"""
+    return " ".join(
+        ABREVIATIONS.get(word.lower().rstrip("."), word)
+        for word in RE_SEPARATEURS.split(text)
+        if word
+    )
+
+
+class NomNormalise(Func):
+    """Normalise un nom pour la recherche par trigrammes
+
+    Utilise la fonction SQL `data_france_normaliser`, qui retire les accents et
+    met en minuscules, et qui est déclarée immuable pour pouvoir être indexée.
+    """
+
+    function = "data_france_normaliser"
+    output_field = TextField()
+
+
+class MotProche(Func):
+    """Indique si l'un des mots du texte est proche des termes recherchés
+
+    Utilise l'opérateur `%>` de `pg_trgm` (similarité de mots supérieure au
+    seuil `pg_trgm.word_similarity_threshold`), qui peut s'appuyer sur un
+    index GIN `gin_trgm_ops` du texte.
+    """
+
+    template = "(%(expressions)s)"
+    arg_joiner = " %%> "
+    output_field = BooleanField()
@@ -14,30 +14,63 @@ urlpatterns = [
         views.CommuneParCodeView.as_view(),
         name="communes-par-code",
     ),
+    path(
+        "communes/par-codes/",
+        views.CommuneParCodesView.as_view(),
+        name="communes-par-codes",
+    ),
     path("epci/par-code/", views.EPCIParCodeView.as_view(), name="epci-par-code"),
+    path("epci/par-codes/", views.EPCIParCodesView.as_view(), name="epci-par-codes"),
     path(
         "departements/par-code/",
         views.DepartementParCodeView.as_view(),
         name="departements-par-code",
     ),
+    path(
+        "departements/par-codes/",
+        views.DepartementParCodesView.as_view(),
+        name="departements-par-codes",
+    ),
     path(
         "regions/par-code/", views.RegionParCodeView.as_view(), name="regions-par-code"
     ),
+    path(
+        "regions/par-codes/",
+        views.RegionParCodesView.as_view(),
+        name="regions-par-codes",
+    ),
     path(
         "code-postal/par-code/",
         views.CodePostalParCodeView.as_view(),
         name="code-postal-par-code",
     ),
+    path(
+        "code-postal/par-codes/",
+        views.CodePostalParCodesView.as_view(),
+        name="code-postal-par-codes",
+    ),
     path(
         "collectivite-departementale/par-code/",
         views.CollectiviteDepartementaleParCodeView.as_view(),
         name="collectivite-departementale-par-code",
     ),
+    path(
+        "collectivite-departementale/par-codes/",
+        views.CollectiviteDepartementaleParCodesView.as_view(),
+        name="collectivite-departementale-par-codes",
+    ),
     path(
         "collectivite-regionale/par-code/",
         views.CollectiviteRegionaleParCodeView.as_view(),
         name="collectivite-regionale-par-code",
     ),
+    path(
+        "collectivite-regionale/par-codes/",
+        views.CollectiviteRegionaleParCodesView.as_view(),
+        name="collectivite-regionale-par-codes",
+    ),
+    path("localiser/", views.LocaliserView.as_view(), name="localiser"),
+    path("localiser/lot/", views.LocaliserLotView.as_view(), name="localiser-lot"),
     path(
         "circonscription-consulaire/chercher/",
         views.RechercheCirconscriptionConsulaireView.as_view(),
@@ -1,14 +1,28 @@
 import json
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
+from data_france.autocompletion import index_communes
+from data_france.cache import CacheDonneesMixin
 from data_france.forms import (
     CommuneParametresForm,
     ParCodeParametresForm,
     CommuneParCodeParametresForm,
+    ParCodesParametresForm,
+    CommuneParCodesParametresForm,
+    LocaliserParametresForm,
+    LocaliserLotParametresForm,
 )
+from data_france.localisation import localiser
 from data_france.models import (
     Commune,
     CirconscriptionConsulaire,
@@ -18,10 +32,65 @@ from data_france.models import (
     CodePostal,
     CollectiviteDepartementale,
     CollectiviteRegionale,
+    GeometriesSimplifieesMixin,
 )
 
 
-class RechercheCommuneView(View):
+def _a_une_geometrie(model):
+    return any(f.name == "geometry" for f in model._meta.get_fields())
+
+
+def _preparer_geometries(qs, geojson, niveau):
+    """Prépare le queryset pour la sérialisation des géométries
+
+    Les colonnes de géométrie ne sont jamais chargées : lorsque la géométrie est
+    demandée, son GeoJSON est directement calculé par PostgreSQL (ou lu dans
+    la version simplifiée précalculée) et exposé par l'annotation
+    `geometrie_geojson`.
+    """
+    model = qs.model
+    if not _a_une_geometrie(model):
+        return qs
+
+    qs = qs.defer("geometry", *getattr(model, "CHAMPS_GEOJSON", ()))
+    if not geojson:
+        return qs
+
+    geometrie = AsGeoJSON("geometry")
+    if niveau is not None and issubclass(model, GeometriesSimplifieesMixin):
+        geometrie = Coalesce(
+            f"geojson_{niveau}", geometrie, output_field=models.TextField()
+        )
+    return qs.annotate(geometrie_geojson=geometrie)
+
+
+def _feature(props, instance):
+    # le GeoJSON de la géométrie est inséré tel quel plutôt que d'être
+    # désérialisé pour être resérialisé aussitôt
+    return '{"type": "Feature", "properties": %s, "geometry": %s}' % (
+        json.dumps(props, cls=DjangoJSONEncoder),
+        getattr(instance, "geometrie_geojson", None) or "null",
+    )
+
+
+def _feature_collection(features, **membres):
+    # les membres supplémentaires sont ajoutés avant la liste des features
+    yield '{"type": "FeatureCollection", %s"features": [' % "".join(
+        f"{json.dumps(nom)}: {json.dumps(valeur, cls=DjangoJSONEncoder)}, "
+        for nom, valeur in membres.items()
+    )
+    for i, feature in enumerate(features):
+        yield feature if i == 0 else ", " + feature
+    yield "]}"
+
+
+def _reponse_geojson(contenu):
+    if isinstance(contenu, str):
+        contenu = [contenu]
+    return StreamingHttpResponse(contenu, content_type="application/json")
+
+
+class RechercheCommuneView(CacheDonneesMixin, View):
     def get(self, request, *args, **kwargs):
         params = CommuneParametresForm(data=request.GET)
 
@@ -32,32 +101,43 @@ class RechercheCommuneView(View):
             ]
 
             geojson = params.cleaned_data["geojson"]
+            flou = params.cleaned_data["flou"]
+            niveau = params.niveau_simplification()
+
+            qs = _preparer_geometries(
+                Commune.objects.select_related(
+                    "departement", "commune_parent__departement"
+                ),
+                geojson,
+                niveau,
+            )
 
-            qs = (
-                Commune.objects.search(q)
-                .filter(type__in=types)
-                .select_related("departement", "commune_parent__departement")[:10]
+            # l'index en mémoire ne gère pas la recherche floue
+            memoire = (
+                getattr(settings, "DATA_FRANCE_RECHERCHE_COMMUNES", None) == "memoire"
             )
 
-            res = [c.as_dict() for c in qs]
+            if memoire and not flou:
+                resultats = index_communes().rechercher(q, types, limite=10)
+                if not geojson:
+                    return JsonResponse({"results": [r.commune for r in resultats]})
 
-            if geojson:
-                features = [
-                    {
-                        "type": "Feature",
-                        "properties": r,
-                        "geometry": json.loads(c.geometry.geojson),
-                    }
-                    for r, c in zip(res, qs)
-                ]
-                return JsonResponse({"type": "FeatureCollection", "features": features})
+                par_id = qs.in_bulk([r.id for r in resultats])
+                communes = [par_id[r.id] for r in resultats if r.id in par_id]
             else:
-                return JsonResponse({"results": res})
+                communes = list(qs.search(q, flou=flou).filter(type__in=types)[:10])
+
+            if geojson:
+                return _reponse_geojson(
+                    _feature_collection(_feature(c.as_dict(), c) for c in communes)
+                )
+
+            return JsonResponse({"results": [c.as_dict() for c in communes]})
 
         return JsonResponse({"errors": params.errors}, status=400)
 
 
-class RechercheCirconscriptionConsulaireView(View):
+class RechercheCirconscriptionConsulaireView(CacheDonneesMixin, View):
     def get(self, request, *args, **kwargs):
         q = request.GET.get("q")
 
@@ -73,7 +153,42 @@ class RechercheCirconscriptionConsulaireView(View):
         return JsonResponse({"results": res})
 
 
-class BaseParCodeView(View):
+class LocaliserView(CacheDonneesMixin, View):
+    """Renvoie les entités administratives contenant un point"""
+
+    def get(self, request, *args, **kwargs):
+        params = LocaliserParametresForm(data=request.GET)
+
+        if not params.is_valid():
+            return JsonResponse({"errors": params.errors}, status=400)
+
+        (resultat,) = localiser(
+            [(params.cleaned_data["latitude"], params.cleaned_data["longitude"])]
+        )
+        return JsonResponse(resultat)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class LocaliserLotView(View):
+    """Variante groupée de :py:class:`LocaliserView`
+
+    Les points sont envoyés en POST, dans un corps JSON de la forme
+    `[{"latitude": ..., "longitude": ...}, ...]`. Les résultats sont renvoyés
+    dans le même ordre.
+    """
+
+    def post(self, request, *args, **kwargs):
+        params = LocaliserLotParametresForm(
+            data={"points": request.body.decode("utf-8")}
+        )
+
+        if not params.is_valid():
+            return JsonResponse({"errors": params.errors}, status=400)
+
+        return JsonResponse({"results": localiser(params.cleaned_data["points"])})
+
+
+class BaseParCodeView(CacheDonneesMixin, View):
     queryset = None
     form_class = ParCodeParametresForm
 
@@ -90,25 +205,66 @@ class BaseParCodeView(View):
             return JsonResponse({"errors": params.errors}, status=400)
 
         geojson = params.cleaned_data.get("geojson", False)
-        other_params = {k: v for k, v in params.cleaned_data.items() if k != "geojson"}
+        niveau = params.niveau_simplification()
 
-        qs = self.get_queryset()
+        qs = _preparer_geometries(self.get_queryset(), geojson, niveau)
 
-        instance = get_object_or_404(qs, **other_params)
+        instance = get_object_or_404(qs, **params.filtres())
         props = self.get_props_from_instance(instance)
 
         if geojson:
-            return JsonResponse(
-                {
-                    "type": "Feature",
-                    "properties": props,
-                    "geometry": json.loads(instance.geometry.geojson),
-                }
-            )
+            return _reponse_geojson(_feature(props, instance))
         else:
             return JsonResponse(props)
 
 
+class BaseParCodesView(BaseParCodeView):
+    """Variante groupée de :py:class:`BaseParCodeView`
+
+    Résout en une seule requête une liste de codes séparés par des virgules
+    (paramètre `codes`), et renvoie les résultats indexés par code.
+    """
+
+    form_class = ParCodesParametresForm
+
+    def get(self, request, *args, **kwargs):
+        params = self.form_class(data=request.GET)
+
+        if not params.is_valid():
+            return JsonResponse({"errors": params.errors}, status=400)
+
+        geojson = params.cleaned_data.get("geojson", False)
+        niveau = params.niveau_simplification()
+        filtres = params.filtres()
+        codes = filtres.pop("codes")
+
+        qs = _preparer_geometries(self.get_queryset(), geojson, niveau).filter(
+            code__in=codes, **filtres
+        )
+
+        # les lignes sont lues avant de construire la réponse : une erreur de la
+        # base de données donne ainsi une erreur 500 plutôt qu'une réponse
+        # tronquée
+        instances = list(qs)
+        trouves = {i.code for i in instances}
+        missing = [c for c in dict.fromkeys(codes) if c not in trouves]
+
+        if geojson:
+            # seules les features sont sérialisées au fur et à mesure
+            return _reponse_geojson(
+                _feature_collection(
+                    (
+                        _feature(self.get_props_from_instance(instance), instance)
+                        for instance in instances
+                    ),
+                    missing=missing,
+                )
+            )
+
+        results = {i.code: self.get_props_from_instance(i) for i in instances}
+        return JsonResponse({"results": results, "missing": missing})
+
+
 class CommuneParCodeView(BaseParCodeView):
     queryset = Commune.objects.select_related(
         "departement", "commune_parent__departement"
@@ -138,3 +294,32 @@ class CollectiviteDepartementaleParCodeView(BaseParCodeView):
 
 class CollectiviteRegionaleParCodeView(BaseParCodeView):
     queryset = CollectiviteRegionale.objects.all()
+
+
+class CommuneParCodesView(BaseParCodesView):
+    queryset = CommuneParCodeView.queryset
+    form_class = CommuneParCodesParametresForm
+
+
+class EPCIParCodesView(BaseParCodesView):
+    queryset = EPCIParCodeView.queryset
+
+
+class DepartementParCodesView(BaseParCodesView):
+    queryset = DepartementParCodeView.queryset
+
+
+class RegionParCodesView(BaseParCodesView):
+    queryset = RegionParCodeView.queryset
+
+
+class CodePostalParCodesView(BaseParCodesView):
+    queryset = CodePostalParCodeView.queryset
+
+
+class CollectiviteDepartementaleParCodesView(BaseParCodesView):
+    queryset = CollectiviteDepartementaleParCodeView.queryset
+
+
+class CollectiviteRegionaleParCodesView(BaseParCodesView):
+    queryset = CollectiviteRegionaleParCodeView.queryset
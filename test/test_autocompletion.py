@@ -0,0 +1,60 @@
+from django.test import TestCase, SimpleTestCase
+
+from data_france.autocompletion import IndexCommunes, lire_tsvector, normaliser
+from data_france.models import Commune
+
+
+class LireTsvectorTestCase(SimpleTestCase):
+    def test_lire_tsvector(self):
+        self.assertEqual(
+            lire_tsvector("'25':3C '25390':5 'd''or':4 'etalan':1A,2B"),
+            {
+                "25": ((3, 0.2),),
+                "25390": None,
+                "d'or": ((4, 0.1),),
+                "etalan": ((1, 1.0), (2, 0.4)),
+            },
+        )
+
+    def test_normaliser(self):
+        self.assertEqual(normaliser("Étalans-Œuvres"), "etalans-oeuvres")
+
+
+class IndexCommunesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.index = IndexCommunes.charger()
+
+    def comparer(self, q, types=None):
+        types = types or Commune.TypeCommune.values
+        resultats = self.index.rechercher(q, types, limite=10)
+        attendus = list(Commune.objects.search(q).filter(type__in=types)[:10])
+
+        self.assertEqual(len(resultats), len(attendus))
+        for resultat, attendu in zip(resultats, attendus):
+            self.assertAlmostEqual(resultat.rang, attendu.rank, places=5)
+        return resultats
+
+    def test_recherche_simple(self):
+        resultats = self.comparer("etalans")
+        self.assertEqual(
+            [r.commune["code"] for r in resultats],
+            ["25222"],
+        )
+
+    def test_recherche_par_prefixe(self):
+        self.comparer("besan")
+        self.comparer("saint")
+
+    def test_recherche_plusieurs_mots(self):
+        self.comparer("Paris 13")
+        self.comparer("Saint-Étienne")
+        self.comparer("Saint-Denis Réunion")
+
+    def test_recherche_avec_type(self):
+        resultats = self.comparer("Paris 13", ["SRM"])
+        self.assertEqual([r.commune["code"] for r in resultats], ["75056SR13"])
+
+    def test_recherche_sans_resultat(self):
+        self.assertEqual(self.index.rechercher("zzzzzz"), [])
+        self.assertEqual(self.index.rechercher("  "), [])
@@ -0,0 +1,503 @@
+import io
+import lzma
+import tempfile
+import tracemalloc
+from itertools import islice
+from unittest import skipIf
+
+from django.contrib.gis.db.models.functions import AsWKB
+from django.db import connection
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from data_france.data import (
+    DEPENDANCES_RECHERCHE,
+    import_with_temp_table,
+    import_standard,
+    creer_index_recherche,
+    _lignes_a_indexer,
+    executer_unites,
+    agreger_geometries_et_populations,
+    Unite,
+    ETAPES_IMPORT,
+    empreintes_tables,
+    importer_geometries,
+)
+from data_france.data.compression import (
+    EXTENSIONS,
+    ouvrir,
+    ouvrir_donnees,
+    zstandard,
+)
+from data_france.data.copie_binaire import (
+    EcrivainCopieBinaire,
+    FormatCopieInvalide,
+    lire_copie,
+    transcrire_csv,
+)
+from data_france.data.geometries import (
+    LecteurGeometries,
+    FormatGeometriesInvalide,
+    ecrire_geometries,
+)
+from data_france.data.triggers_recherche import (
+    synchroniser_triggers_recherche,
+    triggers_recherche_installes,
+)
+from data_france.cache import enregistrer_version_donnees
+from data_france.models import (
+    CirconscriptionConsulaire,
+    CodePostal,
+    Commune,
+    Departement,
+    EluMunicipal,
+    EmpreinteAgregat,
+)
+
+
+class ImportCommunesTestCase(TestCase):
+    def test_import_par_blocs_borne_memoire(self):
+        """L'import des communes ne garde en mémoire qu'un bloc à la fois"""
+        taille_bloc = 1 << 16
+
+        with ouvrir_donnees("communes.csv.lzma", "rt") as f:
+            tracemalloc.start()
+            try:
+                import_with_temp_table(
+                    f, "data_france_commune", using=None, taille_bloc=taille_bloc
+                )
+                _, pic = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        # le fichier décompressé fait plusieurs centaines de Mo : on vérifie
+        # seulement que le pic de mémoire reste de l'ordre de quelques blocs.
+        self.assertLess(pic, 16 * (1 << 20))
+
+
+class ImportIncrementalTestCase(TestCase):
+    def test_reimport_sans_modification(self):
+        """Réimporter un fichier déjà importé ne modifie aucune ligne"""
+        bilan = import_standard(
+            "departements.csv.lzma",
+            "data_france_departement",
+            "Chargement des départements",
+            incremental=True,
+        )
+
+        self.assertEqual(bilan.inseres, 0)
+        self.assertEqual(bilan.mis_a_jour, 0)
+        self.assertEqual(bilan.inchanges, Departement.objects.count())
+
+    def test_reimport_apres_modification(self):
+        """Seules les lignes modifiées sont réécrites"""
+        Departement.objects.filter(code="25").update(nom="Doubs modifié")
+
+        bilan = import_standard(
+            "departements.csv.lzma",
+            "data_france_departement",
+            "Chargement des départements",
+            incremental=True,
+        )
+
+        self.assertEqual(bilan.inseres, 0)
+        self.assertEqual(bilan.mis_a_jour, 1)
+        self.assertEqual(Departement.objects.get(code="25").nom, "Doubs")
+
+
+class EtapesImportTestCase(SimpleTestCase):
+    def test_dependances_declarees_avant(self):
+        """Chaque étape ne dépend que d'étapes déclarées avant elle"""
+        vues = set()
+        for etape in ETAPES_IMPORT:
+            self.assertTrue(
+                vues.issuperset(etape.dependances),
+                f"Dépendances manquantes pour l'étape {etape.nom}",
+            )
+            vues.add(etape.nom)
+
+
+class IndexRechercheTestCase(TestCase):
+    def test_ne_reecrit_que_les_lignes_modifiees(self):
+        Commune.objects.filter(type="COM", code="25222").update(search=None)
+
+        mises_a_jour = creer_index_recherche(None)
+
+        self.assertEqual(mises_a_jour.pop("data_france_commune"), 1)
+        self.assertFalse(any(mises_a_jour.values()))
+        self.assertIsNotNone(Commune.objects.get(type="COM", code="25222").search)
+
+    def test_reindexation_complete(self):
+        mises_a_jour = creer_index_recherche(None, reindexation_complete=True)
+
+        self.assertEqual(mises_a_jour["data_france_commune"], Commune.objects.count())
+
+    def test_restreint_aux_lignes_importees(self):
+        elus = list(EluMunicipal.objects.values_list("id", flat=True)[:2])
+        EluMunicipal.objects.filter(id__in=elus).update(search=None)
+        modifications = {
+            table: []
+            for dependances in DEPENDANCES_RECHERCHE.values()
+            for table in dependances
+        }
+        modifications["data_france_elumunicipal"] = elus[:1]
+
+        mises_a_jour = creer_index_recherche(None, modifications=modifications)
+
+        self.assertEqual(mises_a_jour["data_france_elumunicipal"], 1)
+        self.assertIsNotNone(EluMunicipal.objects.get(id=elus[0]).search)
+        # l'autre élu n'a pas été modifié par l'import : il n'est pas recalculé
+        self.assertIsNone(EluMunicipal.objects.get(id=elus[1]).search)
+
+
+class LignesAIndexerTestCase(SimpleTestCase):
+    def test_sans_modifications_connues(self):
+        self.assertIsNone(_lignes_a_indexer("data_france_elumunicipal", None))
+
+    def test_lignes_modifiees(self):
+        modifications = {
+            "data_france_commune": [],
+            "data_france_codepostal": [],
+            "data_france_codepostal_communes": [],
+            "data_france_departement": [],
+            "data_france_elumunicipal": [3, 5],
+        }
+        self.assertEqual(
+            _lignes_a_indexer("data_france_elumunicipal", modifications), [3, 5]
+        )
+
+        modifications["data_france_elumunicipal"] = []
+        self.assertEqual(
+            _lignes_a_indexer("data_france_elumunicipal", modifications), []
+        )
+
+    def test_dependance_modifiee(self):
+        modifications = {
+            "data_france_commune": [12],
+            "data_france_codepostal": [],
+            "data_france_codepostal_communes": [],
+            "data_france_departement": [],
+            "data_france_elumunicipal": [3],
+        }
+        self.assertIsNone(_lignes_a_indexer("data_france_elumunicipal", modifications))
+
+        # une dépendance importée sans mode incrémental compte comme modifiée
+        del modifications["data_france_commune"]
+        self.assertIsNone(_lignes_a_indexer("data_france_elumunicipal", modifications))
+
+
+SEARCH_A_JOUR_SQL = """
+    SELECT search IS NOT DISTINCT FROM {table}_search(t)
+    FROM {table} t
+    WHERE id = ANY(%s);
+"""
+
+
+class TriggersRechercheTestCase(TestCase):
+    """Maintenance des vecteurs de recherche par les triggers, installés ici
+    dans la transaction du test"""
+
+    def setUp(self):
+        with override_settings(DATA_FRANCE_RECHERCHE_TRIGGERS=True):
+            self.assertTrue(synchroniser_triggers_recherche(None))
+
+        self.assertTrue(triggers_recherche_installes(None))
+        self.etalans = Commune.objects.get(type="COM", code="25222")
+
+    def assertSearchAJour(self, model, pks):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SEARCH_A_JOUR_SQL.format(table=model._meta.db_table), [list(pks)]
+            )
+            self.assertTrue(all(a_jour for a_jour, in cursor.fetchall()))
+
+    def codes_communes(self, q):
+        return list(Commune.objects.search(q).values_list("code", flat=True))
+
+    def test_insertion(self):
+        circonscription = CirconscriptionConsulaire.objects.create(
+            nom="Zanzibar", consulats=["Stone Town"], nombre_conseillers=1
+        )
+
+        self.assertIsNotNone(
+            CirconscriptionConsulaire.objects.get(pk=circonscription.pk).search
+        )
+        self.assertIn(
+            circonscription, CirconscriptionConsulaire.objects.search("zanzibar")
+        )
+
+    def test_modification(self):
+        Commune.objects.filter(pk=self.etalans.pk).update(nom="Zorglub")
+
+        self.assertEqual(self.codes_communes("zorglub"), ["25222"])
+        # les vecteurs des élus de la commune sont recalculés aussi
+        self.assertSearchAJour(
+            EluMunicipal,
+            EluMunicipal.objects.filter(commune=self.etalans).values_list(
+                "pk", flat=True
+            ),
+        )
+
+    def test_associations_codes_postaux(self):
+        autre = Commune.objects.get(type="COM", code="25056")
+        code_postal = CodePostal.objects.create(code="99999")
+
+        # une seule requête pour les deux associations
+        code_postal.communes.add(self.etalans, autre)
+        self.assertCountEqual(self.codes_communes("99999"), ["25222", "25056"])
+        self.assertSearchAJour(
+            EluMunicipal,
+            EluMunicipal.objects.filter(commune__in=[self.etalans, autre]).values_list(
+                "pk", flat=True
+            ),
+        )
+
+        code_postal.communes.remove(autre)
+        self.assertEqual(self.codes_communes("99999"), ["25222"])
+
+        code_postal.communes.clear()
+        self.assertEqual(self.codes_communes("99999"), [])
+
+
+    def test_synchronisation(self):
+        with override_settings(DATA_FRANCE_RECHERCHE_TRIGGERS=True):
+            self.assertFalse(synchroniser_triggers_recherche(None))
+
+        self.assertTrue(synchroniser_triggers_recherche(None))
+        self.assertFalse(triggers_recherche_installes(None))
+
+        # sans les triggers, le vecteur n'est plus recalculé
+        Commune.objects.filter(pk=self.etalans.pk).update(nom="Zorglub")
+        self.assertEqual(self.codes_communes("zorglub"), [])
+
+
+class ExecuterUnitesTestCase(TestCase):
+    def test_relance_unites_en_echec(self):
+        """Seules les unités en échec sont signalées"""
+        unites = [
+            Unite("ok", "SELECT 1;"),
+            Unite("ko", "SELECT 1/0;"),
+        ]
+
+        with self.assertRaises(RuntimeError) as cm:
+            executer_unites(unites, None, tentatives=2)
+
+        self.assertIn("ko", str(cm.exception))
+        self.assertNotIn("ok", str(cm.exception))
+
+    def test_durees(self):
+        durees = executer_unites(
+            [Unite("a", "SELECT 1;"), Unite("b", "SELECT 2;")], None
+        )
+        self.assertCountEqual(durees, ["a", "b"])
+
+
+class AgregerGeometriesTestCase(TestCase):
+    def test_ne_recalcule_que_les_agregats_modifies(self):
+        # l'import initial a enregistré les empreintes de tous les agrégats
+        durees = agreger_geometries_et_populations(None)
+        self.assertIsNone(durees["département 25"])
+        self.assertIsNone(durees["EPCI 200046977"])
+
+        Departement.objects.filter(code="25").update(geometry=None)
+
+        durees = agreger_geometries_et_populations(None)
+        self.assertIsNotNone(durees["département 25"])
+        self.assertIsNone(durees["département 39"])
+        self.assertIsNotNone(Departement.objects.get(code="25").geometry)
+
+    def test_empreintes_enregistrees(self):
+        self.assertTrue(
+            EmpreinteAgregat.objects.filter(nom="département 25").exists()
+        )
+
+
+class VersionDonneesTestCase(TestCase):
+    def test_version_inchangee_sans_modification(self):
+        """Aucune nouvelle version n'est créée si les données n'ont pas changé"""
+        version = enregistrer_version_donnees(None, empreintes_tables(None))
+
+        self.assertIn("data_france_commune", version.empreintes)
+        self.assertNotIn("data_france_versiondonnees", version.empreintes)
+        self.assertEqual(
+            enregistrer_version_donnees(None, empreintes_tables(None)).pk, version.pk
+        )
+
+    def test_nouvelle_version_apres_modification(self):
+        version = enregistrer_version_donnees(None, empreintes_tables(None))
+
+        Departement.objects.filter(code="25").update(nom="Doubs modifié")
+        nouvelle = enregistrer_version_donnees(None, empreintes_tables(None))
+
+        self.assertNotEqual(nouvelle.pk, version.pk)
+        self.assertNotEqual(nouvelle.identifiant, version.identifiant)
+        self.assertEqual(
+            [
+                t
+                for t in nouvelle.empreintes
+                if nouvelle.empreintes[t] != version.empreintes[t]
+            ],
+            ["data_france_departement"],
+        )
+
+    def test_empreinte_des_geometries(self):
+        """Seul le WKB des géométries compte, pas le GeoJSON simplifié"""
+        empreinte = empreintes_tables(None)["data_france_departement"]
+
+        Departement.objects.filter(code="25").update(geojson_forte="{}")
+        self.assertEqual(empreintes_tables(None)["data_france_departement"], empreinte)
+
+        Departement.objects.filter(code="25").update(
+            geometry=Departement.objects.get(code="39").geometry
+        )
+        self.assertNotEqual(
+            empreintes_tables(None)["data_france_departement"], empreinte
+        )
+
+
+class FichierGeometriesTestCase(SimpleTestCase):
+    def ecrire(self, geometries):
+        with tempfile.NamedTemporaryFile(suffix=".wkb.lzma") as f:
+            ecrire_geometries(f.name, geometries)
+            with lzma.open(f.name) as g:
+                return io.BytesIO(g.read())
+
+    def test_relecture(self):
+        geometries = [(3, b"\x01\x02\x03"), (1, None), (7, b"\x04\x05")]
+        lecteur = LecteurGeometries(self.ecrire(geometries))
+
+        self.assertEqual(len(lecteur), 2)
+        self.assertEqual(list(lecteur), [(3, b"\x01\x02\x03"), (7, b"\x04\x05")])
+
+    def test_acces_direct(self):
+        lecteur = LecteurGeometries(self.ecrire([(3, b"abc"), (7, b"de")]))
+        self.assertEqual(lecteur.lire(*lecteur.positions()[7]), b"de")
+        self.assertEqual(lecteur.lire(*lecteur.positions()[3]), b"abc")
+
+    def test_signature_invalide(self):
+        with self.assertRaises(FormatGeometriesInvalide):
+            LecteurGeometries(io.BytesIO(b"id,code\n" * 4))
+
+
+class ImportGeometriesTestCase(TestCase):
+    def test_import_geometries_binaires(self):
+        """Les géométries d'un fichier binaire remplacent celles qui diffèrent"""
+        paris, lyon = (
+            Commune.objects.filter(type="COM", code__in=["75056", "69123"])
+            .annotate(wkb=AsWKB("geometry"))
+            .order_by("-code")
+        )
+        supprimees = (
+            Commune.objects.exclude(id__in=[paris.id, lyon.id])
+            .filter(geometry__isnull=False)
+            .count()
+        )
+
+        with tempfile.NamedTemporaryFile(suffix=".wkb.lzma") as fichier:
+            ecrire_geometries(
+                fichier.name,
+                [(lyon.id, bytes(lyon.wkb)), (paris.id, bytes(lyon.wkb))],
+            )
+            with lzma.open(fichier.name) as f:
+                modifiees = importer_geometries(f, "data_france_commune", using=None)
+
+        # seule la géométrie de Paris est remplacée, et celles des communes
+        # absentes du fichier sont supprimées
+        self.assertEqual(modifiees, 1 + supprimees)
+        paris.refresh_from_db()
+        lyon.refresh_from_db()
+        self.assertTrue(paris.geometry.equals(lyon.geometry))
+        self.assertEqual(Commune.objects.filter(geometry__isnull=False).count(), 2)
+
+
+class CopieBinaireTestCase(SimpleTestCase):
+    TYPES = {
+        "id": "integer",
+        "code": "character varying",
+        "population": "integer",
+        "date": "date",
+        "horaires": "jsonb",
+    }
+
+    def test_relecture(self):
+        f = io.BytesIO()
+        transcrire_csv(
+            io.StringIO(
+                "id,code,population,date,horaires\n"
+                '1,01001,\\N,2020-03-15,[]\n2,"a,b",12,\\N,"[1]"\n'
+            ),
+            f,
+            self.TYPES,
+        )
+        f.seek(0)
+        lignes = list(lire_copie(f))
+
+        self.assertEqual(
+            [(l["id"], l["code"], l["population"]) for l in lignes],
+            [(1, "01001", None), (2, "a,b", 12)],
+        )
+        # 2020-03-15 est le 7379e jour depuis le 1er janvier 2000
+        self.assertEqual(lignes[0]["date"], (7379).to_bytes(4, "big"))
+        self.assertEqual(lignes[1]["horaires"], b"\x01[1]")
+
+    def test_type_inconnu(self):
+        with self.assertRaises(FormatCopieInvalide):
+            EcrivainCopieBinaire(io.BytesIO(), {"id": "integer; DROP TABLE x"})
+
+
+TYPES_COLONNES_SQL = """
+    SELECT attname, format_type(atttypid, NULL)
+    FROM pg_attribute
+    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+"""
+
+
+class ImportCopieBinaireTestCase(TestCase):
+    def types_colonnes(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(TYPES_COLONNES_SQL, [table])
+            return dict(cursor.fetchall())
+
+    def test_import_binaire_identique(self):
+        """Un fichier COPY binaire donne les mêmes lignes que le CSV d'origine"""
+        with ouvrir_donnees("elus_municipaux.csv.lzma", "rt") as f:
+            # l'en-tête et les 200 premiers élus suffisent
+            contenu = "".join(islice(f, 201))
+        binaire = io.BytesIO()
+        transcrire_csv(
+            io.StringIO(contenu),
+            binaire,
+            self.types_colonnes("data_france_elumunicipal"),
+        )
+
+        EluMunicipal.objects.update(nom="", date_naissance="1900-01-01")
+        binaire.seek(0)
+        import_with_temp_table(
+            binaire, "data_france_elumunicipal", using=None, binaire=True
+        )
+
+        bilan = import_with_temp_table(
+            io.StringIO(contenu),
+            "data_france_elumunicipal",
+            using=None,
+            incremental=True,
+        )
+        self.assertEqual(bilan.mis_a_jour, 0)
+        self.assertEqual(bilan.inchanges, 200)
+
+
+class CompressionTestCase(SimpleTestCase):
+    def relire(self, codec):
+        with tempfile.TemporaryDirectory() as d:
+            chemin = f"{d}/fichier.csv{EXTENSIONS[codec]}"
+            with ouvrir(chemin, "wt", newline="") as f:
+                f.write("id,nom\n1,Étalans\n")
+            # le format est détecté d'après le contenu, pas d'après l'extension
+            with open(chemin, "rb") as brut, ouvrir(brut, "rt", newline="") as f:
+                return f.read()
+
+    def test_lzma(self):
+        self.assertEqual(self.relire("lzma"), "id,nom\n1,Étalans\n")
+
+    @skipIf(zstandard is None, "zstandard n'est pas installé")
+    def test_zstd(self):
+        self.assertEqual(self.relire("zstd"), "id,nom\n1,Étalans\n")
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+import utils
+from utils import CacheEmpreintes, check_hash
+
+CONTENU = b"code;nom\n59350;Lille\n"
+EMPREINTE = hashlib.sha256(CONTENU).hexdigest()
+
+
+class CacheEmpreintesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        self.prepare_dir = Path(self.dossier.name)
+        self.fichier = self.prepare_dir / "source.csv"
+        self.fichier.write_bytes(CONTENU)
+
+        self.cache = CacheEmpreintes(self.prepare_dir / "empreintes.json")
+        mock.patch.object(utils, "cache_empreintes", self.cache).start()
+
+        self.calculer = mock.patch.object(
+            utils, "calculer_empreinte", wraps=utils.calculer_empreinte
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def tearDown(self):
+        self.dossier.cleanup()
+
+    def verifier(self, **options):
+        verification = check_hash(self.fichier, EMPREINTE)
+        tache = SimpleNamespace(options=options, value_savers=[])
+        return verification(tache, {})
+
+    def test_empreinte_reutilisee(self):
+        self.assertTrue(self.verifier())
+        self.assertEqual(self.calculer.call_count, 1)
+
+        self.assertTrue(self.verifier())
+        self.assertEqual(self.calculer.call_count, 1)
+
+        # le cache est relu depuis le disque par une nouvelle instance
+        with mock.patch.object(
+            utils, "cache_empreintes", CacheEmpreintes(self.cache.path)
+        ):
+            self.assertTrue(self.verifier())
+        self.assertEqual(self.calculer.call_count, 1)
+
+    def test_taille_modifiee(self):
+        self.verifier()
+        stat = self.fichier.stat()
+        self.fichier.write_bytes(CONTENU + b"59000;Lille\n")
+        os.utime(self.fichier, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertFalse(self.verifier())
+        self.assertEqual(self.calculer.call_count, 2)
+
+    def test_date_modifiee(self):
+        self.verifier()
+        stat = self.fichier.stat()
+        os.utime(self.fichier, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        self.assertTrue(self.verifier())
+        self.assertEqual(self.calculer.call_count, 2)
+
+    def test_inode_modifie(self):
+        self.verifier()
+        stat = self.fichier.stat()
+        copie = self.prepare_dir / "copie.csv"
+        shutil.copy2(self.fichier, copie)
+        copie.replace(self.fichier)
+        self.assertNotEqual(self.fichier.stat().st_ino, stat.st_ino)
+        self.assertEqual(self.fichier.stat().st_mtime_ns, stat.st_mtime_ns)
+
+        self.assertTrue(self.verifier())
+        self.assertEqual(self.calculer.call_count, 2)
+
+    def test_verifier_tout(self):
+        self.verifier()
+        self.assertTrue(self.verifier(verifier_tout=True))
+        self.assertEqual(self.calculer.call_count, 2)
+
+        verification = check_hash(self.fichier, EMPREINTE)
+        verification.verifier_tout = True
+        self.assertTrue(verification.est_valide())
+        self.assertEqual(self.calculer.call_count, 3)
+
+    def test_verifier_tout_detecte_corruption(self):
+        self.verifier()
+        # même taille, même date, même inode : seul le calcul complet le voit
+        stat = self.fichier.stat()
+        with self.fichier.open("r+b") as f:
+            f.write(b"C")
+        os.utime(self.fichier, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertTrue(self.verifier())
+        self.assertFalse(self.verifier(verifier_tout=True))
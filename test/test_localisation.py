@@ -0,0 +1,53 @@
+import random
+import unittest
+
+from django.test import TestCase
+
+from data_france.localisation import Localisateur, localiser
+from data_france.models import Commune
+
+try:
+    import numpy as np
+    import shapely
+except ImportError:
+    np = shapely = None
+
+
+@unittest.skipIf(shapely is None, "shapely et numpy sont nécessaires")
+class LocalisateurTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.localisateur = Localisateur.depuis_base()
+
+        # des points tirés dans un échantillon de communes
+        random.seed(0)
+        communes = random.sample(
+            list(Commune.objects.filter(type="COM", geometry__isnull=False)), 200
+        )
+        points = [c.geometry.point_on_surface for c in communes]
+        cls.codes = [c.code for c in communes]
+        cls.latitudes = np.array([p.y for p in points])
+        cls.longitudes = np.array([p.x for p in points])
+
+    def test_localiser_lot(self):
+        resultats = self.localisateur.localiser(self.latitudes, self.longitudes)
+
+        self.assertEqual(list(resultats["commune"]), self.codes)
+        self.assertEqual(len(resultats["canton"]), len(self.codes))
+
+    def test_point_hors_de_toute_commune(self):
+        resultats = self.localisateur.localiser([0.0], [0.0])
+        self.assertEqual(list(resultats["commune"]), [None])
+
+    def test_comparaison_avec_sql(self):
+        """Le localisateur trouve les mêmes communes que la localisation en SQL"""
+        latitudes = [*self.latitudes, 0.0]
+        longitudes = [*self.longitudes, 0.0]
+
+        resultats = self.localisateur.localiser(latitudes, longitudes)
+        attendus = localiser(zip(latitudes, longitudes))
+
+        self.assertEqual(
+            list(resultats["commune"]),
+            [a["commune"] and a["commune"]["code"] for a in attendus],
+        )
@@ -1,5 +1,10 @@
+from unittest import mock
+
 from django.test import TestCase
 
+from data_france.cache import enregistrer_version_donnees
+from data_france.geometries import cache_geometries
+
 from data_france.models import (
     Commune,
     EPCI,
@@ -45,6 +50,16 @@ class CommuneTestCase(TestCase):
             ).exists()
         )
 
+    def test_localiser(self):
+        """Le queryset permet de trouver les communes contenant un point"""
+        etalans = Commune.objects.get(type="COM", code="25222")
+        point = etalans.geometry.point_on_surface
+
+        self.assertEqual(
+            list(Commune.objects.localiser(point.y, point.x).filter(type="COM")),
+            [etalans],
+        )
+
     def test_avec_population(self):
         """Les communes ont leur population"""
 
@@ -91,6 +106,92 @@ class CommuneTestCase(TestCase):
         )
 
 
+class GeometriePrepareeTestCase(TestCase):
+    def setUp(self):
+        cache_geometries.vider()
+
+    def point_etalans(self):
+        point = Commune.objects.get(type="COM", code="25222").geometry.point_on_surface
+        return point.y, point.x
+
+    def test_contient_point(self):
+        latitude, longitude = self.point_etalans()
+        etalans = Commune.objects.defer("geometry").get(type="COM", code="25222")
+        doubs = Departement.objects.defer("geometry").get(code="25")
+        jura = Departement.objects.defer("geometry").get(code="39")
+
+        self.assertTrue(etalans.contient_point(latitude, longitude))
+        self.assertTrue(doubs.contient_point(latitude, longitude))
+        self.assertFalse(jura.contient_point(latitude, longitude))
+
+    def test_geometrie_en_cache(self):
+        latitude, longitude = self.point_etalans()
+        etalans = Commune.objects.defer("geometry").get(type="COM", code="25222")
+        etalans.contient_point(latitude, longitude)
+
+        # ni requête, ni désérialisation pour une autre instance de la même commune
+        autre = Commune(pk=etalans.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(autre.contient_point(latitude, longitude))
+
+    def test_succes_et_echecs_du_cache(self):
+        latitude, longitude = self.point_etalans()
+        communes = Commune.objects.defer("geometry").filter(
+            type="COM", code__in=["25222", "25056"]
+        )
+
+        for _ in range(3):
+            for commune in communes:
+                commune.contient_point(latitude, longitude)
+
+        # chaque géométrie n'est chargée qu'une fois
+        self.assertEqual(cache_geometries.echecs, 2)
+        self.assertEqual(cache_geometries.succes, 4)
+
+    def test_eviction_de_la_geometrie_la_plus_ancienne(self):
+        latitude, longitude = self.point_etalans()
+        etalans, besancon = (
+            Commune.objects.defer("geometry")
+            .filter(type="COM", code__in=["25222", "25056"])
+            .order_by("-code")
+        )
+
+        with mock.patch.object(cache_geometries, "taille", 1):
+            etalans.contient_point(latitude, longitude)
+            besancon.contient_point(latitude, longitude)
+            etalans.contient_point(latitude, longitude)
+
+        self.assertEqual(cache_geometries.echecs, 3)
+        self.assertEqual(cache_geometries.succes, 0)
+
+    def test_invalidation_par_version(self):
+        etalans = Commune.objects.defer("geometry").get(type="COM", code="25222")
+        etalans.geometrie_preparee()
+        self.assertEqual(len(cache_geometries), 1)
+
+        enregistrer_version_donnees()
+        with mock.patch.object(cache_geometries, "delai_verification", 0):
+            Departement.objects.defer("geometry").get(code="25").geometrie_preparee()
+        self.assertEqual(len(cache_geometries), 1)
+
+
+class RechercheFloueTestCase(TestCase):
+    def codes(self, q, flou):
+        return [
+            c.code for c in Commune.objects.search(q, flou=flou).filter(type="COM")[:10]
+        ]
+
+    def test_faute_de_frappe(self):
+        self.assertEqual(self.codes("marseile", flou=False), [])
+        self.assertIn("13055", self.codes("marseile", flou=True))
+
+    def test_abreviation(self):
+        self.assertIn("42218", self.codes("st etienne", flou=True))
+
+    def test_recherche_exacte_conservee(self):
+        self.assertEqual(self.codes("etalans", flou=True)[0], "25222")
+
+
 class EPCITestCase(TestCase):
     def test_epci_correctement_importes(self):
         """Le nombre d'EPCI en base correspond à ce qui est attendu"""
@@ -0,0 +1,118 @@
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+from django.test import SimpleTestCase
+from shapely.geometry import Polygon
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+from simplification import (
+    Simplificateur,
+    coordonnees,
+    depuis_simplification,
+    simplifier_regions,
+    trouver_jonctions,
+    voisinages,
+)
+
+# une frontière nord-sud en x = 1, légèrement sinueuse
+FRONTIERE = [
+    (1 + (0.001 * np.sin(i * 1.7) if 0 < i < 50 else 0), i / 50) for i in range(51)
+]
+COMMUNE_A = Polygon([(0, 0), *FRONTIERE, (0, 1)])
+COMMUNE_B = Polygon([(2, 0), (2, 1), *reversed(FRONTIERE)])
+CANTON = COMMUNE_A.union(COMMUNE_B)
+
+# une commune enclavée dans une autre : l'anneau commun n'a aucune jonction
+ANGLES = np.linspace(0, 2 * np.pi, 60, endpoint=False)
+ENCLAVE = [
+    (5 + 0.1 * np.cos(a) + 0.0005 * np.sin(7 * a), 5 + 0.1 * np.sin(a))
+    for a in ANGLES
+]
+COMMUNE_ENCLAVEE = Polygon(ENCLAVE)
+COMMUNE_ENCLAVANTE = Polygon([(4, 4), (6, 4), (6, 6), (4, 6)], [ENCLAVE])
+
+
+def lot(*geometries):
+    return [("communes", {"geometry": g.wkb}) for g in geometries]
+
+
+def simplificateur(*geometries, aire_minimum):
+    jonctions = trouver_jonctions(voisinages(lot(*geometries)))
+    return Simplificateur(jonctions, aire_minimum)
+
+
+class SimplificationTestCase(SimpleTestCase):
+    def test_jonctions(self):
+        jonctions = trouver_jonctions(voisinages(lot(COMMUNE_A, COMMUNE_B, CANTON)))
+        self.assertEqual(coordonnees(jonctions).tolist(), [[1, 0], [1, 1]])
+
+    def test_pas_de_jonction_pour_une_enclave(self):
+        jonctions = trouver_jonctions(
+            voisinages(lot(COMMUNE_ENCLAVANTE, COMMUNE_ENCLAVEE))
+        )
+        self.assertEqual(len(jonctions), 0)
+
+    def test_frontiere_commune(self):
+        s = simplificateur(COMMUNE_A, COMMUNE_B, aire_minimum=1e-6)
+        a, b = s.simplifier(COMMUNE_A), s.simplifier(COMMUNE_B)
+
+        # la frontière sinueuse a bien été simplifiée...
+        self.assertLess(len(a.geoms[0].exterior.coords), len(FRONTIERE))
+        # ...de la même façon des deux côtés
+        frontiere_a = {p for p in a.geoms[0].exterior.coords if 0.5 < p[0] < 1.5}
+        frontiere_b = {p for p in b.geoms[0].exterior.coords if 0.5 < p[0] < 1.5}
+        self.assertEqual(frontiere_a, frontiere_b)
+        self.assertEqual(a.intersection(b).area, 0)
+        self.assertEqual(a.union(b).geom_type, "Polygon")
+
+    def test_commune_dans_canton(self):
+        s = simplificateur(COMMUNE_A, COMMUNE_B, CANTON, aire_minimum=1e-6)
+        a, b, canton = (s.simplifier(g) for g in (COMMUNE_A, COMMUNE_B, CANTON))
+        self.assertEqual(a.union(b).symmetric_difference(canton).area, 0)
+
+    def test_boucle_garde_trois_points(self):
+        s = simplificateur(COMMUNE_ENCLAVANTE, COMMUNE_ENCLAVEE, aire_minimum=1e-5)
+        enclavee = s.simplifier(COMMUNE_ENCLAVEE).geoms[0].exterior
+        trou = s.simplifier(COMMUNE_ENCLAVANTE).geoms[0].interiors[0]
+
+        self.assertEqual(len(enclavee.coords), 4)
+        self.assertEqual(set(enclavee.coords), set(trou.coords))
+
+    def test_simplifier_regions(self):
+        schema = pa.schema([("code", pa.string()), ("geometry", pa.binary())])
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            communes, cantons, dest = (
+                d / "communes.arrow",
+                d / "cantons.arrow",
+                d / "simplifie.arrow",
+            )
+            for chemin, entites in (
+                (communes, {"A": COMMUNE_A, "B": COMMUNE_B}),
+                (cantons, {"AB": CANTON}),
+            ):
+                with pa.ipc.new_file(str(chemin), schema) as f:
+                    f.write_batch(
+                        pa.RecordBatch.from_pylist(
+                            [{"code": c, "geometry": g.wkb} for c, g in entites.items()],
+                            schema=schema,
+                        )
+                    )
+
+            simplifier_regions(
+                {dest: {"communes": communes, "cantons": cantons}},
+                1e-6,
+                max_processus=2,
+            )
+
+            self.assertEqual(
+                [p["code"] for p, _ in depuis_simplification(dest, "communes")],
+                ["A", "B"],
+            )
+            self.assertEqual(
+                [p["code"] for p, _ in depuis_simplification(dest, "cantons")],
+                ["AB"],
+            )
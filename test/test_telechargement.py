@@ -0,0 +1,147 @@
+import hashlib
+import re
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+from telechargement import (
+    EmpreinteIncorrecte,
+    PlageIncorrecte,
+    fichier_partiel,
+    telecharger,
+)
+
+CONTENU = bytes(range(256)) * 64
+EMPREINTE = hashlib.sha256(CONTENU).hexdigest()
+
+
+class Serveur(BaseHTTPRequestHandler):
+    # "plages" : requêtes Range respectées ; "complet" : toujours 200 ;
+    # "depuis_zero" : 206 avec une plage commençant au début du fichier ;
+    # "decale" : 206 avec une plage commençant ailleurs que demandé ;
+    # "toujours_decale" : de même, y compris sans requête Range
+    mode = "plages"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        plage = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if self.mode == "toujours_decale":
+            return self.repondre_plage(10)
+        if plage is None or self.mode == "complet":
+            return self.repondre(200, CONTENU)
+
+        debut = int(plage.group(1))
+        if debut >= len(CONTENU):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(CONTENU)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.mode == "depuis_zero":
+            debut = 0
+        elif self.mode == "decale":
+            debut //= 2
+        self.repondre_plage(debut)
+
+    def repondre_plage(self, debut):
+        self.repondre(
+            206,
+            CONTENU[debut:],
+            {"Content-Range": f"bytes {debut}-{len(CONTENU) - 1}/{len(CONTENU)}"},
+        )
+
+    def repondre(self, statut, contenu, entetes=()):
+        self.send_response(statut)
+        for nom, valeur in dict(entetes).items():
+            self.send_header(nom, valeur)
+        self.send_header("Content-Length", str(len(contenu)))
+        self.end_headers()
+        self.wfile.write(contenu)
+
+
+class TelechargementTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.serveur = ThreadingHTTPServer(("127.0.0.1", 0), Serveur)
+        cls.url = f"http://127.0.0.1:{cls.serveur.server_port}/source"
+        threading.Thread(target=cls.serveur.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.serveur.shutdown()
+        cls.serveur.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        self.dest = Path(self.dossier.name) / "source.bin"
+        Serveur.mode = "plages"
+
+    def tearDown(self):
+        self.dossier.cleanup()
+
+    def partiel(self, contenu):
+        fichier_partiel(self.dest).write_bytes(contenu)
+
+    def test_telechargement_complet(self):
+        self.assertEqual(telecharger(self.url, self.dest, EMPREINTE), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+        self.assertFalse(fichier_partiel(self.dest).exists())
+
+    def test_reprise(self):
+        self.partiel(CONTENU[:1000])
+        self.assertEqual(telecharger(self.url, self.dest, EMPREINTE), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_serveur_sans_plages(self):
+        Serveur.mode = "complet"
+        self.partiel(CONTENU[:1000])
+        self.assertEqual(telecharger(self.url, self.dest, EMPREINTE), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_plage_depuis_le_debut(self):
+        Serveur.mode = "depuis_zero"
+        self.partiel(CONTENU[:1000])
+        self.assertEqual(telecharger(self.url, self.dest), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_plage_decalee(self):
+        # la plage reçue est refusée, et le fichier téléchargé à nouveau en entier
+        Serveur.mode = "decale"
+        self.partiel(CONTENU[:1000])
+        self.assertEqual(telecharger(self.url, self.dest), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_plage_toujours_decalee(self):
+        Serveur.mode = "toujours_decale"
+        self.partiel(CONTENU[:1000])
+        with self.assertRaises(PlageIncorrecte):
+            telecharger(self.url, self.dest)
+        self.assertFalse(self.dest.exists())
+
+    def test_partiel_deja_complet(self):
+        self.partiel(CONTENU)
+        self.assertEqual(telecharger(self.url, self.dest, EMPREINTE), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_partiel_trop_long(self):
+        # le serveur répond 416, mais le fichier partiel n'a pas la taille annoncée
+        self.partiel(CONTENU + b"x" * 10)
+        self.assertEqual(telecharger(self.url, self.dest), EMPREINTE)
+        self.assertEqual(self.dest.read_bytes(), CONTENU)
+
+    def test_empreinte_incorrecte(self):
+        self.partiel(b"x" * len(CONTENU))
+        with self.assertRaises(EmpreinteIncorrecte):
+            telecharger(self.url, self.dest, EMPREINTE)
+        self.assertFalse(fichier_partiel(self.dest).exists())
+        self.assertFalse(self.dest.exists())
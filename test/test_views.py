@@ -1,13 +1,21 @@
 import json
 
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.core.cache import caches
 from django.http import QueryDict
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, RequestFactory, override_settings
 
-from data_france.models import Commune, Departement
+from data_france.cache import enregistrer_version_donnees
+from data_france.models import Commune, Departement, Region
 from data_france.views import (
     RechercheCommuneView,
     CommuneParCodeView,
+    CommuneParCodesView,
     DepartementParCodeView,
+    DepartementParCodesView,
+    RegionParCodesView,
+    LocaliserView,
+    LocaliserLotView,
 )
 
 
@@ -29,10 +37,20 @@ class ViewTestCase(TestCase):
 
     def get_status_json(self, res):
         self.assertEqual("application/json", res["Content-Type"])
+        content = b"".join(res.streaming_content) if res.streaming else res.content
         try:
-            return res.status_code, json.loads(res.content.decode("utf-8"))
+            return res.status_code, json.loads(content.decode("utf-8"))
         except ValueError:
-            self.fail(f"Devrait renvoyer un JSON valide en UTF-8: '{res.content}'")
+            self.fail(f"Devrait renvoyer un JSON valide en UTF-8: '{content}'")
+
+    def geometrie_attendue(self, instance):
+        """Renvoie la géométrie de l'instance telle que sérialisée par PostGIS"""
+        return json.loads(
+            type(instance)
+            .objects.annotate(g=AsGeoJSON("geometry"))
+            .values_list("g", flat=True)
+            .get(pk=instance.pk)
+        )
 
 
 class CommuneSearchViewTestCase(ViewTestCase):
@@ -89,6 +107,15 @@ class CommuneSearchViewTestCase(ViewTestCase):
         self.assertEqual(status, 200)
         self.assertCountEqual([c["code"] for c in results["results"]], ["75056SR13"])
 
+    def test_recherche_floue(self):
+        req = self.factory.get(
+            f"/communes/?{self.query_builder({'q': 'etalan', 'flou': 'true'})}"
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["results"][0]["code"], "25222")
+
     def test_recherche_en_geojson(self):
         req = self.factory.get(
             f"/communes/?{self.query_builder({'q': 'etalans', 'geojson': 'true'})}"
@@ -118,11 +145,16 @@ class CommuneSearchViewTestCase(ViewTestCase):
         )
 
         etalans = Commune.objects.get(type="COM", code="25222")
-        expected_geometry = json.loads(etalans.geometry.geojson)
+        expected_geometry = self.geometrie_attendue(etalans)
 
         self.assertEqual(feature["geometry"], expected_geometry)
 
 
+@override_settings(DATA_FRANCE_RECHERCHE_COMMUNES="memoire")
+class CommuneSearchMemoireViewTestCase(CommuneSearchViewTestCase):
+    """Mêmes tests, avec l'index de recherche en mémoire"""
+
+
 class CommuneParCodeViewTestCase(ViewTestCase):
     view_class = CommuneParCodeView
 
@@ -195,7 +227,7 @@ class DepartementViewTestCase(ViewTestCase):
                         "code": d.chef_lieu.code,
                     },
                 },
-                "geometry": json.loads(d.geometry.geojson),
+                "geometry": self.geometrie_attendue(d),
             },
         )
 
@@ -214,3 +246,322 @@ class DepartementViewTestCase(ViewTestCase):
         res = self.view(req)
 
         self.assertEqual(res.status_code, 400)
+
+
+class CommuneParCodesViewTestCase(ViewTestCase):
+    view_class = CommuneParCodesView
+
+    def test_obtenir_plusieurs_communes(self):
+        communes = list(Commune.objects.filter(type="COM").order_by("?")[:5])
+        codes = [c.code for c in communes]
+
+        req = self.factory.get(
+            f"/communes/par-codes/?{self.query_builder({'codes': ','.join([*codes, '00000']), 'type': 'COM'})}"
+        )
+        res = self.view(req)
+
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            results,
+            {
+                "results": {
+                    c.code: {
+                        "code": c.code,
+                        "type": c.type,
+                        "nom": c.nom_complet,
+                        "code_departement": c.code_departement,
+                        "nom_departement": c.nom_departement,
+                    }
+                    for c in communes
+                },
+                "missing": ["00000"],
+            },
+        )
+
+    def test_type_obligatoire(self):
+        req = self.factory.get(f"/communes/par-codes/?{self.query_builder({'codes': '25222'})}")
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 400)
+        self.assertCountEqual(results["errors"], ["type"])
+
+
+class DepartementParCodesViewTestCase(ViewTestCase):
+    view_class = DepartementParCodesView
+
+    def test_obtenir_departements_geojson(self):
+        req = self.factory.get(
+            f"/departements/par-codes/?{self.query_builder({'codes': '25,39,00', 'geojson': 'true'})}"
+        )
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["type"], "FeatureCollection")
+        self.assertCountEqual(
+            [f["properties"]["code"] for f in results["features"]], ["25", "39"]
+        )
+        self.assertEqual(results["missing"], ["00"])
+
+    def test_trop_de_codes(self):
+        codes = ",".join(str(i) for i in range(2000))
+        req = self.factory.get(f"/departements/par-codes/?{self.query_builder({'codes': codes})}")
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 400)
+        self.assertCountEqual(results["errors"], ["codes"])
+
+
+class GeometriesSimplifieesViewTestCase(ViewTestCase):
+    view_class = DepartementParCodeView
+
+    def test_obtenir_geometrie_simplifiee(self):
+        d = Departement.objects.order_by("?").first()
+
+        req = self.factory.get(
+            f"/departements/?{self.query_builder({'code': d.code, 'geojson': 'true', 'simplification': 'forte'})}"
+        )
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["geometry"], json.loads(d.geojson_forte))
+
+    def test_niveau_deduit_du_zoom(self):
+        d = Departement.objects.order_by("?").first()
+
+        req = self.factory.get(
+            f"/departements/?{self.query_builder({'code': d.code, 'geojson': 'true', 'zoom': '9'})}"
+        )
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["geometry"], json.loads(d.geojson_moyenne))
+
+    def test_geometrie_complete_au_zoom_maximal(self):
+        d = Departement.objects.order_by("?").first()
+
+        req = self.factory.get(
+            f"/departements/?{self.query_builder({'code': d.code, 'geojson': 'true', 'zoom': '18'})}"
+        )
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["geometry"], self.geometrie_attendue(d))
+
+    def test_niveau_invalide(self):
+        req = self.factory.get(
+            f"/departements/?{self.query_builder({'code': '25', 'simplification': 'extreme'})}"
+        )
+        res = self.view(req)
+        status, results = self.get_status_json(res)
+
+        self.assertEqual(status, 400)
+        self.assertCountEqual(results["errors"], ["simplification"])
+
+
+class RegionParCodesGeoJSONTestCase(ViewTestCase):
+    view_class = RegionParCodesView
+
+    def obtenir(self, **params):
+        regions = Region.objects.order_by("code")
+        req = self.factory.get(
+            f"/regions/par-codes/?{self.query_builder({'codes': ','.join(r.code for r in regions), 'geojson': 'true', **params})}"
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["type"], "FeatureCollection")
+        self.assertEqual(results["missing"], [])
+        self.assertEqual(len(results["features"]), regions.count())
+        for feature in results["features"]:
+            self.assertEqual(feature["type"], "Feature")
+
+        return {
+            r: next(
+                f for f in results["features"] if f["properties"]["code"] == r.code
+            )
+            for r in regions
+        }
+
+    def test_proprietes(self):
+        for region, feature in self.obtenir(simplification="forte").items():
+            self.assertEqual(feature["properties"], region.as_dict())
+
+    def test_geometries_simplifiees(self):
+        for region, feature in self.obtenir(simplification="forte").items():
+            self.assertEqual(feature["geometry"], json.loads(region.geojson_forte))
+
+    def test_niveau_deduit_du_zoom(self):
+        for region, feature in self.obtenir(zoom="12").items():
+            self.assertEqual(feature["geometry"], json.loads(region.geojson_faible))
+
+    def test_geometries_completes(self):
+        for region, feature in self.obtenir().items():
+            self.assertEqual(feature["geometry"], self.geometrie_attendue(region))
+
+
+@override_settings(
+    DATA_FRANCE_CACHE="data_france",
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "data_france": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "data_france_tests",
+        },
+    },
+)
+class CacheDonneesTestCase(ViewTestCase):
+    view_class = DepartementParCodeView
+
+    def setUp(self) -> None:
+        super().setUp()
+        caches["data_france"].clear()
+        enregistrer_version_donnees()
+
+    def requete(self, params, **headers):
+        return self.view(
+            self.factory.get(f"/departements/?{self.query_builder(params)}", **headers)
+        )
+
+    def test_etag_et_requete_conditionnelle(self):
+        res = self.requete({"code": "25"})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("ETag", res)
+        self.assertIn("Last-Modified", res)
+
+        etag, last_modified = res["ETag"], res["Last-Modified"]
+        res = self.requete({"code": "25"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res["ETag"], etag)
+        self.assertEqual(res["Last-Modified"], last_modified)
+
+    def test_requete_conditionnelle_par_date(self):
+        res = self.requete({"code": "25"})
+        etag, last_modified = res["ETag"], res["Last-Modified"]
+
+        res = self.requete({"code": "25"}, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res["ETag"], etag)
+        self.assertEqual(res["Last-Modified"], last_modified)
+
+    def test_requete_conditionnelle_sans_lecture_des_tables(self):
+        etag = self.requete({"code": "25"})["ETag"]
+
+        # la version des données est conservée dans le cache
+        with self.assertNumQueries(0):
+            res = self.requete({"code": "25"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+    def test_parametres_normalises(self):
+        etag = self.requete([("code", "25"), ("geojson", "true")])["ETag"]
+        self.assertEqual(
+            etag, self.requete([("geojson", "true"), ("code", "25")])["ETag"]
+        )
+
+    def test_invalidation_par_nouvelle_version(self):
+        res = self.requete({"code": "25"})
+        etag = res["ETag"]
+
+        Departement.objects.filter(code="25").update(nom="Doubs modifié")
+
+        # la réponse en cache est toujours servie tant que la version n'a pas changé
+        status, results = self.get_status_json(self.requete({"code": "25"}))
+        self.assertEqual(results["nom"], "Doubs")
+
+        enregistrer_version_donnees()
+
+        res = self.requete({"code": "25"}, HTTP_IF_NONE_MATCH=etag)
+        status, results = self.get_status_json(res)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(res["ETag"], etag)
+        self.assertEqual(results["nom"], "Doubs modifié")
+
+    def test_reponses_en_erreur_non_mises_en_cache(self):
+        res = self.requete({"geojson": "true"})
+        self.assertEqual(res.status_code, 400)
+        self.assertNotIn("ETag", res)
+
+
+class LocaliserViewTestCase(ViewTestCase):
+    view_class = LocaliserView
+
+    def point_dans(self, commune):
+        point = commune.geometry.point_on_surface
+        return point.y, point.x
+
+    def test_localiser_point(self):
+        etalans = Commune.objects.select_related("departement__region", "epci").get(
+            type="COM", code="25222"
+        )
+        latitude, longitude = self.point_dans(etalans)
+
+        req = self.factory.get(
+            f"/localiser/?{self.query_builder({'latitude': latitude, 'longitude': longitude})}"
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(results["commune"], {"code": "25222", "nom": "Étalans"})
+        self.assertIsNone(results["subdivision"])
+        self.assertEqual(results["epci"]["code"], etalans.epci.code)
+        self.assertEqual(results["departement"], {"code": "25", "nom": "Doubs"})
+        self.assertEqual(
+            results["region"]["code"], etalans.departement.region.code
+        )
+
+    def test_parametres_invalides(self):
+        req = self.factory.get(
+            f"/localiser/?{self.query_builder({'latitude': '91', 'longitude': 'a'})}"
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 400)
+        self.assertCountEqual(results["errors"], ["latitude", "longitude"])
+
+
+class LocaliserLotViewTestCase(ViewTestCase):
+    view_class = LocaliserLotView
+
+    def test_localiser_plusieurs_points(self):
+        arrondissement = Commune.objects.get(type="ARM", code="75113")
+        point = arrondissement.geometry.point_on_surface
+
+        req = self.factory.post(
+            "/localiser/lot/",
+            data=json.dumps(
+                [
+                    {"latitude": point.y, "longitude": point.x},
+                    {"latitude": 0, "longitude": 0},
+                ]
+            ),
+            content_type="application/json",
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 200)
+        paris, large = results["results"]
+
+        self.assertEqual(paris["commune"]["code"], "75056")
+        self.assertEqual(paris["subdivision"]["code"], "75113")
+        self.assertEqual(paris["subdivision"]["type"], "ARM")
+        self.assertEqual(paris["departement"]["code"], "75")
+
+        self.assertTrue(all(v is None for v in large.values()))
+
+    def test_trop_de_points(self):
+        req = self.factory.post(
+            "/localiser/lot/",
+            data=json.dumps([{"latitude": 0, "longitude": 0}] * 1001),
+            content_type="application/json",
+        )
+        status, results = self.get_status_json(self.view(req))
+
+        self.assertEqual(status, 400)
+        self.assertCountEqual(results["errors"], ["points"])